@@ -0,0 +1,788 @@
+#!/usr/bin/env python3
+"""
+Benchmarks for MIA for All system
+Runs against a local stand-in Ollama server, no real model needed
+"""
+
+import sys
+import os
+import json
+import time
+import asyncio
+import argparse
+import threading
+import logging
+import contextlib
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# Add the current directory to Python path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+FAKE_RESPONSE = "Pozdravljen! Sem MIA, tvoja osebna asistentka. Kako ti lahko pomagam danes?"
+
+class FakeOllamaHandler(BaseHTTPRequestHandler):
+    """Minimal Ollama API: /api/tags, /api/embed and /api/generate (streaming and not)"""
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, data, status=200):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_json(self):
+        length = int(self.headers.get("Content-Length", 0))
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def do_GET(self):
+        if self.path == "/api/tags":
+            self._send_json({"models": [{"name": f"{name}:latest"} for name in self.server.models]})
+        else:
+            self._send_json({"error": "not found"}, status=404)
+
+    def do_POST(self):
+        payload = self._read_json()
+        if self.path == "/api/embed":
+            self._embed(payload)
+            return
+        if self.path != "/api/generate":
+            self._send_json({"error": "not found"}, status=404)
+            return
+
+        server = self.server
+        server.requests += 1
+        # Like OLLAMA_NUM_PARALLEL: requests beyond the limit wait for a free slot
+        with server.slots:
+            self._generate(payload)
+
+    def _embed(self, payload):
+        import hashlib
+
+        server = self.server
+        server.embed_requests += 1
+        if server.embed_models is not None and payload.get("model") not in server.embed_models:
+            self._send_json({"error": f"model \"{payload.get('model')}\" not found"}, status=404)
+            return
+        if server.embed_failures > 0:
+            # Like an Ollama that is still starting up
+            server.embed_failures -= 1
+            self._send_json({"error": "server busy"}, status=500)
+            return
+        texts = payload.get("input", [])
+        texts = [texts] if isinstance(texts, str) else texts
+        time.sleep(server.embed_delay)
+        # Deterministic pseudo-embeddings: the same text always maps to the same vector
+        embeddings = [[b / 255 for b in hashlib.sha256(text.encode()).digest()[:16]] for text in texts]
+        self._send_json({"model": payload.get("model"), "embeddings": embeddings})
+
+    def _generate(self, payload):
+        server = self.server
+        tokens = [word + " " for word in FAKE_RESPONSE.split(" ")]
+        tokens = tokens[:payload.get("options", {}).get("num_predict", len(tokens))]
+        # The first request for a model pays its load, like a cold Ollama
+        load_delay = 0.0
+        with server.lock:
+            if payload.get("model") not in server.loaded:
+                server.loaded.add(payload.get("model"))
+                load_delay = server.load_delay
+        time.sleep(load_delay)
+        final = {
+            "model": payload.get("model"),
+            "done": True,
+            "context": list(range(len(payload.get("prompt", "")) % 64 + 1)),
+            "prompt_eval_count": len(payload.get("prompt", "").split()),
+            "prompt_eval_duration": int(server.first_token_delay * 1e9),
+            "eval_count": len(tokens),
+            "eval_duration": int(len(tokens) * server.token_delay * 1e9),
+            "load_duration": int(load_delay * 1e9),
+        }
+
+        if not payload.get("stream", True):
+            time.sleep(server.first_token_delay + len(tokens) * server.token_delay)
+            self._send_json({**final, "response": "".join(tokens)})
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        time.sleep(server.first_token_delay)
+        for token in tokens:
+            self._write_chunk({"model": payload.get("model"), "response": token, "done": False})
+            time.sleep(server.token_delay)
+        self._write_chunk({**final, "response": ""})
+        self.wfile.write(b"0\r\n\r\n")
+
+    def _write_chunk(self, data):
+        line = (json.dumps(data) + "\n").encode()
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(line), line))
+        self.wfile.flush()
+
+class _QuietHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Clients hanging up mid-stream (barge-in, cancelled turns) are expected
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+class FakeOllamaServer:
+    """Local stand-in for the Ollama HTTP server, run on a background thread"""
+
+    def __init__(self, first_token_delay=0.05, token_delay=0.005, models=("mistral",), load_delay=0.0,
+                 parallel=None, embed_delay=0.01, embed_models=None, embed_failures=0):
+        self.httpd = _QuietHTTPServer(("127.0.0.1", 0), FakeOllamaHandler)
+        # None serves every embedding model; a list makes the others answer 404
+        self.httpd.embed_models = embed_models
+        self.httpd.embed_failures = embed_failures
+        self.httpd.slots = threading.BoundedSemaphore(parallel) if parallel else contextlib.nullcontext()
+        self.httpd.embed_delay = embed_delay
+        self.httpd.embed_requests = 0
+        self.httpd.first_token_delay = first_token_delay
+        self.httpd.token_delay = token_delay
+        self.httpd.models = list(models)
+        self.httpd.load_delay = load_delay
+        self.httpd.loaded = set()
+        self.httpd.lock = threading.Lock()
+        self.httpd.requests = 0
+        self.thread = None
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.httpd.server_port}"
+
+    @property
+    def requests(self) -> int:
+        return self.httpd.requests
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+def benchmark_sessions(sessions=50, turns=3, max_concurrency=16, first_token_delay=0.05, token_delay=0.005):
+    """Concurrent sessions through AsyncConversationEngine, reported as sessions/sec"""
+    from mia_server import AsyncConversationEngine
+
+    async def run(url):
+        engine = AsyncConversationEngine(url, max_concurrency=max_concurrency)
+        await engine.start()
+
+        async def session_worker():
+            session_id = engine.create_session()
+            for turn in range(turns):
+                await engine.process_input(session_id, f"Vprašanje številka {turn}")
+
+        start = time.perf_counter()
+        await asyncio.gather(*(session_worker() for _ in range(sessions)))
+        elapsed = time.perf_counter() - start
+        stats = engine.stats()
+        await engine.close()
+        return elapsed, stats
+
+    with FakeOllamaServer(first_token_delay, token_delay) as server:
+        elapsed, stats = asyncio.run(run(server.url))
+
+    return {
+        "sessions": sessions,
+        "turns_per_session": turns,
+        "max_concurrency": max_concurrency,
+        "elapsed_s": round(elapsed, 3),
+        "sessions_per_s": round(sessions / elapsed, 2),
+        "turns_per_s": round(sessions * turns / elapsed, 2),
+        "peak_in_flight": stats["ollama"]["peak_in_flight"],
+    }
+
+def synthetic_utterances(count=20, rate=16000, seed=0):
+    """Low-level background noise with voiced bursts of random length, as int16 PCM"""
+    import numpy as np
+
+    rng = np.random.default_rng(seed)
+    pieces = []
+    for _ in range(count):
+        pieces.append(rng.normal(0, 30, int(rate * rng.uniform(0.8, 1.5))))
+        duration = rng.uniform(0.8, 3.0)
+        t = np.arange(int(rate * duration)) / rate
+        f0 = rng.uniform(110, 220)
+        voiced = sum(np.sin(2 * np.pi * f0 * h * t) / h for h in range(1, 5))
+        envelope = 0.6 + 0.4 * np.sin(2 * np.pi * 3 * t)
+        pieces.append(3000 * voiced * envelope + rng.normal(0, 30, t.size))
+    pieces.append(rng.normal(0, 30, rate))
+    return np.clip(np.concatenate(pieces), -32768, 32767).astype(np.int16).tobytes()
+
+def benchmark_vad(count=20, chunk=1024):
+    """Utterance endpointing on synthetic audio versus the fixed 5 s recording window"""
+    from mia_system import VoiceActivityDetector
+
+    audio = synthetic_utterances(count)
+    step = chunk * 2
+    vad = VoiceActivityDetector()
+    start = time.perf_counter()
+    segments = list(vad.segments(audio[i:i + step] for i in range(0, len(audio), step)))
+    elapsed = time.perf_counter() - start
+    stats = vad.stats()
+
+    audio_s = len(audio) / 2 / vad.rate
+    return {
+        "utterances": count,
+        "segments": len(segments),
+        "audio_s": round(audio_s, 2),
+        "realtime_factor": round(elapsed / audio_s, 5),
+        "avg_turn_start_s": round(stats["avg_turn_start_s"], 3),
+        "fixed_window_s": vad.fixed_window_s,
+        "avg_saved_s": round(stats["avg_saved_s"], 3),
+    }
+
+def benchmark_stt(seconds=20.0, chunk=1024):
+    """Speech-to-text real-time factor on CPU for 16 kHz int16 audio, batch and streaming"""
+    from mia_system import SpeechToText
+
+    stt = SpeechToText()
+    audio = synthetic_utterances(count=8)[:int(seconds * stt.rate) * 2]
+    audio_s = len(audio) / 2 / stt.rate
+
+    # The first call pays the model load, later calls hit the cached model
+    start = time.perf_counter()
+    stt.transcribe(audio[:stt.rate * 2])
+    first_call_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    stt.transcribe(audio)
+    batch_s = time.perf_counter() - start
+
+    step = chunk * 2
+    partials = 0
+    start = time.perf_counter()
+    for _, is_final in stt.transcribe_stream(audio[i:i + step] for i in range(0, len(audio), step)):
+        partials += not is_final
+    stream_s = time.perf_counter() - start
+
+    return {
+        "backend": stt.backend.name,
+        "audio_s": round(audio_s, 2),
+        "first_call_s": round(first_call_s, 3),
+        "batch_rtf": round(batch_s / audio_s, 4),
+        "stream_rtf": round(stream_s / audio_s, 4),
+        "partial_hypotheses": partials,
+    }
+
+def benchmark_history_memory(turns=100_000, capacity=1000):
+    """Peak and retained memory of 100k turns: list of dicts versus the bounded ring buffer"""
+    import tempfile
+    import tracemalloc
+    from datetime import datetime
+    from mia_system import ConversationHistory
+
+    def measure(fill):
+        tracemalloc.start()
+        kept = fill()
+        retained, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        del kept
+        return retained, peak
+
+    def dict_history():
+        # The previous layout: one dict per turn in the module history and a copy in Memory
+        history, memory = [], []
+        for i in range(turns):
+            exchange = {"user": f"Vprašanje {i}", "response": f"Odgovor {i}", "timestamp": datetime.now().isoformat()}
+            history.append(exchange)
+            memory.append(dict(exchange))
+        return history, memory
+
+    with tempfile.TemporaryDirectory() as directory:
+        def ring_history():
+            history = ConversationHistory(capacity, spill_path=os.path.join(directory, "history.jsonl"))
+            for i in range(turns):
+                history.append(f"Vprašanje {i}", f"Odgovor {i}")
+            return history
+
+        list_retained, list_peak = measure(dict_history)
+        ring_retained, ring_peak = measure(ring_history)
+
+    return {
+        "turns": turns,
+        "capacity": capacity,
+        "list_retained_mb": round(list_retained / 2**20, 2),
+        "list_peak_mb": round(list_peak / 2**20, 2),
+        "ring_retained_mb": round(ring_retained / 2**20, 2),
+        "ring_peak_mb": round(ring_peak / 2**20, 2),
+    }
+
+def benchmark_warmup(load_delay=2.0, first_token_delay=0.05, token_delay=0.005):
+    """Cold vs. warm first-token latency with a simulated model load"""
+    from mia_system import OllamaClient, ModelWarmup
+
+    with FakeOllamaServer(first_token_delay, token_delay, load_delay=load_delay) as server:
+        warmup = ModelWarmup(OllamaClient(server.url))
+        report = warmup.warm_up(["mistral"])["mistral"]
+
+    return {"simulated_load_s": load_delay, **report}
+
+STARTUP_PROBE = """
+import sys, time, json, logging
+sys.path.insert(0, {directory!r})
+start = time.perf_counter()
+import mia_system
+import_s = time.perf_counter() - start
+logging.getLogger("MIA_for_All").setLevel(logging.WARNING)
+start = time.perf_counter()
+mia_system.MIA_System(data_dir="data", cache_dir="cache", config_dir="config")
+construct_s = time.perf_counter() - start
+heavy = [name for name in ("torch", "cv2", "pyaudio", "whisper") if name in sys.modules]
+print(json.dumps({{"import_s": import_s, "construct_s": construct_s, "heavy_modules": heavy}}))
+"""
+
+def benchmark_startup(load_delay=1.0):
+    """Cold import and construction in a fresh interpreter, then sequential vs. parallel initialization"""
+    import subprocess
+    import tempfile
+    from mia_system import MIA_System, AudioDevice, InMemoryAudioBackend, TextToSpeech
+
+    directory = os.path.dirname(os.path.abspath(__file__))
+    with tempfile.TemporaryDirectory() as cwd:
+        # A fresh process, so nothing is already imported; cwd keeps its log file and data out of the tree
+        output = subprocess.run([sys.executable, "-c", STARTUP_PROBE.format(directory=directory)],
+                                cwd=cwd, capture_output=True, text=True, check=True).stdout
+    probe = json.loads(output.strip().splitlines()[-1])
+
+    def initialize(max_workers):
+        with FakeOllamaServer(load_delay=load_delay) as server, tempfile.TemporaryDirectory() as data_dir:
+            mia = MIA_System(ollama_url=server.url, data_dir=os.path.join(data_dir, "data"), cache_dir=data_dir, config_dir=data_dir)
+            mia.audio_video.audio_device = AudioDevice(backend=InMemoryAudioBackend())
+            mia.audio_video.tts = TextToSpeech(use_cache=False)
+            start = time.perf_counter()
+            mia.initialize_system(max_workers=max_workers)
+            elapsed = time.perf_counter() - start
+            mia.journal.close()
+            return elapsed
+
+    sequential_s = initialize(1)
+    parallel_s = initialize(4)
+    return {
+        "import_s": round(probe["import_s"], 3),
+        "construct_s": round(probe["construct_s"], 3),
+        "heavy_modules_loaded": probe["heavy_modules"],
+        "init_sequential_s": round(sequential_s, 3),
+        "init_parallel_s": round(parallel_s, 3),
+    }
+
+def benchmark_video(frames=240, width=640, height=480, batch_size=16):
+    """Video analysis throughput in frames/sec, frame by frame versus batched"""
+    import numpy as np
+    from mia_system import VideoProcessor, SyntheticFrameSource
+
+    source = SyntheticFrameSource(width, height)
+    shape = source.open()
+    clip = []
+    for i in range(frames):
+        frame = np.empty(shape, dtype=np.uint8)
+        source.read_into(frame)
+        # Every other stretch of the clip is a still scene, which should be skipped
+        clip.append(clip[-1] if (i // 20) % 2 and clip else frame)
+
+    def run(size):
+        processor = VideoProcessor()
+        start = time.perf_counter()
+        for i in range(0, frames, size):
+            processor.analyze_batch(clip[i:i + size])
+        elapsed = time.perf_counter() - start
+        processor.pool.shutdown()
+        return elapsed, processor.stats()
+
+    single_s, stats = run(1)
+    batch_s, _ = run(batch_size)
+    return {
+        "frames": frames,
+        "resolution": f"{width}x{height}",
+        "detectors": stats["detectors"],
+        "skipped_frames": stats["skipped"],
+        "single_fps": round(frames / single_s, 1),
+        "batch_size": batch_size,
+        "batch_fps": round(frames / batch_s, 1),
+    }
+
+def synthetic_wav(seed=0, rate=16000) -> bytes:
+    """One synthetic utterance as a 16 kHz mono WAV file"""
+    import wave
+    from io import BytesIO
+
+    buffer = BytesIO()
+    with wave.open(buffer, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(rate)
+        wav.writeframes(synthetic_utterances(count=1, rate=rate, seed=seed))
+    return buffer.getvalue()
+
+def percentiles(samples, prefix: str) -> dict:
+    """p50/p95/p99 of durations in seconds, reported in milliseconds"""
+    import numpy as np
+
+    if not samples:
+        return {}
+    p50, p95, p99 = np.percentile(np.asarray(samples) * 1000, [50, 95, 99])
+    return {f"{prefix}_p50_ms": round(p50, 1), f"{prefix}_p95_ms": round(p95, 1), f"{prefix}_p99_ms": round(p99, 1)}
+
+def benchmark_e2e(turns=30, first_token_delay=0.05, token_delay=0.005, vision_every=5):
+    """Whole turns: synthetic WAV through listen/STT/LLM/TTS/playback, text turns and camera frames to the vision model"""
+    import wave
+    from io import BytesIO
+    from mia_system import (AudioVideoInterface, AudioDevice, InMemoryAudioBackend, ConversationModule,
+                            OllamaClient, STTBackend, SpeechToText, DummyTTSBackend, TextToSpeech,
+                            Camera, SyntheticFrameSource, FrameEncoder)
+
+    class ScriptedSTTBackend(STTBackend):
+        # A different question every turn, so no turn is answered from a cache
+        name = "scripted"
+
+        def __init__(self):
+            self.turn = 0
+
+        def transcribe(self, samples, rate):
+            self.turn += 1
+            return f"Vprašanje številka {self.turn}: kaj mi priporočaš za danes?"
+
+    utterances = []
+    for seed in range(turns):
+        with wave.open(BytesIO(synthetic_wav(seed))) as wav:
+            utterances.append(wav.readframes(wav.getnframes()))
+
+    backend = InMemoryAudioBackend()
+    audio_video = AudioVideoInterface(audio_device=AudioDevice(backend=backend))
+    audio_video.stt = SpeechToText(backend=ScriptedSTTBackend())
+    audio_video.tts = TextToSpeech(backend=DummyTTSBackend(), use_cache=False)
+    audio_video.camera = Camera(source=SyntheticFrameSource(640, 480))
+    encoder = FrameEncoder()
+
+    voice, text, vision, first_token, first_audio = [], [], [], [], []
+    with FakeOllamaServer(first_token_delay, token_delay, models=("mistral", "llava")) as server:
+        conversation = ConversationModule(server.url, client=OllamaClient(server.url))
+        stream = conversation._stream_response_with_ollama
+
+        def timed_stream(*args, **kwargs):
+            # Client-side time to first token, including the HTTP round trip
+            start = time.perf_counter()
+            for i, token in enumerate(stream(*args, **kwargs)):
+                if i == 0:
+                    first_token.append(time.perf_counter() - start)
+                yield token
+        conversation._stream_response_with_ollama = timed_stream
+
+        start_all = time.perf_counter()
+        for turn, utterance in enumerate(utterances):
+            # Spoken turn, timed from the end of the user's speech being available to the end of playback
+            backend.feed(utterance)
+            start = time.perf_counter()
+            question = audio_video.listen()
+            heard = time.perf_counter() - start
+            audio_video.speak_stream(conversation.stream_input(question, modality="audio"))
+            voice.append(time.perf_counter() - start)
+            if audio_video.last_time_to_first_audio is not None:
+                first_audio.append(heard + audio_video.last_time_to_first_audio)
+
+            start = time.perf_counter()
+            conversation.process_input(f"Napiši povzetek točke {turn}.")
+            text.append(time.perf_counter() - start)
+
+            if vision_every and turn % vision_every == 0:
+                start = time.perf_counter()
+                frame = audio_video.capture_video()
+                audio_video.process_video(frame)
+                images = [image for _, image in encoder.prepare([frame])]
+                conversation.process_input("Kaj vidiš na sliki?", modality="image", images=images)
+                vision.append(time.perf_counter() - start)
+        elapsed = time.perf_counter() - start_all
+        requests = server.requests
+
+    audio_video.camera.capture_thread.stop()
+    audio_video.audio_device.close()
+    completed = len(voice) + len(text) + len(vision)
+    return {
+        "turns": completed,
+        "token_rate": round(1 / token_delay, 1) if token_delay else None,
+        "first_token_delay": first_token_delay,
+        "llm_requests": requests,
+        **percentiles(voice + text + vision, "turn"),
+        **percentiles(voice, "voice_turn"),
+        **percentiles(text, "text_turn"),
+        **percentiles(vision, "vision_turn"),
+        **percentiles(first_token, "ttft"),
+        **percentiles(first_audio, "ttfa"),
+        "turns_per_s": round(completed / elapsed, 2),
+    }
+
+def benchmark_scheduler(turns=10, background=6, parallel=2, first_token_delay=0.05, token_delay=0.005,
+                        concurrent_embeds=32):
+    """Interactive turn latency under background load, with and without the request scheduler"""
+    from concurrent.futures import ThreadPoolExecutor
+    from mia_system import OllamaClient, RequestScheduler
+
+    def run(scheduler):
+        with FakeOllamaServer(first_token_delay, token_delay, parallel=parallel) as server:
+            client = OllamaClient(server.url, pool_size=background + concurrent_embeds, scheduler=scheduler)
+            stop = threading.Event()
+
+            def background_worker(worker):
+                # Rolling summaries and memory indexing, back to back
+                i = 0
+                while not stop.is_set():
+                    client.post("/api/generate", json={"model": "mistral", "prompt": f"Povzetek {worker}/{i}",
+                                                       "stream": False}, priority=RequestScheduler.BACKGROUND)
+                    i += 1
+
+            latencies = []
+            with ThreadPoolExecutor(background) as pool:
+                for worker in range(background):
+                    pool.submit(background_worker, worker)
+                time.sleep(0.2)
+                for turn in range(turns):
+                    start = time.perf_counter()
+                    client.post("/api/generate", json={"model": "mistral", "prompt": f"Vprašanje {turn}", "stream": False})
+                    latencies.append(time.perf_counter() - start)
+                stop.set()
+
+            # Many callers at once: one identical prompt, and single-text embeddings
+            requests_before = server.requests
+            with ThreadPoolExecutor(8) as pool:
+                list(pool.map(lambda _: client.post("/api/generate", json={"model": "mistral", "prompt": "Živjo",
+                                                                           "stream": False}), range(8)))
+            duplicate_requests = server.requests - requests_before
+            with ThreadPoolExecutor(concurrent_embeds) as pool:
+                list(pool.map(lambda i: client.embed("nomic-embed-text", [f"spomin {i}"]), range(concurrent_embeds)))
+            return latencies, duplicate_requests, server.httpd.embed_requests
+
+    direct, direct_duplicates, direct_embeds = run(None)
+    scheduler = RequestScheduler(max_concurrency=parallel)
+    scheduled, scheduled_duplicates, scheduled_embeds = run(scheduler)
+    stats = scheduler.stats()
+    return {
+        "background_workers": background,
+        "ollama_parallel": parallel,
+        **percentiles(direct, "direct_turn"),
+        **percentiles(scheduled, "scheduled_turn"),
+        "interactive_wait_p95_ms": stats["interactive"]["wait_p95_ms"],
+        "background_wait_p95_ms": stats["background"]["wait_p95_ms"],
+        "duplicate_prompt_requests_direct": direct_duplicates,
+        "duplicate_prompt_requests_scheduled": scheduled_duplicates,
+        "embed_requests_direct": direct_embeds,
+        "embed_requests_scheduled": scheduled_embeds,
+    }
+
+INTENT_TURNS = [
+    "pomoč", "Kaj znaš?", "video", "Kaj vidiš?", "opiši sliko", "analiziraj posnetek prosim",
+    "Kakšno bo vreme jutri v Ljubljani?", "Povej mi vic.", "Kaj priporočaš za večerjo?",
+    "Razloži mi, kako deluje fotosinteza.", "Rad bi se pogovoril o vremenu in jutrišnjem izletu",
+    "Koliko prebivalcev ima Slovenija?",
+]
+
+def benchmark_intents(repeat=200):
+    """Intent routing latency for command and chat turns, and how many turns skip the LLM"""
+    from mia_system import IntentRouter
+
+    router = IntentRouter()
+    timings = {"command": [], "chat": []}
+    for _ in range(repeat):
+        for text in INTENT_TURNS:
+            start = time.perf_counter()
+            routed = router.route(text)
+            timings["chat" if routed is None else "command"].append(time.perf_counter() - start)
+
+    stats = router.stats()
+    routed = sum(stats["routed"].values())
+    return {
+        "turns": routed + stats["passed_to_llm"],
+        "routed_share": round(routed / (routed + stats["passed_to_llm"]), 3),
+        "command_route_us": round(sum(timings["command"]) / max(len(timings["command"]), 1) * 1e6, 1),
+        "chat_route_us": round(sum(timings["chat"]) / max(len(timings["chat"]), 1) * 1e6, 1),
+    }
+
+def benchmark_journal(turns=10_000, snapshot_every=500):
+    """Session journal cost on the turn path and resume time after a long session"""
+    import tempfile
+    from mia_system import MIA_System, ConversationHistory
+
+    plain = ConversationHistory()
+    start = time.perf_counter()
+    for i in range(turns):
+        plain.append(f"Vprašanje {i}", f"Odgovor {i}")
+    plain_s = time.perf_counter() - start
+
+    with tempfile.TemporaryDirectory() as directory:
+        mia = MIA_System(data_dir=os.path.join(directory, "data"), cache_dir=directory, config_dir=directory)
+        mia.journal.snapshot_every = snapshot_every
+        history = mia.conversation.conversation_history
+        start = time.perf_counter()
+        for i in range(turns):
+            history.append(f"Vprašanje {i}", f"Odgovor {i}")
+        journaled_s = time.perf_counter() - start
+        mia.journal.close()
+        journal_kb = os.path.getsize(mia.journal.journal_path) / 1024
+        snapshot_kb = os.path.getsize(mia.journal.snapshot_path) / 1024
+
+        start = time.perf_counter()
+        resumed = MIA_System(data_dir=os.path.join(directory, "data"), cache_dir=directory, config_dir=directory)
+        resume_s = time.perf_counter() - start
+        restored = len(resumed.conversation.conversation_history)
+        resumed.journal.close()
+
+    return {
+        "turns": turns,
+        "restored_turns": restored,
+        "plain_append_us": round(plain_s / turns * 1e6, 2),
+        "journaled_append_us": round(journaled_s / turns * 1e6, 2),
+        "snapshot_kb": round(snapshot_kb, 1),
+        "journal_tail_kb": round(journal_kb, 1),
+        "resume_ms": round(resume_s * 1000, 1),
+    }
+
+def benchmark_encryption(megabytes=16, mic_chunk=4096, records=2000):
+    """At-rest encryption throughput (MB/s) for whole recordings and streamed mic chunks, plus per-record cost"""
+    import tempfile
+    import numpy as np
+    from mia_system import Encryption
+
+    pcm = np.random.default_rng(0).integers(-3000, 3000, megabytes * 1024 * 1024 // 2, dtype=np.int16)
+    size_mb = pcm.nbytes / (1024 * 1024)
+    with tempfile.TemporaryDirectory() as directory:
+        key_path = os.path.join(directory, "master.key")
+        start = time.perf_counter()
+        encryption = Encryption(key_path=key_path)
+        encryption.cipher("audio")
+        first_key_s = time.perf_counter() - start
+        start = time.perf_counter()
+        for _ in range(100):
+            encryption.cipher("audio")
+        cached_key_s = (time.perf_counter() - start) / 100
+
+        start = time.perf_counter()
+        sealed = encryption.encrypt(pcm, "audio")
+        encrypt_s = time.perf_counter() - start
+        start = time.perf_counter()
+        opened = encryption.decrypt(sealed, "audio")
+        decrypt_s = time.perf_counter() - start
+        assert opened == pcm.tobytes()
+
+        # Microphone-sized buffers as they arrive during recording
+        view = memoryview(pcm).cast("B")
+        encryptor = encryption.encryptor("audio")
+        start = time.perf_counter()
+        for offset in range(0, len(view), mic_chunk):
+            encryptor.update(view[offset:offset + mic_chunk])
+        encryptor.finalize()
+        stream_s = time.perf_counter() - start
+
+        record = json.dumps({"seq": 1, "kind": "turn", "user": "Kakšno bo vreme jutri?",
+                             "response": "Jutri bo sončno in toplo."}, ensure_ascii=False)
+        start = time.perf_counter()
+        for _ in range(records):
+            encryption.seal_text(record, "journal")
+        record_s = (time.perf_counter() - start) / records
+
+    return {
+        "size_mb": round(size_mb, 1),
+        "encrypt_mb_per_s": round(size_mb / encrypt_s, 1),
+        "decrypt_mb_per_s": round(size_mb / decrypt_s, 1),
+        "stream_encrypt_mb_per_s": round(size_mb / stream_s, 1),
+        "overhead_bytes": len(sealed) - pcm.nbytes,
+        "record_seal_us": round(record_s * 1e6, 2),
+        "first_key_ms": round(first_key_s * 1000, 3),
+        "cached_key_us": round(cached_key_s * 1e6, 2),
+    }
+
+BENCHMARKS = {
+    "sessions": benchmark_sessions,
+    "vad": benchmark_vad,
+    "stt": benchmark_stt,
+    "history_memory": benchmark_history_memory,
+    "warmup": benchmark_warmup,
+    "startup": benchmark_startup,
+    "video": benchmark_video,
+    "e2e": benchmark_e2e,
+    "scheduler": benchmark_scheduler,
+    "intents": benchmark_intents,
+    "journal": benchmark_journal,
+    "encryption": benchmark_encryption,
+}
+
+# Result keys are compared by suffix: throughputs should not drop, durations and sizes should not grow
+HIGHER_IS_BETTER = ("_per_s", "_fps")
+LOWER_IS_BETTER = ("_us", "_ms", "_s", "_mb", "_rtf")
+
+def compare_results(baseline: dict, results: dict, tolerance=0.2) -> list:
+    """Metrics that got worse than the baseline by more than tolerance (a fraction)"""
+    regressions = []
+    for name, result in results.items():
+        for key, value in result.items():
+            old = baseline.get(name, {}).get(key)
+            if isinstance(value, bool) or not isinstance(value, (int, float)) or not isinstance(old, (int, float)) or not old:
+                continue
+            if key.endswith(HIGHER_IS_BETTER):
+                change = (old - value) / old
+            elif key.endswith(LOWER_IS_BETTER):
+                change = (value - old) / old
+            else:
+                continue
+            if change > tolerance:
+                regressions.append(f"{name}.{key}: {old} -> {value} ({change:+.0%} worse)")
+    return regressions
+
+def main():
+    """Run the selected benchmarks and print the results as JSON"""
+    import inspect
+
+    parser = argparse.ArgumentParser(description="MIA for All benchmarks")
+    parser.add_argument("benchmarks", nargs="*", help=f"benchmarks to run: {', '.join(BENCHMARKS)} (default: all)")
+    parser.add_argument("--tokens-per-s", type=float, help="token rate of the fake Ollama server")
+    parser.add_argument("--first-token-delay", type=float, help="first-token delay of the fake Ollama server in seconds")
+    parser.add_argument("--save-baseline", metavar="FILE", help="write the results to FILE as a baseline")
+    parser.add_argument("--baseline", metavar="FILE", help="compare the results with a saved baseline")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed slowdown against the baseline (default 0.2)")
+    args = parser.parse_args()
+    unknown = [name for name in args.benchmarks if name not in BENCHMARKS]
+    if unknown:
+        parser.error(f"unknown benchmarks: {', '.join(unknown)}")
+
+    overrides = {}
+    if args.tokens_per_s:
+        overrides["token_delay"] = 1 / args.tokens_per_s
+    if args.first_token_delay is not None:
+        overrides["first_token_delay"] = args.first_token_delay
+
+    logging.getLogger("MIA_for_All").setLevel(logging.WARNING)
+    results = {}
+    for name in args.benchmarks or list(BENCHMARKS):
+        benchmark = BENCHMARKS[name]
+        parameters = inspect.signature(benchmark).parameters
+        results[name] = benchmark(**{key: value for key, value in overrides.items() if key in parameters})
+        print(json.dumps({"benchmark": name, **results[name]}))
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare_results(json.load(f), results, args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
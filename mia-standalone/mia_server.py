@@ -0,0 +1,315 @@
+#!/usr/bin/env python3
+"""
+MIA for All - Async multi-session server
+Serves many text conversations from one process over HTTP and WebSocket
+"""
+
+import sys
+import os
+import json
+import time
+import uuid
+import asyncio
+import argparse
+from typing import Dict, Any, Optional, AsyncIterator
+
+import aiohttp
+from aiohttp import web
+
+# Add the current directory to Python path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from mia_system import ConversationModule, SentenceSplitter, logger
+
+class AsyncOllamaClient:
+    """Async HTTP client for Ollama with a keep-alive pool and a concurrency limit"""
+
+    def __init__(self, base_url="http://localhost:11434", max_concurrency=8, pool_size=16,
+                 connect_timeout=3.05, read_timeout=30):
+        self.base_url = base_url.rstrip("/")
+        self.max_concurrency = max_concurrency
+        self.pool_size = pool_size
+        self.timeout = aiohttp.ClientTimeout(sock_connect=connect_timeout, sock_read=read_timeout)
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.session = None
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.requests = 0
+
+    async def start(self):
+        """Open the underlying HTTP session"""
+        if self.session is None:
+            connector = aiohttp.TCPConnector(limit=self.pool_size, keepalive_timeout=30)
+            self.session = aiohttp.ClientSession(connector=connector, timeout=self.timeout)
+
+    async def close(self):
+        """Close the underlying HTTP session"""
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    def _enter(self):
+        self.in_flight += 1
+        self.requests += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+
+    async def get(self, path: str) -> Dict[str, Any]:
+        """Send a GET request and return the decoded JSON body"""
+        await self.start()
+        async with self.session.get(f"{self.base_url}{path}") as response:
+            response.raise_for_status()
+            return await response.json()
+
+    async def generate(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        """Run a non-streaming /api/generate request"""
+        await self.start()
+        async with self.semaphore:
+            self._enter()
+            try:
+                async with self.session.post(f"{self.base_url}/api/generate",
+                                             json={**payload, "stream": False}) as response:
+                    response.raise_for_status()
+                    return await response.json(content_type=None)
+            finally:
+                self.in_flight -= 1
+
+    async def stream_generate(self, payload: Dict[str, Any]) -> AsyncIterator[Dict[str, Any]]:
+        """Yield the NDJSON chunks of a streaming /api/generate request"""
+        await self.start()
+        async with self.semaphore:
+            self._enter()
+            try:
+                async with self.session.post(f"{self.base_url}/api/generate",
+                                             json={**payload, "stream": True}) as response:
+                    response.raise_for_status()
+                    async for line in response.content:
+                        if line.strip():
+                            yield json.loads(line)
+            finally:
+                self.in_flight -= 1
+
+    def stats(self) -> Dict[str, int]:
+        """Request and concurrency counters"""
+        return {
+            "requests": self.requests,
+            "in_flight": self.in_flight,
+            "peak_in_flight": self.peak_in_flight,
+            "max_concurrency": self.max_concurrency
+        }
+
+class UnknownSessionError(KeyError):
+    """Raised for a session id that was never created or has expired"""
+
+class ConversationSession:
+    """State owned by a single user session"""
+
+    def __init__(self, session_id: str, ollama_url: str, mode: str):
+        self.session_id = session_id
+        # Each session keeps its own history, context manager and KV-cache tokens
+        self.conversation = ConversationModule(ollama_url=ollama_url, streaming=False, mode=mode)
+        self.lock = asyncio.Lock()
+        self.last_active = time.monotonic()
+
+class AsyncConversationEngine:
+    """Asyncio conversation engine serving many sessions concurrently"""
+
+    def __init__(self, ollama_url="http://localhost:11434", max_concurrency=8, mode="prompt",
+                 session_ttl=1800):
+        self.ollama_url = ollama_url
+        self.mode = mode
+        self.session_ttl = session_ttl
+        self.client = AsyncOllamaClient(ollama_url, max_concurrency=max_concurrency,
+                                        pool_size=max_concurrency * 2)
+        self.sessions: Dict[str, ConversationSession] = {}
+        self.turns = 0
+        logger.info(f"Async conversation engine initialized (max concurrency {max_concurrency})")
+
+    async def start(self):
+        """Start the engine"""
+        await self.client.start()
+
+    async def close(self):
+        """Stop the engine and release connections"""
+        await self.client.close()
+
+    def create_session(self) -> str:
+        """Create a new session and return its id"""
+        session_id = uuid.uuid4().hex
+        self.sessions[session_id] = ConversationSession(session_id, self.ollama_url, self.mode)
+        return session_id
+
+    def get_session(self, session_id: Optional[str]) -> ConversationSession:
+        """Return an existing session; sessions are only created by create_session()"""
+        session = self.sessions.get(session_id) if session_id else None
+        if session is None:
+            raise UnknownSessionError(session_id)
+        session.last_active = time.monotonic()
+        return session
+
+    def close_session(self, session_id: str):
+        """Drop a session and its history"""
+        self.sessions.pop(session_id, None)
+
+    def expire_sessions(self) -> int:
+        """Drop sessions idle for longer than the TTL"""
+        cutoff = time.monotonic() - self.session_ttl
+        expired = [sid for sid, s in self.sessions.items() if s.last_active < cutoff and not s.lock.locked()]
+        for session_id in expired:
+            del self.sessions[session_id]
+        return len(expired)
+
+    async def process_input(self, session_id: Optional[str], user_input: str) -> str:
+        """Process one turn for a session and return the full response"""
+        session = self.get_session(session_id)
+        conversation = session.conversation
+        # Building the prompt and recording the turn take locks and may summarize or
+        # write the memory store, so they run off the event loop
+        loop = asyncio.get_running_loop()
+        async with session.lock:
+            model, prompt, options = await loop.run_in_executor(None, conversation.prepare_turn, user_input)
+            try:
+                data = await self.client.generate({"model": model, "prompt": prompt, **options})
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                logger.error(f"Ollama connection error: {e}")
+                return ConversationModule.LLM_NOT_RUNNING
+
+            response = data.get("response", "Nisem razumel vašega vprašanja.")
+            await loop.run_in_executor(None, conversation.finish_turn, user_input, response, data)
+            self.turns += 1
+            return response
+
+    async def stream_input(self, session_id: Optional[str], user_input: str) -> AsyncIterator[str]:
+        """Process one turn for a session and yield the response sentence by sentence"""
+        session = self.get_session(session_id)
+        conversation = session.conversation
+        loop = asyncio.get_running_loop()
+        async with session.lock:
+            model, prompt, options = await loop.run_in_executor(None, conversation.prepare_turn, user_input)
+            splitter = SentenceSplitter()
+            chunks = []
+            final = None
+            try:
+                async for data in self.client.stream_generate({"model": model, "prompt": prompt, **options}):
+                    token = data.get("response", "")
+                    if token:
+                        chunks.append(token)
+                        for sentence in splitter.feed(token):
+                            yield sentence
+                    if data.get("done"):
+                        final = data
+                        break
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                logger.error(f"Ollama connection error: {e}")
+                yield ConversationModule.LLM_NOT_RUNNING
+                return
+
+            for sentence in splitter.flush():
+                yield sentence
+            await loop.run_in_executor(None, conversation.finish_turn, user_input, "".join(chunks), final)
+            self.turns += 1
+
+    def stats(self) -> Dict[str, Any]:
+        """Engine counters"""
+        return {"sessions": len(self.sessions), "turns": self.turns, "ollama": self.client.stats()}
+
+def create_app(engine: AsyncConversationEngine) -> web.Application:
+    """Build the HTTP/WebSocket front end for an engine"""
+    routes = web.RouteTableDef()
+
+    @routes.get("/health")
+    async def health(request):
+        return web.json_response({"status": "ok", **engine.stats()})
+
+    @routes.post("/sessions")
+    async def create_session(request):
+        return web.json_response({"session_id": engine.create_session()})
+
+    @routes.delete("/sessions/{session_id}")
+    async def close_session(request):
+        engine.close_session(request.match_info["session_id"])
+        return web.json_response({"status": "closed"})
+
+    @routes.post("/sessions/{session_id}/turns")
+    async def turn(request):
+        body = await request.json()
+        text = body.get("text", "").strip()
+        if not text:
+            raise web.HTTPBadRequest(text="Missing 'text'")
+        session_id = request.match_info["session_id"]
+        try:
+            response = await engine.process_input(session_id, text)
+        except UnknownSessionError:
+            raise web.HTTPNotFound(text="Unknown session")
+        return web.json_response({"session_id": session_id, "response": response})
+
+    @routes.get("/ws")
+    async def websocket(request):
+        # The session comes from POST /sessions; each message is {"text": ...} and the
+        # reply is streamed as "sentence" messages followed by one "done" message
+        session_id = request.query.get("session_id")
+        if session_id not in engine.sessions:
+            raise web.HTTPNotFound(text="Unknown session")
+        ws = web.WebSocketResponse(heartbeat=30)
+        await ws.prepare(request)
+        await ws.send_json({"type": "session", "session_id": session_id})
+
+        async for message in ws:
+            if message.type != aiohttp.WSMsgType.TEXT:
+                continue
+            try:
+                body = json.loads(message.data)
+            except ValueError:
+                body = {"text": message.data}
+            text = str(body.get("text", "")).strip()
+            if not text:
+                await ws.send_json({"type": "error", "error": "Missing 'text'"})
+                continue
+
+            sentences = []
+            try:
+                async for sentence in engine.stream_input(session_id, text):
+                    sentences.append(sentence)
+                    await ws.send_json({"type": "sentence", "text": sentence})
+            except UnknownSessionError:
+                # Expired while the socket was idle
+                await ws.send_json({"type": "error", "error": "Unknown session"})
+                break
+            await ws.send_json({"type": "done", "response": " ".join(sentences)})
+
+        return ws
+
+    async def expire_sessions(app):
+        async def loop():
+            while True:
+                await asyncio.sleep(60)
+                expired = engine.expire_sessions()
+                if expired:
+                    logger.info(f"Expired {expired} idle sessions")
+        app["expiry_task"] = asyncio.create_task(loop())
+
+    async def on_cleanup(app):
+        app["expiry_task"].cancel()
+        await engine.close()
+
+    app = web.Application()
+    app.add_routes(routes)
+    app.on_startup.append(expire_sessions)
+    app.on_cleanup.append(on_cleanup)
+    return app
+
+def main():
+    """Start the MIA multi-session server"""
+    parser = argparse.ArgumentParser(description="MIA for All multi-session server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--ollama-url", default="http://localhost:11434")
+    parser.add_argument("--max-concurrency", type=int, default=8)
+    parser.add_argument("--mode", choices=ConversationModule.MODES, default="prompt")
+    args = parser.parse_args()
+
+    engine = AsyncConversationEngine(args.ollama_url, max_concurrency=args.max_concurrency, mode=args.mode)
+    logger.info(f"Starting MIA for All server on http://{args.host}:{args.port}")
+    web.run_app(create_app(engine), host=args.host, port=args.port, print=None)
+
+if __name__ == "__main__":
+    main()
@@ -5,21 +5,29 @@ Standalone personal assistant using Ollama LLM server
 """
 
 import os
+import re
 import sys
 import json
 import time
+import queue
+import bisect
+import random
+import base64
+import hashlib
+import collections
 import threading
 import logging
+import sqlite3
 import requests
 from datetime import datetime
-from typing import Dict, List, Any, Optional
-import torch
+from concurrent.futures import ThreadPoolExecutor, Future, TimeoutError as FutureTimeoutError
+from functools import cached_property
+from typing import Dict, List, Any, Optional, Iterable, Iterator, Tuple
 import numpy as np
 
-# Audio/Video imports
-import pyaudio
+# Audio/Video imports; pyaudio, cv2 and torch are imported where they are first
+# needed so text-only use never loads them
 import wave
-import cv2
 from io import BytesIO
 
 # Setup logging
@@ -33,24 +41,247 @@ logging.basicConfig(
 )
 logger = logging.getLogger("MIA_for_All")
 
+# Sentence boundary used to cut streamed LLM output into speakable pieces
+SENTENCE_BOUNDARY = re.compile(r'(?<=[.!?…])\s+|\n+')
+
+# Word and punctuation pieces used for approximate token counting
+TOKEN_PIECE = re.compile(r'\w+|[^\w\s]')
+
+class _NullSpan:
+    """Span used while metrics are disabled; entering and leaving it costs nothing"""
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc):
+        return False
+
+_NULL_SPAN = _NullSpan()
+
+class _Span:
+    def __init__(self, metrics: "Metrics", stage: str, attrs: Dict[str, Any]):
+        self.metrics = metrics
+        self.stage = stage
+        self.attrs = attrs
+    
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+    
+    def __exit__(self, *exc):
+        self.metrics.observe(self.stage, time.perf_counter() - self.start, **self.attrs)
+        return False
+
+class Histogram:
+    """Cumulative-bucket latency histogram in seconds"""
+    
+    BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+    
+    def __init__(self, buckets: Tuple[float, ...] = BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+    
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+    
+    def quantile(self, q: float) -> float:
+        """Upper bound of the bucket holding the q-quantile"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets + (float("inf"),), self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+class Metrics:
+    """Per-stage timing spans collected into histograms, with a Prometheus text export and a JSON-lines trace"""
+    
+    def __init__(self, enabled=False, trace_path: Optional[str] = None):
+        self.enabled = enabled
+        self.histograms: Dict[str, Histogram] = {}
+        self.lock = threading.Lock()
+        self.trace_file = None
+        self.server = None
+        if trace_path:
+            self.open_trace(trace_path)
+    
+    def open_trace(self, path: str):
+        """Append one JSON line per span to path"""
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self.lock:
+            self.trace_file = open(path, "a", encoding="utf-8", buffering=64 * 1024)
+    
+    def span(self, stage: str, **attrs):
+        """Time the enclosed block as one observation of stage"""
+        if not self.enabled:
+            return _NULL_SPAN
+        return _Span(self, stage, attrs)
+    
+    def observe(self, stage: str, seconds: float, **attrs):
+        """Record a duration that was measured elsewhere (e.g. reported by Ollama)"""
+        if not self.enabled:
+            return
+        with self.lock:
+            histogram = self.histograms.get(stage)
+            if histogram is None:
+                histogram = self.histograms[stage] = Histogram()
+            histogram.observe(seconds)
+            if self.trace_file is not None:
+                record = {"ts": round(time.time(), 6), "stage": stage, "ms": round(seconds * 1000, 3), **attrs}
+                self.trace_file.write(json.dumps(record, ensure_ascii=False) + "\n")
+    
+    def prometheus(self) -> str:
+        """Histograms in the Prometheus text exposition format"""
+        lines = [
+            "# HELP mia_stage_seconds Time spent in each stage of a conversation turn",
+            "# TYPE mia_stage_seconds histogram"
+        ]
+        with self.lock:
+            for stage, histogram in sorted(self.histograms.items()):
+                cumulative = 0
+                for bound, count in zip(histogram.buckets + (float("inf"),), histogram.counts):
+                    cumulative += count
+                    le = "+Inf" if bound == float("inf") else f"{bound:g}"
+                    lines.append(f'mia_stage_seconds_bucket{{stage="{stage}",le="{le}"}} {cumulative}')
+                lines.append(f'mia_stage_seconds_sum{{stage="{stage}"}} {histogram.sum:.6f}')
+                lines.append(f'mia_stage_seconds_count{{stage="{stage}"}} {histogram.count}')
+        return "\n".join(lines) + "\n"
+    
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        """Count, mean and approximate p50/p95 per stage"""
+        with self.lock:
+            return {
+                stage: {
+                    "count": histogram.count,
+                    "mean_ms": round(histogram.sum / histogram.count * 1000, 1) if histogram.count else 0.0,
+                    "p50_le_s": histogram.quantile(0.5),
+                    "p95_le_s": histogram.quantile(0.95)
+                }
+                for stage, histogram in self.histograms.items()
+            }
+    
+    def serve(self, port=9464, host="127.0.0.1"):
+        """Serve /metrics over HTTP from a background thread"""
+        from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+        metrics = self
+        
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+            
+            def do_GET(self):
+                if self.path != "/metrics":
+                    self.send_error(404)
+                    return
+                body = metrics.prometheus().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+        
+        self.server = ThreadingHTTPServer((host, port), MetricsHandler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, name="mia-metrics", daemon=True).start()
+        logger.info(f"Metrics served at http://{host}:{self.server.server_port}/metrics")
+    
+    def close(self):
+        """Stop the endpoint and flush the trace"""
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+        with self.lock:
+            if self.trace_file is not None:
+                self.trace_file.close()
+                self.trace_file = None
+
+_metrics = Metrics()
+
+def get_metrics() -> Metrics:
+    """Return the process-wide metrics registry (disabled until configured)"""
+    return _metrics
+
+def configure_metrics(enabled=True, trace_path: Optional[str] = None, port: Optional[int] = None) -> Metrics:
+    """Turn on metrics, optionally with a JSON-lines trace file and a /metrics endpoint"""
+    _metrics.enabled = enabled
+    if trace_path:
+        _metrics.open_trace(trace_path)
+    if port is not None:
+        _metrics.serve(port)
+    return _metrics
+
 class AudioVideoInterface:
     """Audio/Video interface for MIA system"""
     
-    def __init__(self):
-        self.microphone = Microphone()
-        self.speaker = Speaker()
-        self.camera = Camera()
-        self.tts = TextToSpeech()
-        self.stt = SpeechToText()
-        self.video_processor = VideoProcessor()
+    def __init__(self, audio_device: Optional["AudioDevice"] = None, cache_dir: Optional[str] = None):
+        # Devices and engines are built on first use, so a text-only session
+        # never opens the camera or PortAudio
+        if audio_device is not None:
+            self.audio_device = audio_device
+        # Synthesized audio is cached under this directory (default ~/.cache/mia)
+        self.cache_dir = cache_dir
+        self.last_time_to_first_audio = None
         logger.info("Audio/Video interface initialized")
     
-    def listen(self) -> str:
-        """Listen to user input"""
+    @cached_property
+    def audio_device(self) -> "AudioDevice":
+        # Microphone and speaker share one device and its persistent streams
+        return get_audio_device()
+    
+    @cached_property
+    def microphone(self) -> "Microphone":
+        return Microphone(device=self.audio_device)
+    
+    @cached_property
+    def speaker(self) -> "Speaker":
+        return Speaker(device=self.audio_device)
+    
+    @cached_property
+    def camera(self) -> "Camera":
+        # Grabbed continuously in the background so a request gets a fresh frame at once
+        return Camera(threaded=True)
+    
+    @cached_property
+    def tts(self) -> "TextToSpeech":
+        if self.cache_dir is None:
+            return TextToSpeech()
+        return TextToSpeech(cache=TTSCache(os.path.join(self.cache_dir, "tts")))
+    
+    @cached_property
+    def stt(self) -> "SpeechToText":
+        return SpeechToText()
+    
+    @cached_property
+    def video_processor(self) -> "VideoProcessor":
+        return VideoProcessor()
+    
+    def listen(self, on_partial=None) -> str:
+        """Listen to user input, transcribing while the user is still speaking"""
         try:
             logger.info("Listening to user...")
-            audio_data = self.microphone.record()
-            text = self.stt.transcribe(audio_data)
+            # Skip audio captured while we were not listening (e.g. our own speech)
+            self.microphone.device.flush_input()
+            streams = self.microphone.utterance_streams()
+            text = ""
+            try:
+                with get_metrics().span("record"):
+                    utterance = next(streams, None)
+                    if utterance is not None:
+                        for text, is_final in self.stt.transcribe_stream(utterance):
+                            if not is_final and text:
+                                logger.info(f"Partial transcription: {text}")
+                                if on_partial is not None:
+                                    on_partial(text)
+            finally:
+                streams.close()
             logger.info(f"Transcribed text: {text}")
             return text
         except Exception as e:
@@ -66,6 +297,45 @@ class AudioVideoInterface:
         except Exception as e:
             logger.error(f"Error in speaking: {e}")
     
+    def speak_stream(self, sentences: Iterable[str]) -> str:
+        """Speak sentences as they arrive while the producer keeps generating"""
+        pending = queue.Queue()
+        start = time.perf_counter()
+        self.last_time_to_first_audio = None
+        
+        def produce():
+            try:
+                for sentence in sentences:
+                    pending.put(sentence)
+            except Exception as e:
+                logger.error(f"Error in response stream: {e}")
+            finally:
+                pending.put(None)
+        
+        producer = threading.Thread(target=produce, daemon=True)
+        producer.start()
+        
+        spoken = []
+        while True:
+            sentence = pending.get()
+            if sentence is None:
+                break
+            spoken.append(sentence)
+            try:
+                logger.info(f"Speaking: {sentence}")
+                audio_data = self.tts.synthesize(sentence)
+                if self.last_time_to_first_audio is None:
+                    self.last_time_to_first_audio = time.perf_counter() - start
+                    get_metrics().observe("first_audio", self.last_time_to_first_audio)
+                    logger.info(f"Time to first audio: {self.last_time_to_first_audio * 1000:.0f} ms")
+                self.speaker.play(audio_data)
+            except Exception as e:
+                logger.error(f"Error in speaking: {e}")
+        
+        producer.join()
+        logger.info(f"Streamed response spoken in {(time.perf_counter() - start) * 1000:.0f} ms")
+        return " ".join(spoken)
+    
     def capture_video(self) -> np.ndarray:
         """Capture video frame"""
         try:
@@ -76,6 +346,21 @@ class AudioVideoInterface:
             logger.error(f"Error in video capture: {e}")
             return None
     
+    def analyze_video_async(self, count=8) -> Future:
+        """Capture a short burst of frames and analyze it on the video worker pool"""
+        def job():
+            # Frames are shrunk as they arrive so camera buffers go back at once
+            frames, shapes = [], []
+            try:
+                for _ in range(count):
+                    frame = self.camera.capture(wait_new=True)
+                    shapes.append(frame.shape[:2])
+                    frames.append(self.video_processor.downsample(frame))
+            finally:
+                self.camera.release()
+            return self.video_processor.analyze_batch(frames, shapes)
+        return self.video_processor.pool.submit(job)
+    
     def process_video(self, frame: np.ndarray) -> Dict[str, Any]:
         """Process video frame"""
         try:
@@ -86,200 +371,2714 @@ class AudioVideoInterface:
             logger.error(f"Error in video processing: {e}")
             return {}
 
+class VoiceActivityDetector:
+    """Energy / zero-crossing voice activity detector for 16-bit mono PCM"""
+    
+    def __init__(self, rate=16000, frame_size=512, energy_threshold=300.0, max_zcr=0.35,
+                 noise_factor=3.0, preroll_ms=300, silence_ms=600, min_speech_ms=200,
+                 max_utterance_s=15.0, fixed_window_s=5.0, echo_factor=4.0, echo_tail_ms=300):
+        self.rate = rate
+        self.frame_size = frame_size
+        self.energy_threshold = energy_threshold
+        self.max_zcr = max_zcr
+        self.noise_factor = noise_factor
+        self.noise_floor = None
+        
+        frame_ms = 1000.0 * frame_size / rate
+        self.frame_duration = frame_ms / 1000.0
+        self.preroll_frames = max(1, int(round(preroll_ms / frame_ms)))
+        self.silence_frames = max(1, int(round(silence_ms / frame_ms)))
+        self.min_speech_frames = max(1, int(round(min_speech_ms / frame_ms)))
+        self.max_frames = max(1, int(max_utterance_s / self.frame_duration))
+        self.fixed_window_s = fixed_window_s
+        
+        # Echo gating: while our own speech plays (and its tail still reaches the
+        # microphone) only speech louder than echo_factor times the threshold counts
+        self.echo_factor = echo_factor
+        self.echo_tail_s = echo_tail_ms / 1000.0
+        self.playing = False
+        self.echo_until = 0.0
+        
+        # Turn-start statistics compared with recording a fixed window
+        self.utterances = 0
+        self.total_utterance_s = 0.0
+        self.total_saved_s = 0.0
+    
+    def set_playing(self, playing: bool):
+        """Mark whether the speaker is currently playing our own speech"""
+        self.playing = playing
+        if not playing:
+            self.echo_until = time.monotonic() + self.echo_tail_s
+    
+    def echo_gated(self) -> bool:
+        return self.playing or time.monotonic() < self.echo_until
+    
+    def classify(self, data: bytes) -> np.ndarray:
+        """Return a speech flag for every complete frame in data"""
+        samples = np.frombuffer(data, dtype=np.int16)
+        usable = len(samples) - len(samples) % self.frame_size
+        frames = samples[:usable].reshape(-1, self.frame_size).astype(np.float32)
+        
+        energy = np.sqrt(np.mean(frames * frames, axis=1))
+        signs = np.signbit(frames)
+        zcr = np.count_nonzero(signs[:, 1:] != signs[:, :-1], axis=1) / (self.frame_size - 1)
+        
+        threshold = self.energy_threshold
+        if self.noise_floor is not None:
+            threshold = max(threshold, self.noise_floor * self.noise_factor)
+        gated = self.echo_gated()
+        if gated:
+            threshold *= self.echo_factor
+        speech = (energy >= threshold) & (zcr <= self.max_zcr)
+        
+        # Track the background level from non-speech frames, but not from our own echo
+        quiet = energy[~speech]
+        if quiet.size and not gated:
+            level = float(quiet.mean())
+            self.noise_floor = level if self.noise_floor is None else 0.95 * self.noise_floor + 0.05 * level
+        return speech
+    
+    def segments(self, chunks: Iterable[bytes]) -> Iterator[bytes]:
+        """Yield one PCM segment per detected utterance from a stream of chunks"""
+        audio: List[bytes] = []
+        for piece in self._utterance_audio(chunks):
+            if piece is None:
+                yield b"".join(audio)
+                audio = []
+            else:
+                audio.append(piece)
+    
+    def utterance_streams(self, chunks: Iterable[bytes]) -> Iterator[Iterator[bytes]]:
+        """Yield one iterator per utterance, producing its audio while it is still spoken"""
+        pieces = self._utterance_audio(chunks)
+        
+        def utterance(first: bytes) -> Iterator[bytes]:
+            yield first
+            for piece in pieces:
+                if piece is None:
+                    return
+                yield piece
+        
+        # An utterance always starts with audio, None only ever ends one
+        for first in pieces:
+            stream = utterance(first)
+            yield stream
+            # Skip whatever the caller did not read of this utterance
+            for _ in stream:
+                pass
+    
+    def _utterance_audio(self, chunks: Iterable[bytes]) -> Iterator[Optional[bytes]]:
+        """Yield utterance audio as soon as it is confirmed speech, then None when it ends"""
+        frame_bytes = self.frame_size * 2
+        preroll = collections.deque(maxlen=self.preroll_frames)
+        # Frames heard but not yet handed out: the start of an utterance until it
+        # has enough speech, and trailing silence that may still end it
+        held: List[bytes] = []
+        frames = 0
+        speech_frames = 0
+        silence_frames = 0
+        confirmed = False
+        leftover = b""
+        
+        for chunk in chunks:
+            data = leftover + chunk
+            usable = len(data) - len(data) % frame_bytes
+            leftover = data[usable:]
+            if not usable:
+                continue
+            
+            flags = self.classify(data[:usable])
+            for index, is_speech in enumerate(flags):
+                frame = data[index * frame_bytes:(index + 1) * frame_bytes]
+                if not frames:
+                    if is_speech:
+                        held = list(preroll)
+                        held.append(frame)
+                        preroll.clear()
+                        frames = len(held)
+                        speech_frames = 1
+                        silence_frames = 0
+                    else:
+                        preroll.append(frame)
+                    continue
+                
+                held.append(frame)
+                frames += 1
+                if is_speech:
+                    speech_frames += 1
+                    silence_frames = 0
+                else:
+                    silence_frames += 1
+                
+                confirmed = confirmed or speech_frames >= self.min_speech_frames
+                if confirmed and len(held) > silence_frames:
+                    yield b"".join(held[:len(held) - silence_frames])
+                    del held[:len(held) - silence_frames]
+                
+                if silence_frames >= self.silence_frames or frames >= self.max_frames:
+                    if confirmed:
+                        # Trailing silence is only needed for endpointing, not for transcription
+                        self._finish_segment(frames)
+                        yield None
+                    held = []
+                    frames = 0
+                    speech_frames = 0
+                    silence_frames = 0
+                    confirmed = False
+        
+        # The stream ended mid-utterance: flush what was heard so far
+        if confirmed:
+            if len(held) > silence_frames:
+                yield b"".join(held[:len(held) - silence_frames])
+            self._finish_segment(frames)
+            yield None
+    
+    def _finish_segment(self, frames: int):
+        utterance_s = frames * self.frame_duration
+        saved_s = self.fixed_window_s - utterance_s
+        self.utterances += 1
+        self.total_utterance_s += utterance_s
+        self.total_saved_s += saved_s
+        logger.info(f"Utterance endpointed after {utterance_s:.2f} s "
+                    f"(fixed {self.fixed_window_s:.0f} s window: {saved_s:+.2f} s saved)")
+    
+    def stats(self) -> Dict[str, float]:
+        """Average turn-start time and time saved versus the fixed window"""
+        count = max(self.utterances, 1)
+        return {
+            "utterances": self.utterances,
+            "avg_turn_start_s": self.total_utterance_s / count,
+            "avg_saved_s": self.total_saved_s / count,
+            "endpoint_delay_s": self.silence_frames * self.frame_duration
+        }
+
+class AudioRingBuffer:
+    """Single-producer / single-consumer byte ring buffer for PCM audio"""
+    
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.buffer = bytearray(capacity)
+        self.view = memoryview(self.buffer)
+        # Monotonic positions: only the producer moves write_pos and only the
+        # consumer moves read_pos, so the data path needs no lock
+        self.write_pos = 0
+        self.read_pos = 0
+        self.discard_requested = False
+        self.overruns = 0
+        self.readable = threading.Event()
+        self.writable = threading.Event()
+    
+    def available(self) -> int:
+        """Bytes ready to be read"""
+        return self.write_pos - self.read_pos
+    
+    def free(self) -> int:
+        """Bytes that can be written without overwriting unread data"""
+        return self.capacity - self.available()
+    
+    def write(self, data) -> int:
+        """Producer side: copy as much of data as fits and return the byte count"""
+        data = memoryview(data).cast("B")
+        size = min(len(data), self.free())
+        if size < len(data):
+            self.overruns += 1
+        if size:
+            start = self.write_pos % self.capacity
+            first = min(size, self.capacity - start)
+            self.view[start:start + first] = data[:first]
+            if first < size:
+                self.view[:size - first] = data[first:size]
+            self.write_pos += size
+            self.readable.set()
+        return size
+    
+    def read(self, size: int) -> bytes:
+        """Consumer side: return up to size bytes"""
+        if self.discard_requested:
+            self.discard_requested = False
+            self.read_pos = self.write_pos
+        size = min(size, self.available())
+        if not size:
+            return b""
+        start = self.read_pos % self.capacity
+        first = min(size, self.capacity - start)
+        data = bytes(self.view[start:start + first])
+        if first < size:
+            data += bytes(self.view[:size - first])
+        self.read_pos += size
+        self.writable.set()
+        return data
+    
+    def clear(self):
+        """Drop all unread data; applied by the consumer on its next read"""
+        self.discard_requested = True
+    
+    def wait_readable(self, size: int, timeout: float) -> bool:
+        """Wait until at least size bytes can be read"""
+        if self.available() >= size:
+            return True
+        self.readable.clear()
+        return self.available() >= size or (self.readable.wait(timeout) and self.available() >= size)
+    
+    def wait_writable(self, timeout: float) -> bool:
+        """Wait until some space is free"""
+        if self.free():
+            return True
+        self.writable.clear()
+        return self.free() > 0 or (self.writable.wait(timeout) and self.free() > 0)
+
+class InMemoryAudioStream:
+    """Callback-mode stream of InMemoryAudioBackend, driven by its own thread"""
+    
+    def __init__(self, backend: "InMemoryAudioBackend", rate: int, frames_per_buffer: int,
+                 input: bool, output: bool, stream_callback):
+        self.backend = backend
+        self.rate = rate
+        self.frames = frames_per_buffer
+        self.is_input = input
+        self.is_output = output
+        self.callback = stream_callback
+        self.active = threading.Event()
+        self.active.set()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+    
+    def _run(self):
+        size = self.frames * 2
+        silence = bytes(size)
+        while self.active.is_set():
+            if self.is_input:
+                data = self.backend.next_input(size) or silence
+                self.callback(data, self.frames, {}, 0)
+            if self.is_output:
+                data, _ = self.callback(None, self.frames, {}, 0)
+                if data.count(0) != len(data):
+                    self.backend.output.extend(data)
+            time.sleep(self.frames / self.rate if self.backend.realtime else 0.001)
+    
+    def is_active(self) -> bool:
+        return self.active.is_set()
+    
+    def stop_stream(self):
+        self.active.clear()
+        if threading.current_thread() is not self.thread:
+            self.thread.join(timeout=1)
+    
+    def close(self):
+        self.stop_stream()
+
+class InMemoryAudioBackend:
+    """PortAudio stand-in: plays a byte string as microphone input and records speaker output"""
+    
+    def __init__(self, input_audio: bytes = b"", realtime=False):
+        self.input_audio = input_audio
+        self.input_pos = 0
+        self.output = bytearray()
+        self.realtime = realtime
+        self.lock = threading.Lock()
+    
+    def feed(self, audio: bytes):
+        """Append more microphone input"""
+        with self.lock:
+            self.input_audio = self.input_audio[self.input_pos:] + audio
+            self.input_pos = 0
+    
+    def next_input(self, size: int) -> bytes:
+        with self.lock:
+            data = self.input_audio[self.input_pos:self.input_pos + size]
+            self.input_pos += len(data)
+        if data and len(data) < size:
+            data += bytes(size - len(data))
+        return data
+    
+    def open(self, rate=16000, frames_per_buffer=1024, input=False, output=False,
+             stream_callback=None, **kwargs) -> InMemoryAudioStream:
+        return InMemoryAudioStream(self, rate, frames_per_buffer, input, output, stream_callback)
+    
+    def terminate(self):
+        pass
+
+# PortAudio constants, so in-memory backends work without importing pyaudio
+PA_INT16 = 8
+PA_CONTINUE = 0
+
+class AudioDevice:
+    """Audio device shared by Microphone and Speaker, with persistent callback-mode streams"""
+    
+    def __init__(self, rate=16000, chunk=1024, backend=None, input_seconds=10, output_seconds=30):
+        self.rate = rate
+        self.chunk = chunk
+        if backend is None:
+            import pyaudio
+            backend = pyaudio.PyAudio()
+        self.backend = backend
+        self.input_buffer = AudioRingBuffer(rate * 2 * input_seconds)
+        self.output_buffer = AudioRingBuffer(rate * 2 * output_seconds)
+        self.input_stream = None
+        self.output_stream = None
+        self.lock = threading.Lock()
+        # Time to wait for the callback thread, one buffer worth of audio
+        self.poll_interval = chunk / rate
+    
+    def _input_callback(self, in_data, frame_count, time_info, status):
+        self.input_buffer.write(in_data)
+        return (None, PA_CONTINUE)
+    
+    def _output_callback(self, in_data, frame_count, time_info, status):
+        size = frame_count * 2
+        data = self.output_buffer.read(size)
+        if len(data) < size:
+            data += bytes(size - len(data))
+        return (data, PA_CONTINUE)
+    
+    def _open(self, **kwargs):
+        return self.backend.open(
+            format=PA_INT16,
+            channels=1,
+            rate=self.rate,
+            frames_per_buffer=self.chunk,
+            **kwargs
+        )
+    
+    def start_input(self):
+        """Open the input stream once; it then keeps filling the input buffer"""
+        with self.lock:
+            if self.input_stream is None:
+                self.input_stream = self._open(input=True, stream_callback=self._input_callback)
+                logger.info("Audio input stream opened")
+    
+    def start_output(self):
+        """Open the output stream once; it then keeps draining the output buffer"""
+        with self.lock:
+            if self.output_stream is None:
+                self.output_stream = self._open(output=True, stream_callback=self._output_callback)
+                logger.info("Audio output stream opened")
+    
+    def read(self, size: int, stop_event: Optional[threading.Event] = None) -> bytes:
+        """Read exactly size bytes of input, or b"" if stop_event gets set first"""
+        self.start_input()
+        while not self.input_buffer.wait_readable(size, self.poll_interval):
+            if stop_event is not None and stop_event.is_set():
+                return b""
+        return self.input_buffer.read(size)
+    
+    def flush_input(self):
+        """Drop input captured so far"""
+        self.input_buffer.clear()
+    
+    def write(self, data: bytes, cancel_event: Optional[threading.Event] = None) -> bool:
+        """Queue data for playback; returns False if cancelled before it was all queued"""
+        self.start_output()
+        view = memoryview(data)
+        while view:
+            if cancel_event is not None and cancel_event.is_set():
+                return False
+            if self.output_buffer.wait_writable(self.poll_interval):
+                view = view[self.output_buffer.write(view):]
+        return True
+    
+    def drain(self, cancel_event: Optional[threading.Event] = None) -> bool:
+        """Wait until queued output has been played; returns False if cancelled"""
+        # Never wait much longer than the queued audio takes to play
+        deadline = time.monotonic() + self.output_buffer.available() / (self.rate * 2) + 1.0
+        while self.output_buffer.available() > 0:
+            if cancel_event is not None and cancel_event.is_set():
+                return False
+            if time.monotonic() > deadline:
+                logger.warning("Audio output is not draining, dropping queued audio")
+                return False
+            time.sleep(self.poll_interval / 2)
+        return True
+    
+    def cancel_output(self):
+        """Drop output that has not been played yet"""
+        self.output_buffer.clear()
+    
+    def close(self):
+        """Close both streams and release the backend"""
+        with self.lock:
+            for stream in (self.input_stream, self.output_stream):
+                if stream is not None:
+                    stream.stop_stream()
+                    stream.close()
+            self.input_stream = None
+            self.output_stream = None
+        self.backend.terminate()
+
+_audio_device: Optional[AudioDevice] = None
+_audio_device_lock = threading.Lock()
+
+def get_audio_device(rate=16000, chunk=1024) -> AudioDevice:
+    """Return the process-wide audio device"""
+    global _audio_device
+    with _audio_device_lock:
+        if _audio_device is None:
+            _audio_device = AudioDevice(rate=rate, chunk=chunk)
+        return _audio_device
+
 class Microphone:
     """Microphone interface"""
     
-    def __init__(self, rate=16000, chunk=1024):
+    def __init__(self, rate=16000, chunk=1024, vad: Optional[VoiceActivityDetector] = None,
+                 device: Optional[AudioDevice] = None):
         self.rate = rate
         self.chunk = chunk
-        self.audio = pyaudio.PyAudio()
+        self.device = device or get_audio_device(rate, chunk)
+        self.vad = vad or VoiceActivityDetector(rate=rate)
+    
+    def stream(self, stop_event: Optional[threading.Event] = None) -> Iterator[bytes]:
+        """Yield raw chunks from the microphone until stop_event is set"""
+        size = self.chunk * 2
+        while stop_event is None or not stop_event.is_set():
+            data = self.device.read(size, stop_event)
+            if data:
+                yield data
+    
+    def utterances(self, stop_event: Optional[threading.Event] = None) -> Iterator[bytes]:
+        """Yield one audio segment per utterance detected by the VAD"""
+        chunks = self.stream(stop_event)
+        try:
+            yield from self.vad.segments(chunks)
+        finally:
+            chunks.close()
+    
+    def utterance_streams(self, stop_event: Optional[threading.Event] = None) -> Iterator[Iterator[bytes]]:
+        """Yield one audio stream per utterance, filled while the user is still speaking"""
+        chunks = self.stream(stop_event)
+        try:
+            yield from self.vad.utterance_streams(chunks)
+        finally:
+            chunks.close()
+    
+    def record_utterance(self, stop_event: Optional[threading.Event] = None) -> bytes:
+        """Record until the speaker stops talking"""
+        # Skip audio captured while we were not listening (e.g. our own speech)
+        self.device.flush_input()
+        utterances = self.utterances(stop_event)
+        try:
+            return next(utterances, b"")
+        finally:
+            utterances.close()
     
     def record(self, duration=5) -> bytes:
         """Record audio for specified duration"""
+        self.device.flush_input()
         frames = []
-        stream = self.audio.open(
-            format=pyaudio.paInt16,
-            channels=1,
-            rate=self.rate,
-            input=True,
-            frames_per_buffer=self.chunk
-        )
-        
         for _ in range(0, int(self.rate / self.chunk * duration)):
-            data = stream.read(self.chunk)
-            frames.append(data)
-        
-        stream.stop_stream()
-        stream.close()
-        
+            frames.append(self.device.read(self.chunk * 2))
         return b''.join(frames)
 
 class Speaker:
     """Speaker interface"""
     
-    def __init__(self, rate=16000):
+    def __init__(self, rate=16000, chunk=1024, device: Optional[AudioDevice] = None):
         self.rate = rate
-        self.audio = pyaudio.PyAudio()
+        self.chunk = chunk
+        self.device = device or get_audio_device(rate, chunk)
     
-    def play(self, audio_data: bytes):
-        """Play audio data"""
-        stream = self.audio.open(
-            format=pyaudio.paInt16,
-            channels=1,
-            rate=self.rate,
-            output=True,
-            frames_per_buffer=1024
-        )
-        
-        stream.write(audio_data)
-        stream.stop_stream()
-        stream.close()
+    def play(self, audio_data: bytes, cancel_event: Optional[threading.Event] = None):
+        """Play audio data, stopping early if cancel_event gets set"""
+        with get_metrics().span("playback"):
+            if not (self.device.write(audio_data, cancel_event) and self.device.drain(cancel_event)):
+                # Barge-in: drop whatever is still queued
+                self.device.cancel_output()
+
+class FrameSource:
+    """Base class for frame producers used by CameraCapture"""
+    
+    name = "base"
+    
+    def open(self) -> Tuple[int, ...]:
+        """Start the source and return the frame shape"""
+        raise NotImplementedError
+    
+    def read_into(self, out: np.ndarray) -> bool:
+        """Write the next frame into out; False if no frame could be read"""
+        raise NotImplementedError
+    
+    def close(self):
+        pass
+
+class OpenCVFrameSource(FrameSource):
+    """Camera device or video file read through cv2.VideoCapture"""
+    
+    name = "opencv"
+    
+    def __init__(self, device=0, width: Optional[int] = None, height: Optional[int] = None,
+                 fps: Optional[float] = None, loop=True):
+        import cv2
+        self.cv2 = cv2
+        self.device = device
+        self.width = width
+        self.height = height
+        self.fps = fps
+        # Video files restart at the end instead of running dry
+        self.loop = loop and isinstance(device, str)
+        self.cap = None
+    
+    def open(self) -> Tuple[int, ...]:
+        cv2 = self.cv2
+        self.cap = cv2.VideoCapture(self.device)
+        if not self.cap.isOpened():
+            raise RuntimeError(f"Could not open video source {self.device!r}")
+        if self.width and self.height:
+            self.cap.set(cv2.CAP_PROP_FRAME_WIDTH, self.width)
+            self.cap.set(cv2.CAP_PROP_FRAME_HEIGHT, self.height)
+        if self.fps:
+            self.cap.set(cv2.CAP_PROP_FPS, self.fps)
+        # Keep the driver queue short so frames are fresh when they are grabbed
+        self.cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+        ok, frame = self.cap.read()
+        if not ok:
+            raise RuntimeError(f"Could not read from video source {self.device!r}")
+        if self.loop:
+            self.cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+        return frame.shape
+    
+    def read_into(self, out: np.ndarray) -> bool:
+        ok, frame = self.cap.read(out)
+        if not ok and self.loop:
+            self.cap.set(self.cv2.CAP_PROP_POS_FRAMES, 0)
+            ok, frame = self.cap.read(out)
+        if not ok:
+            return False
+        if frame is not out:
+            # The source changed size; fit it into the preallocated slot
+            if frame.shape != out.shape:
+                frame = self.cv2.resize(frame, (out.shape[1], out.shape[0]))
+            np.copyto(out, frame)
+        return True
+    
+    def close(self):
+        if self.cap is not None:
+            self.cap.release()
+            self.cap = None
+
+class SyntheticFrameSource(FrameSource):
+    """Moving test pattern, for running the capture path without a camera"""
+    
+    name = "synthetic"
+    
+    def __init__(self, width=640, height=480):
+        self.width = width
+        self.height = height
+        self.index = 0
+    
+    def open(self) -> Tuple[int, ...]:
+        self.gradient = np.linspace(0, 255, self.width).astype(np.uint8)
+        return (self.height, self.width, 3)
+    
+    def read_into(self, out: np.ndarray) -> bool:
+        out[...] = self.gradient[None, :, None]
+        # A bright square moving one step per frame
+        size = max(1, min(self.width, self.height) // 8)
+        x = (self.index * 4) % max(1, self.width - size)
+        y = (self.index * 2) % max(1, self.height - size)
+        out[y:y + size, x:x + size] = 255
+        self.index += 1
+        return True
+
+class CameraCapture:
+    """Background capture thread writing into a preallocated ring of frame buffers"""
+    
+    def __init__(self, source: FrameSource, fps=30.0, slots=3):
+        if slots < 3:
+            raise ValueError("CameraCapture needs at least 3 slots")
+        self.source = source
+        self.fps = fps
+        self.slots = slots
+        self.frames: Optional[np.ndarray] = None
+        # Per slot: sequence number, capture time and how many readers hold it
+        self.sequence = np.zeros(slots, dtype=np.int64)
+        self.timestamps = np.zeros(slots, dtype=np.float64)
+        self.holders = [0] * slots
+        self.latest_slot = -1
+        self.latest_sequence = 0
+        self.consumed_sequence = 0
+        self.captured = 0
+        self.dropped = 0
+        self.late = 0
+        self.read_errors = 0
+        self.condition = threading.Condition()
+        self.stop_event = threading.Event()
+        self.thread = None
+    
+    def start(self) -> "CameraCapture":
+        """Open the source and start grabbing frames"""
+        if self.thread is None:
+            shape = self.source.open()
+            self.frames = np.empty((self.slots, *shape), dtype=np.uint8)
+            self.thread = threading.Thread(target=self._run, name="camera-capture", daemon=True)
+            self.thread.start()
+            logger.info(f"Camera capture started ({self.source.name}, {shape[1]}x{shape[0]} @ {self.fps:g} fps)")
+        return self
+    
+    def _free_slot(self) -> int:
+        # Any slot that is neither the latest frame nor held by a reader
+        for offset in range(1, self.slots + 1):
+            slot = (self.latest_slot + offset) % self.slots
+            if slot != self.latest_slot and not self.holders[slot]:
+                return slot
+        return -1
+    
+    def _run(self):
+        interval = 1.0 / self.fps if self.fps else 0.0
+        deadline = time.monotonic()
+        while not self.stop_event.is_set():
+            with self.condition:
+                slot = self._free_slot()
+            if slot < 0:
+                # Every spare slot is held by readers; wait for one to come back
+                self.stop_event.wait(interval or 0.005)
+                continue
+            
+            try:
+                ok = self.source.read_into(self.frames[slot])
+            except Exception as e:
+                logger.error(f"Error in camera capture: {e}")
+                ok = False
+            if not ok:
+                self.read_errors += 1
+                self.stop_event.wait(max(interval, 0.05))
+                continue
+            
+            with self.condition:
+                # The previous latest frame is overwritten unseen if nobody took it
+                if self.latest_sequence > self.consumed_sequence:
+                    self.dropped += 1
+                self.latest_sequence += 1
+                self.sequence[slot] = self.latest_sequence
+                self.timestamps[slot] = time.time()
+                self.latest_slot = slot
+                self.captured += 1
+                self.condition.notify_all()
+            
+            if interval:
+                deadline += interval
+                delay = deadline - time.monotonic()
+                if delay > 0:
+                    self.stop_event.wait(delay)
+                else:
+                    # Reading took longer than a frame period
+                    self.late += 1
+                    deadline = time.monotonic()
+    
+    def acquire(self, timeout: Optional[float] = 1.0, newer_than=0) -> Tuple[int, np.ndarray]:
+        """Borrow the latest frame without copying; hand the slot back with release()"""
+        with self.condition:
+            if not self.condition.wait_for(lambda: self.latest_sequence > newer_than, timeout):
+                raise TimeoutError("No camera frame available")
+            slot = self.latest_slot
+            self.holders[slot] += 1
+            self.consumed_sequence = max(self.consumed_sequence, int(self.sequence[slot]))
+            frame = self.frames[slot]
+        # Readers get a read-only view, the capture thread never writes a held slot
+        frame = frame.view()
+        frame.flags.writeable = False
+        return slot, frame
+    
+    def release(self, slot: int):
+        """Return a slot borrowed with acquire()"""
+        with self.condition:
+            self.holders[slot] -= 1
+    
+    def stop(self):
+        """Stop the capture thread and close the source"""
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join(timeout=2)
+            self.thread = None
+        self.source.close()
+    
+    def stats(self) -> Dict[str, int]:
+        """Capture counters"""
+        return {
+            "captured": self.captured,
+            "dropped": self.dropped,
+            "late": self.late,
+            "read_errors": self.read_errors
+        }
 
 class Camera:
     """Camera interface"""
     
-    def __init__(self, device_id=0):
+    def __init__(self, device_id=0, threaded=False, width: Optional[int] = None, height: Optional[int] = None,
+                 fps=30.0, source: Optional[FrameSource] = None):
         self.device_id = device_id
-        self.cap = cv2.VideoCapture(device_id)
+        self.capture_thread = None
+        # Slot and sequence of the frame each calling thread currently holds
+        self.held = threading.local()
+        if threaded or source is not None:
+            # Frames are grabbed continuously; capture() hands over the newest one
+            source = source or OpenCVFrameSource(device_id, width, height, fps)
+            self.capture_thread = CameraCapture(source, fps=fps).start()
+        else:
+            import cv2
+            self.cap = cv2.VideoCapture(device_id)
     
-    def capture(self) -> np.ndarray:
+    def capture(self, wait_new=False) -> np.ndarray:
         """Capture single frame"""
+        if self.capture_thread is not None:
+            # The returned frame stays valid until this thread calls capture() or release() again
+            self.release()
+            newer_than = getattr(self.held, "sequence", 0) if wait_new else 0
+            slot, frame = self.capture_thread.acquire(newer_than=newer_than)
+            self.held.slot = slot
+            self.held.sequence = int(self.capture_thread.sequence[slot])
+            return frame
         ret, frame = self.cap.read()
         if not ret:
             raise Exception("Failed to capture frame")
         return frame
     
+    def release(self):
+        """Hand the calling thread's frame back to the capture ring (threaded mode only)"""
+        slot = getattr(self.held, "slot", None)
+        if slot is not None:
+            self.held.slot = None
+            self.capture_thread.release(slot)
+    
+    def stats(self) -> Dict[str, int]:
+        """Capture counters (threaded mode only)"""
+        return self.capture_thread.stats() if self.capture_thread is not None else {}
+    
     def __del__(self):
+        if getattr(self, 'capture_thread', None) is not None:
+            self.capture_thread.stop()
         if hasattr(self, 'cap'):
             self.cap.release()
 
+class TTSBackend:
+    """Base class for text-to-speech engines producing 16-bit mono PCM"""
+    
+    name = "base"
+    
+    @property
+    def cache_id(self) -> str:
+        """Engine name plus every setting that changes the audio, for cache keys"""
+        return self.name
+    
+    def synthesize(self, text: str, voice: str, rate: int) -> bytes:
+        raise NotImplementedError
+
+class DummyTTSBackend(TTSBackend):
+    """Placeholder engine used when no real TTS engine is installed"""
+    
+    name = "dummy"
+    
+    def synthesize(self, text: str, voice: str, rate: int) -> bytes:
+        return b"dummy_audio_data"
+
+class EspeakTTSBackend(TTSBackend):
+    """Local espeak-ng engine, run as a subprocess and resampled to the output rate"""
+    
+    name = "espeak"
+    
+    def __init__(self, words_per_minute=160, executable=None):
+        import shutil
+        self.executable = executable or shutil.which("espeak-ng") or shutil.which("espeak")
+        if not self.executable:
+            raise FileNotFoundError("espeak-ng is not installed")
+        self.words_per_minute = words_per_minute
+    
+    @property
+    def cache_id(self) -> str:
+        return f"{self.name}:{self.words_per_minute}"
+    
+    def synthesize(self, text: str, voice: str, rate: int) -> bytes:
+        import subprocess
+        # "--" so a reply starting with "-" is read as text, not as an option
+        result = subprocess.run(
+            [self.executable, "-v", voice, "-s", str(self.words_per_minute), "--stdout", "--", text],
+            capture_output=True,
+            check=True
+        )
+        with wave.open(BytesIO(result.stdout)) as wav:
+            source_rate = wav.getframerate()
+            samples = np.frombuffer(wav.readframes(wav.getnframes()), dtype=np.int16)
+        if source_rate != rate and samples.size:
+            positions = np.arange(0, samples.size, source_rate / rate)
+            samples = np.interp(positions, np.arange(samples.size), samples).astype(np.int16)
+        return samples.tobytes()
+
+def create_tts_backend(name: str = "auto", **kwargs) -> TTSBackend:
+    """Create a TTS backend by name; "auto" prefers espeak-ng when it is installed"""
+    if name in ("auto", "espeak"):
+        try:
+            return EspeakTTSBackend(**kwargs)
+        except FileNotFoundError:
+            if name == "espeak":
+                raise
+            logger.warning("espeak-ng is not installed, using dummy text-to-speech")
+    return DummyTTSBackend()
+
+class TTSCache:
+    """Content-addressed cache of synthesized PCM: in-memory LRU in front of a disk store
+
+    Only phrases stored with persist=True (canned, pre-warmed replies) reach the disk;
+    one-off replies stay in memory so private conversations are not left behind.
+    """
+    
+    def __init__(self, directory: Optional[str] = None, max_memory_bytes=32 * 1024 * 1024):
+        self.directory = directory or os.path.join(os.path.expanduser("~"), ".cache", "mia", "tts")
+        self.max_memory_bytes = max_memory_bytes
+        self.entries: "collections.OrderedDict[str, bytes]" = collections.OrderedDict()
+        self.memory_bytes = 0
+        self.lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        os.makedirs(self.directory, exist_ok=True)
+    
+    @staticmethod
+    def key(text: str, voice: str, rate: int, backend: str) -> str:
+        """Stable key for a phrase; whitespace differences do not matter"""
+        normalized = " ".join(text.split())
+        return hashlib.sha256(f"{backend}\0{voice}\0{rate}\0{normalized}".encode("utf-8")).hexdigest()
+    
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], f"{key}.pcm")
+    
+    def get(self, key: str) -> Optional[bytes]:
+        """Return cached audio, promoting disk entries into memory"""
+        with self.lock:
+            audio = self.entries.get(key)
+            if audio is not None:
+                self.entries.move_to_end(key)
+                self.memory_hits += 1
+                return audio
+        
+        try:
+            with open(self._path(key), "rb") as f:
+                audio = f.read()
+        except OSError:
+            with self.lock:
+                self.misses += 1
+            return None
+        
+        with self.lock:
+            self.disk_hits += 1
+        self._remember(key, audio)
+        return audio
+    
+    def put(self, key: str, audio: bytes, persist=False):
+        """Store audio in memory, and on disk too when persist is set"""
+        self._remember(key, audio)
+        if not persist:
+            return
+        path = self._path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            temp_path = f"{path}.{os.getpid()}.tmp"
+            with open(temp_path, "wb") as f:
+                f.write(audio)
+            os.replace(temp_path, path)
+        except OSError as e:
+            logger.warning(f"Could not write TTS cache entry: {e}")
+    
+    def _remember(self, key: str, audio: bytes):
+        if len(audio) > self.max_memory_bytes:
+            return
+        with self.lock:
+            previous = self.entries.pop(key, None)
+            if previous is not None:
+                self.memory_bytes -= len(previous)
+            self.entries[key] = audio
+            self.memory_bytes += len(audio)
+            while self.memory_bytes > self.max_memory_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.memory_bytes -= len(evicted)
+    
+    def stats(self) -> Dict[str, int]:
+        """Hit/miss counters and memory use"""
+        return {
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "entries": len(self.entries),
+            "memory_bytes": self.memory_bytes
+        }
+
 class TextToSpeech:
     """Text-to-Speech interface"""
     
-    def __init__(self):
-        # Using a simple TTS approach - in real implementation could use Coqui TTS or similar
+    def __init__(self, backend: Optional[TTSBackend] = None, voice="sl", rate=16000,
+                 cache: Optional[TTSCache] = None, use_cache=True):
+        self.backend = backend or create_tts_backend()
+        self.voice = voice
+        self.rate = rate
+        self.cache = (cache or TTSCache()) if use_cache else None
         self.speakers = ["lahka ženska", "prijazna asistentka", "pomagalka"]
-        logger.info("Text-to-Speech initialized")
+        logger.info(f"Text-to-Speech initialized ({self.backend.name})")
     
-    def synthesize(self, text: str) -> bytes:
+    def synthesize(self, text: str, persist=False) -> bytes:
         """Synthesize speech from text"""
-        # In real implementation, this would use actual TTS engine
-        logger.info(f"Synthesizing speech: {text}")
-        # Return dummy audio data
-        return b"dummy_audio_data"
+        with get_metrics().span("tts"):
+            return self._synthesize(text, persist)
+    
+    def _synthesize(self, text: str, persist=False) -> bytes:
+        if self.cache is None:
+            logger.info(f"Synthesizing speech: {text}")
+            return self.backend.synthesize(text, self.voice, self.rate)
+        
+        key = TTSCache.key(text, self.voice, self.rate, self.backend.cache_id)
+        audio = self.cache.get(key)
+        if audio is None:
+            logger.info(f"Synthesizing speech: {text}")
+            audio = self.backend.synthesize(text, self.voice, self.rate)
+            self.cache.put(key, audio, persist)
+        return audio
+    
+    def prewarm(self, phrases: Iterable[str]) -> int:
+        """Synthesize phrases ahead of time so speaking them later is a cache hit"""
+        start = time.perf_counter()
+        count = 0
+        for phrase in phrases:
+            try:
+                # Fixed phrases are the only ones kept on disk across restarts
+                self.synthesize(phrase, persist=True)
+                count += 1
+            except Exception as e:
+                logger.error(f"Error pre-warming phrase: {e}")
+        logger.info(f"Pre-warmed {count} TTS phrases in {(time.perf_counter() - start) * 1000:.0f} ms")
+        return count
+
+class STTBackend:
+    """Base class for speech-to-text engines working on float32 mono audio"""
+    
+    name = "base"
+    
+    def load(self):
+        """Load model weights ahead of the first transcription"""
+    
+    def transcribe(self, samples: np.ndarray, rate: int) -> str:
+        raise NotImplementedError
+
+class DummySTTBackend(STTBackend):
+    """Placeholder engine used when no real STT engine is installed"""
+    
+    name = "dummy"
+    
+    def transcribe(self, samples: np.ndarray, rate: int) -> str:
+        return "dummy_transcription"
+
+_whisper_models: Dict[Tuple[str, bool], Any] = {}
+_whisper_models_lock = threading.Lock()
+
+class WhisperSTTBackend(STTBackend):
+    """Local Whisper model on CPU, optionally int8-quantized, cached per process"""
+    
+    name = "whisper"
+    
+    def __init__(self, model_name="base", language="sl", quantize=True):
+        import whisper  # optional dependency: pip install openai-whisper
+        self.whisper = whisper
+        self.model_name = model_name
+        self.language = language
+        self.quantize = quantize
+    
+    @property
+    def model(self):
+        """Load the model on first use and share it between instances"""
+        key = (self.model_name, self.quantize)
+        with _whisper_models_lock:
+            model = _whisper_models.get(key)
+            if model is None:
+                start = time.perf_counter()
+                model = self.whisper.load_model(self.model_name, device="cpu")
+                if self.quantize:
+                    import torch
+                    model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+                model.eval()
+                _whisper_models[key] = model
+                logger.info(f"Whisper model '{self.model_name}' loaded in {time.perf_counter() - start:.1f} s")
+            return model
+    
+    def load(self):
+        self.model
+    
+    def transcribe(self, samples: np.ndarray, rate: int) -> str:
+        import torch
+        if rate != 16000:
+            raise ValueError("Whisper expects 16 kHz audio")
+        with torch.inference_mode():
+            result = self.model.transcribe(
+                samples,
+                language=self.language,
+                fp16=False,
+                temperature=0.0,
+                condition_on_previous_text=False
+            )
+        return result.get("text", "").strip()
+
+def create_stt_backend(name: str = "auto", **kwargs) -> STTBackend:
+    """Create an STT backend by name; "auto" prefers Whisper when it is installed"""
+    if name in ("auto", "whisper"):
+        try:
+            return WhisperSTTBackend(**kwargs)
+        except ImportError:
+            if name == "whisper":
+                raise
+            logger.warning("openai-whisper is not installed, using dummy speech-to-text")
+    return DummySTTBackend()
 
 class SpeechToText:
     """Speech-to-Text interface"""
     
-    def __init__(self):
-        # Using a simple STT approach - in real implementation could use Whisper or similar
-        logger.info("Speech-to-Text initialized")
+    def __init__(self, backend: Optional[STTBackend] = None, rate=16000, chunk_seconds=5.0, overlap_seconds=1.0):
+        self.backend = backend or create_stt_backend()
+        self.rate = rate
+        self.chunk_samples = int(chunk_seconds * rate)
+        self.overlap_samples = int(overlap_seconds * rate)
+        logger.info(f"Speech-to-Text initialized ({self.backend.name})")
+    
+    @staticmethod
+    def to_float(audio_data: bytes) -> np.ndarray:
+        """Convert 16-bit PCM to float32 samples in [-1, 1]"""
+        return np.frombuffer(audio_data, dtype=np.int16).astype(np.float32) / 32768.0
     
     def transcribe(self, audio_data: bytes) -> str:
         """Transcribe audio to text"""
-        # In real implementation, this would use actual STT engine
         logger.info("Transcribing audio...")
-        # Return dummy transcription
-        return "dummy_transcription"
+        if not audio_data:
+            return ""
+        return self._transcribe(self.to_float(audio_data))
+    
+    def _transcribe(self, samples: np.ndarray) -> str:
+        with get_metrics().span("stt", audio_s=round(len(samples) / self.rate, 2)):
+            return self.backend.transcribe(samples, self.rate)
+    
+    def transcribe_stream(self, chunks: Iterable[bytes]) -> Iterator[Tuple[str, bool]]:
+        """Transcribe audio while it arrives, yielding (text, is_final) hypotheses"""
+        pieces: List[np.ndarray] = []
+        buffered = 0
+        words: List[str] = []
+        step = self.chunk_samples - self.overlap_samples
+        
+        for chunk in chunks:
+            samples = self.to_float(chunk)
+            pieces.append(samples)
+            buffered += len(samples)
+            # Every full window is transcribed and merged; windows overlap so
+            # words cut at a window edge are recognised in the next one
+            while buffered >= self.chunk_samples:
+                buffer = np.concatenate(pieces)
+                text = self._transcribe(buffer[:self.chunk_samples])
+                words = self._merge_overlap(words, text.split())
+                pieces = [buffer[step:]]
+                buffered = len(pieces[0])
+                yield " ".join(words), False
+        
+        if buffered > self.overlap_samples or not words:
+            text = self._transcribe(np.concatenate(pieces)) if buffered else ""
+            words = self._merge_overlap(words, text.split())
+        yield " ".join(words), True
+    
+    @staticmethod
+    def _merge_overlap(previous: List[str], new: List[str], max_overlap=8) -> List[str]:
+        """Append new words, dropping those repeated from the overlapping audio"""
+        tail = [word.strip(".,!?;:").lower() for word in previous[-max_overlap:]]
+        head = [word.strip(".,!?;:").lower() for word in new[:max_overlap]]
+        for size in range(min(len(tail), len(head)), 0, -1):
+            if tail[-size:] == head[:size]:
+                return previous + new[size:]
+        return previous + new
+
+class SentenceSplitter:
+    """Cuts a stream of text chunks into complete sentences"""
+    
+    def __init__(self, min_length=12):
+        self.min_length = min_length
+        self.buffer = ""
+    
+    def feed(self, chunk: str) -> List[str]:
+        """Add a chunk and return the sentences it completed"""
+        self.buffer += chunk
+        sentences = []
+        start = 0
+        for match in SENTENCE_BOUNDARY.finditer(self.buffer):
+            sentence = self.buffer[start:match.start()].strip()
+            # Very short pieces ("Da.", "1.") are merged with the next sentence
+            if len(sentence) >= self.min_length:
+                sentences.append(sentence)
+                start = match.end()
+        self.buffer = self.buffer[start:]
+        return sentences
+    
+    def flush(self) -> List[str]:
+        """Return whatever is left in the buffer"""
+        rest = self.buffer.strip()
+        self.buffer = ""
+        return [rest] if rest else []
+
+class DNNDetector:
+    """SSD detector (Caffe) run on CPU through OpenCV's DNN module, one forward pass per batch"""
+    
+    def __init__(self, name: str, prototxt: str, weights: str, labels: List[str], input_size=300,
+                 scale=1.0, mean=(104.0, 177.0, 123.0), confidence=0.5):
+        import cv2
+        self.cv2 = cv2
+        self.name = name
+        self.net = cv2.dnn.readNetFromCaffe(prototxt, weights)
+        self.net.setPreferableBackend(cv2.dnn.DNN_BACKEND_OPENCV)
+        self.net.setPreferableTarget(cv2.dnn.DNN_TARGET_CPU)
+        self.labels = labels
+        self.input_size = input_size
+        self.scale = scale
+        self.mean = mean
+        self.confidence = confidence
+    
+    def detect(self, frames: List[np.ndarray]) -> List[List[Dict[str, Any]]]:
+        """Detections per frame as label, confidence and a box relative to the frame size"""
+        if not frames:
+            return []
+        blob = self.cv2.dnn.blobFromImages(frames, self.scale, (self.input_size, self.input_size), self.mean)
+        self.net.setInput(blob)
+        # Rows are [image_id, class_id, confidence, x1, y1, x2, y2] for the whole batch
+        rows = self.net.forward().reshape(-1, 7)
+        rows = rows[rows[:, 2] >= self.confidence]
+        detections: List[List[Dict[str, Any]]] = [[] for _ in frames]
+        for image_id, class_id, confidence, *box in rows.tolist():
+            label = self.labels[int(class_id)] if 0 <= int(class_id) < len(self.labels) else str(int(class_id))
+            detections[int(image_id)].append({
+                "label": label,
+                "confidence": round(confidence, 3),
+                "box": [round(min(max(v, 0.0), 1.0), 3) for v in box]
+            })
+        return detections
+
+# Label sets of the SSD models create_detectors() looks for
+FACE_LABELS = ["background", "face"]
+VOC_LABELS = [
+    "background", "aeroplane", "bicycle", "bird", "boat", "bottle", "bus", "car", "cat", "chair", "cow",
+    "diningtable", "dog", "horse", "motorbike", "person", "pottedplant", "sheep", "sofa", "train", "tvmonitor"
+]
+
+def create_detectors(model_dir: Optional[str] = None) -> List[DNNDetector]:
+    """Face (ResNet-10 SSD) and object (MobileNet-SSD) detectors whose model files are present"""
+    model_dir = model_dir or os.path.join(os.path.expanduser("~"), ".cache", "mia", "models")
+    specs = [
+        ("faces", "deploy.prototxt", "res10_300x300_ssd_iter_140000.caffemodel", FACE_LABELS,
+         {"scale": 1.0, "mean": (104.0, 177.0, 123.0)}),
+        ("objects", "MobileNetSSD_deploy.prototxt", "MobileNetSSD_deploy.caffemodel", VOC_LABELS,
+         {"scale": 1 / 127.5, "mean": (127.5, 127.5, 127.5)}),
+    ]
+    detectors = []
+    for name, prototxt, weights, labels, options in specs:
+        prototxt, weights = os.path.join(model_dir, prototxt), os.path.join(model_dir, weights)
+        if not (os.path.exists(prototxt) and os.path.exists(weights)):
+            logger.warning(f"No {name} detection model in {model_dir}, {name} will not be detected")
+            continue
+        try:
+            detectors.append(DNNDetector(name, prototxt, weights, labels, **options))
+        except Exception as e:
+            logger.error(f"Could not load {name} detection model: {e}")
+    return detectors
 
 class VideoProcessor:
     """Video processing interface"""
     
-    def __init__(self):
-        logger.info("Video processor initialized")
+    def __init__(self, analysis_width=320, pixel_threshold=25, motion_threshold=0.01, scene_threshold=0.4,
+                 detectors: Optional[List[DNNDetector]] = None, workers=2):
+        import cv2
+        self.cv2 = cv2
+        # Frames are shrunk to this width before any analysis or inference
+        self.analysis_width = analysis_width
+        # A pixel moved if its grey level changed by more than pixel_threshold;
+        # a frame has motion if more than motion_threshold of its pixels moved
+        self.pixel_threshold = pixel_threshold
+        self.motion_threshold = motion_threshold
+        # L1 distance between normalized 32-bin histograms that counts as a cut
+        self.scene_threshold = scene_threshold
+        self.detectors = create_detectors() if detectors is None else detectors
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="mia-video")
+        # Last analyzed frame, so consecutive batches are compared across the boundary
+        self.previous_gray: Optional[np.ndarray] = None
+        self.previous_histogram: Optional[np.ndarray] = None
+        self.previous_detections: Dict[str, List[Dict[str, Any]]] = {}
+        self.state_lock = threading.Lock()
+        self.frames = 0
+        self.skipped = 0
+        logger.info(f"Video processor initialized ({len(self.detectors)} detectors)")
+    
+    def downsample(self, frame: np.ndarray) -> np.ndarray:
+        """Shrink a frame to the analysis width (always returns a new array)"""
+        height, width = frame.shape[:2]
+        if width <= self.analysis_width:
+            return frame.copy()
+        size = (self.analysis_width, max(1, round(height * self.analysis_width / width)))
+        return self.cv2.resize(frame, size, interpolation=self.cv2.INTER_AREA)
     
     def analyze(self, frame: np.ndarray) -> Dict[str, Any]:
         """Analyze video frame"""
-        # In real implementation, this would use computer vision models
+        return self.analyze_batch([frame])[0]
+    
+    def analyze_batch(self, frames: List[np.ndarray], shapes: Optional[List[Tuple[int, int]]] = None
+                      ) -> List[Dict[str, Any]]:
+        """Motion, scene changes and detections for consecutive frames"""
+        if not frames:
+            return []
+        # Callers that downsampled already pass the original frame sizes
+        shapes = shapes or [frame.shape[:2] for frame in frames]
+        small = [self.downsample(frame) for frame in frames]
+        cv2 = self.cv2
+        count = len(small)
+        height, width = small[0].shape[:2]
+        gray = np.empty((count, height, width), dtype=np.uint8)
+        for frame, out in zip(small, gray):
+            if frame.ndim == 3:
+                cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY, dst=out)
+            else:
+                out[...] = frame
+        
+        histograms = np.stack([cv2.calcHist([frame], [0], None, [32], [0, 256]).ravel() for frame in gray])
+        histograms /= height * width
+        
+        with self.state_lock:
+            previous_gray = self.previous_gray
+            previous_histogram = self.previous_histogram
+            if previous_gray is None or previous_gray.shape != gray.shape[1:]:
+                previous_gray, previous_histogram = gray[0], histograms[0]
+            # Differences against the preceding frame; frames 1..n as one tall image
+            difference = np.empty_like(gray)
+            cv2.absdiff(gray[0], previous_gray, dst=difference[0])
+            if count > 1:
+                cv2.absdiff(gray[1:].reshape(-1, width), gray[:-1].reshape(-1, width),
+                            dst=difference[1:].reshape(-1, width))
+            motion = np.count_nonzero(difference.reshape(count, -1) > self.pixel_threshold, axis=1) / (height * width)
+            scene = np.abs(histograms - np.concatenate((previous_histogram[None], histograms[:-1]))).sum(axis=1)
+            self.previous_gray = gray[-1].copy()
+            self.previous_histogram = histograms[-1]
+            first_analysis = self.frames == 0
+            self.frames += count
+        
+        scene_change = scene > self.scene_threshold
+        changed = (motion > self.motion_threshold) | scene_change
+        if first_analysis:
+            changed[0] = True
+        # Unchanged frames reuse the detections of the last frame that was run
+        run = np.flatnonzero(changed)
+        detections = {detector.name: detector.detect([small[i] for i in run]) for detector in self.detectors}
+        
+        results = []
+        latest = dict(self.previous_detections)
+        position = {index: n for n, index in enumerate(run.tolist())}
+        for i in range(count):
+            if i in position:
+                latest = {name: found[position[i]] for name, found in detections.items()}
+            results.append({
+                "frame_shape": shapes[i],
+                "timestamp": datetime.now().isoformat(),
+                "analysis": "video_analysis_complete",
+                "motion": round(float(motion[i]), 4),
+                "scene_change": bool(scene_change[i]),
+                "skipped": i not in position,
+                "detections": latest
+            })
+        with self.state_lock:
+            self.previous_detections = latest
+            self.skipped += count - len(run)
+        return results
+    
+    def submit(self, frames: List[np.ndarray]) -> Future:
+        """Analyze frames on the worker pool"""
+        return self.pool.submit(self.analyze_batch, frames)
+    
+    def stats(self) -> Dict[str, int]:
+        """Frames analyzed and skipped"""
+        return {"frames": self.frames, "skipped": self.skipped, "detectors": len(self.detectors)}
+
+class FrameEncoder:
+    """Turns camera frames into base64 JPEGs for Ollama vision models, once per distinct frame"""
+    
+    def __init__(self, max_side=672, quality=80, max_request_bytes=1_000_000, hash_distance=4, cache_size=32):
+        import cv2
+        self.cv2 = cv2
+        # Longest image side sent to the model; vision encoders downscale anyway
+        self.max_side = max_side
+        self.quality = quality
+        # Cap on base64 image bytes in one request
+        self.max_request_bytes = max_request_bytes
+        # Frames whose perceptual hashes differ in at most this many bits are the same image
+        self.hash_distance = hash_distance
+        self.cache: "collections.OrderedDict[int, str]" = collections.OrderedDict()
+        self.cache_size = cache_size
+        # Resize targets, reused for every frame of the same size
+        self.buffers: Dict[Tuple[int, ...], np.ndarray] = {}
+        self.hash_buffer = np.empty((8, 9), dtype=np.uint8)
+        self.encoded = 0
+        self.reused = 0
+        self.duplicates = 0
+        self.lock = threading.Lock()
+    
+    def perceptual_hash(self, frame: np.ndarray) -> int:
+        """64-bit difference hash: brighter-than-right-neighbour bits of a 9x8 grey thumbnail"""
+        cv2 = self.cv2
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame
+        cv2.resize(gray, (9, 8), dst=self.hash_buffer, interpolation=cv2.INTER_AREA)
+        bits = (self.hash_buffer[:, 1:] > self.hash_buffer[:, :-1]).ravel()
+        return int.from_bytes(np.packbits(bits).tobytes(), "big")
+    
+    def _find(self, frame_hash: int) -> Optional[int]:
+        for cached_hash in self.cache:
+            if (cached_hash ^ frame_hash).bit_count() <= self.hash_distance:
+                return cached_hash
+        return None
+    
+    def encode(self, frame: np.ndarray, max_side: Optional[int] = None, quality: Optional[int] = None) -> str:
+        """Resize into a reusable buffer and JPEG-encode to base64"""
+        cv2 = self.cv2
+        max_side = max_side or self.max_side
         height, width = frame.shape[:2]
+        scale = min(1.0, max_side / max(height, width))
+        if scale < 1.0:
+            size = (max(1, round(width * scale)), max(1, round(height * scale)))
+            shape = (size[1], size[0], *frame.shape[2:])
+            buffer = self.buffers.get(shape)
+            if buffer is None:
+                buffer = self.buffers[shape] = np.empty(shape, dtype=frame.dtype)
+            frame = cv2.resize(frame, size, dst=buffer, interpolation=cv2.INTER_AREA)
+        ok, jpeg = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, quality or self.quality])
+        if not ok:
+            raise RuntimeError("JPEG encoding failed")
+        self.encoded += 1
+        return base64.b64encode(jpeg).decode("ascii")
+    
+    def _fit(self, frame: np.ndarray, image: str, budget: int) -> Optional[str]:
+        """Re-encode smaller and at lower quality until the image fits the budget"""
+        max_side, quality = self.max_side, self.quality
+        while len(image) > budget:
+            if quality > 40:
+                quality -= 20
+            elif max_side > 128:
+                max_side = max_side * 3 // 4
+            else:
+                return None
+            image = self.encode(frame, max_side, quality)
+        return image
+    
+    def prepare(self, frames: Iterable[np.ndarray], exclude: Iterable[int] = ()) -> List[Tuple[int, str]]:
+        """(hash, base64 JPEG) for distinct frames not in exclude, within the request byte cap"""
+        prepared: List[Tuple[int, str]] = []
+        excluded = list(exclude)
+        budget = self.max_request_bytes
+        with self.lock:
+            for frame in frames:
+                frame_hash = self.perceptual_hash(frame)
+                known = excluded + [h for h, _ in prepared]
+                if any((h ^ frame_hash).bit_count() <= self.hash_distance for h in known):
+                    self.duplicates += 1
+                    continue
+                cached_hash = self._find(frame_hash)
+                if cached_hash is not None:
+                    # Same picture as one encoded before, reuse its bytes
+                    self.reused += 1
+                    self.cache.move_to_end(cached_hash)
+                    frame_hash, image = cached_hash, self.cache[cached_hash]
+                else:
+                    image = self.encode(frame)
+                    self.cache[frame_hash] = image
+                    if len(self.cache) > self.cache_size:
+                        self.cache.popitem(last=False)
+                if len(image) > budget:
+                    image = self._fit(frame, image, budget)
+                    if image is None:
+                        logger.warning("Frame does not fit the image byte cap, not sending it")
+                        continue
+                budget -= len(image)
+                prepared.append((frame_hash, image))
+        return prepared
+    
+    def stats(self) -> Dict[str, int]:
+        """Encodings done, encodings reused and duplicate frames skipped"""
+        return {"encoded": self.encoded, "reused": self.reused, "duplicates": self.duplicates,
+                "cached": len(self.cache)}
+
+class OllamaBusyError(RuntimeError):
+    """Raised when the request scheduler's queue for a priority is full"""
+
+class OllamaModelNotFoundError(RuntimeError):
+    """Raised when Ollama answers 404 because a model is not installed"""
+
+class _EmbedBatch:
+    __slots__ = ("texts", "priority", "future")
+
+    def __init__(self, priority: int):
+        self.texts: List[str] = []
+        self.priority = priority
+        self.future: Future = Future()
+
+class RequestScheduler:
+    """Admits Ollama requests in priority order, coalesces duplicates and micro-batches embeddings"""
+
+    INTERACTIVE = 0
+    BACKGROUND = 1
+    PRIORITY_NAMES = ("interactive", "background")
+
+    def __init__(self, max_concurrency=2, max_background=None, max_queue=(32, 8),
+                 embed_window=0.005, max_embed_batch=64, window=1000):
+        self.max_concurrency = max_concurrency
+        # Background work never takes the last slot, so a user turn does not wait behind a summary
+        self.max_background = max_background if max_background is not None else max(max_concurrency - 1, 1)
+        self.max_queue = max_queue
+        self.embed_window = embed_window
+        self.max_embed_batch = max_embed_batch
+        self.lock = threading.Lock()
+        self.waiters = tuple(collections.deque() for _ in self.PRIORITY_NAMES)
+        self.active = [0] * len(self.PRIORITY_NAMES)
+        self.in_flight: Dict[str, Future] = {}
+        self.embed_batches: Dict[str, _EmbedBatch] = {}
+        self.waits = tuple(collections.deque(maxlen=window) for _ in self.PRIORITY_NAMES)
+        self.admitted = [0] * len(self.PRIORITY_NAMES)
+        self.rejected = [0] * len(self.PRIORITY_NAMES)
+        self.coalesced = 0
+        self.embed_requests = 0
+        self.embed_texts = 0
+
+    def _dispatch(self):
+        """Hand free slots to waiters, interactive first (call with the lock held)"""
+        while sum(self.active) < self.max_concurrency:
+            if self.waiters[self.INTERACTIVE]:
+                priority = self.INTERACTIVE
+            elif self.waiters[self.BACKGROUND] and self.active[self.BACKGROUND] < self.max_background:
+                priority = self.BACKGROUND
+            else:
+                return
+            self.active[priority] += 1
+            self.waiters[priority].popleft().set()
+
+    def acquire(self, priority=INTERACTIVE):
+        """Wait for a request slot; returns a callable that gives it back"""
+        start = time.perf_counter()
+        granted = threading.Event()
+        with self.lock:
+            if len(self.waiters[priority]) >= self.max_queue[priority]:
+                self.rejected[priority] += 1
+                raise OllamaBusyError(f"{self.PRIORITY_NAMES[priority]} request queue is full")
+            self.waiters[priority].append(granted)
+            self._dispatch()
+        granted.wait()
+        wait = time.perf_counter() - start
+        with self.lock:
+            self.admitted[priority] += 1
+            self.waits[priority].append(wait)
+        get_metrics().observe(f"queue_wait_{self.PRIORITY_NAMES[priority]}", wait)
+
+        released = []
+        def release():
+            with self.lock:
+                if not released:
+                    released.append(True)
+                    self.active[priority] -= 1
+                    self._dispatch()
+        return release
+
+    def run(self, priority: int, send, key: Optional[str] = None):
+        """Run send() in a slot; concurrent calls with the same key share one request"""
+        if key is not None:
+            with self.lock:
+                future = self.in_flight.get(key)
+                owner = future is None
+                if owner:
+                    future = self.in_flight[key] = Future()
+                else:
+                    self.coalesced += 1
+            if not owner:
+                return future.result()
+
+        try:
+            release = self.acquire(priority)
+            try:
+                result = send()
+            finally:
+                release()
+        except BaseException as e:
+            if key is not None:
+                self._finish(key, exception=e)
+            raise
+        if key is not None:
+            self._finish(key, result=result)
+        return result
+
+    def _finish(self, key: str, result=None, exception=None):
+        with self.lock:
+            future = self.in_flight.pop(key)
+        if exception is not None:
+            future.set_exception(exception)
+        else:
+            future.set_result(result)
+
+    def embed(self, model: str, texts: List[str], send, priority=INTERACTIVE) -> np.ndarray:
+        """Embed texts together with other calls arriving within the batching window"""
+        with self.lock:
+            batch = self.embed_batches.get(model)
+            leader = batch is None or len(batch.texts) + len(texts) > self.max_embed_batch
+            if leader:
+                batch = self.embed_batches[model] = _EmbedBatch(priority)
+            # The batch goes out at the most urgent priority of its members
+            batch.priority = min(batch.priority, priority)
+            offset = len(batch.texts)
+            batch.texts.extend(texts)
+
+        if leader:
+            try:
+                time.sleep(self.embed_window)
+                with self.lock:
+                    if self.embed_batches.get(model) is batch:
+                        del self.embed_batches[model]
+                    self.embed_requests += 1
+                    self.embed_texts += len(batch.texts)
+                batch.future.set_result(send(model, batch.texts, batch.priority))
+            except BaseException as e:
+                # Followers block on the future, so it is resolved even on KeyboardInterrupt or SystemExit
+                with self.lock:
+                    if self.embed_batches.get(model) is batch:
+                        del self.embed_batches[model]
+                batch.future.set_exception(e)
+                if not isinstance(e, Exception):
+                    raise
+        return batch.future.result()[offset:offset + len(texts)]
+
+    def stats(self) -> Dict[str, Any]:
+        """Queue depth, admissions, rejections and wait-time percentiles per priority"""
+        with self.lock:
+            stats: Dict[str, Any] = {
+                "coalesced": self.coalesced,
+                "embed_requests": self.embed_requests,
+                "embed_texts": self.embed_texts
+            }
+            for priority, name in enumerate(self.PRIORITY_NAMES):
+                waits = sorted(self.waits[priority])
+                stats[name] = {
+                    "active": self.active[priority],
+                    "queued": len(self.waiters[priority]),
+                    "admitted": self.admitted[priority],
+                    "rejected": self.rejected[priority],
+                    "wait_p50_ms": round(waits[len(waits) // 2] * 1000, 1) if waits else 0.0,
+                    "wait_p95_ms": round(waits[int(len(waits) * 0.95)] * 1000, 1) if waits else 0.0
+                }
+        return stats
+
+class OllamaClient:
+    """Shared HTTP client for Ollama with a pooled keep-alive session"""
+    
+    RETRY_STATUSES = (502, 503, 504)
+    
+    def __init__(self, base_url="http://localhost:11434", pool_size=4, max_retries=2,
+                 backoff=0.25, connect_timeout=3.05, read_timeout=30,
+                 scheduler: Optional[RequestScheduler] = None):
+        self.base_url = base_url.rstrip("/")
+        # Optional: POSTs then wait for a slot in priority order
+        self.scheduler = scheduler
+        self.pool_size = pool_size
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.timeout = (connect_timeout, read_timeout)
+        self.retries = 0
+        
+        self.session = requests.Session()
+        self.session.headers.update({"Connection": "keep-alive"})
+        # Retries are handled in request() so they can be counted and jittered
+        self.adapter = requests.adapters.HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=pool_size,
+            max_retries=0
+        )
+        self.session.mount("http://", self.adapter)
+        self.session.mount("https://", self.adapter)
+        logger.info(f"Ollama client initialized for {self.base_url} (pool size {pool_size})")
+    
+    def request(self, method: str, path: str, timeout=None, priority=RequestScheduler.INTERACTIVE,
+                **kwargs) -> requests.Response:
+        """Send a request, through the scheduler if there is one"""
+        scheduler = self.scheduler
+        if scheduler is None or method != "POST":
+            return self._send(method, path, timeout, **kwargs)
+        
+        if kwargs.get("stream"):
+            # A streamed response keeps its slot until the caller closes it
+            release = scheduler.acquire(priority)
+            try:
+                response = self._send(method, path, timeout, **kwargs)
+            except BaseException:
+                release()
+                raise
+            close = response.close
+            def close_and_release():
+                try:
+                    close()
+                finally:
+                    release()
+            response.close = close_and_release
+            return response
+        
+        # Identical requests already in flight (e.g. the same prompt from two sessions) share one response
+        key = None
+        if "json" in kwargs:
+            body = json.dumps(kwargs["json"], sort_keys=True, ensure_ascii=False)
+            key = hashlib.sha1(f"{path}\n{body}".encode()).hexdigest()
+        return scheduler.run(priority, lambda: self._send(method, path, timeout, **kwargs), key)
+    
+    def _send(self, method: str, path: str, timeout=None, **kwargs) -> requests.Response:
+        """Send a request, retrying connection failures with jittered backoff"""
+        url = f"{self.base_url}{path}"
+        for attempt in range(self.max_retries + 1):
+            last_attempt = attempt == self.max_retries
+            try:
+                response = self.session.request(method, url, timeout=timeout or self.timeout, **kwargs)
+                if response.status_code not in self.RETRY_STATUSES or last_attempt:
+                    return response
+                response.close()
+                reason = f"status {response.status_code}"
+            except requests.exceptions.ConnectionError as e:
+                if last_attempt:
+                    raise
+                reason = str(e)
+            
+            delay = self.backoff * (2 ** attempt)
+            delay = random.uniform(delay / 2, delay)
+            self.retries += 1
+            logger.warning(f"Ollama request {path} failed ({reason}), retrying in {delay:.2f}s")
+            time.sleep(delay)
+    
+    def get(self, path: str, **kwargs) -> requests.Response:
+        """Send a GET request to Ollama"""
+        return self.request("GET", path, **kwargs)
+    
+    def post(self, path: str, **kwargs) -> requests.Response:
+        """Send a POST request to Ollama"""
+        return self.request("POST", path, **kwargs)
+    
+    def embed(self, model: str, texts: List[str], priority=RequestScheduler.INTERACTIVE) -> np.ndarray:
+        """Embed several texts in one request; rows are unit length"""
+        if self.scheduler is not None:
+            # Concurrent callers (cache lookups, memory search and indexing) share one request
+            return self.scheduler.embed(model, texts, self._embed, priority)
+        return self._embed(model, texts, priority)
+    
+    def _embed(self, model: str, texts: List[str], priority=RequestScheduler.INTERACTIVE) -> np.ndarray:
+        response = self.post("/api/embed", json={"model": model, "input": texts}, priority=priority)
+        if response.status_code == 404:
+            # Older Ollama servers only have the single-prompt endpoint
+            rows = []
+            for text in texts:
+                single = self.post("/api/embeddings", json={"model": model, "prompt": text}, priority=priority)
+                if single.status_code == 404:
+                    raise OllamaModelNotFoundError(f"Embedding model {model} is not available: {single.text}")
+                if single.status_code != 200:
+                    raise RuntimeError(f"Ollama embeddings error: {single.status_code} - {single.text}")
+                rows.append(single.json()["embedding"])
+        elif response.status_code != 200:
+            raise RuntimeError(f"Ollama embeddings error: {response.status_code} - {response.text}")
+        else:
+            rows = response.json()["embeddings"]
+        
+        matrix = np.asarray(rows, dtype=np.float32)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return matrix / norms
+    
+    def stats(self) -> Dict[str, int]:
+        """Connection reuse counters taken from the underlying pools"""
+        pools = self.adapter.poolmanager.pools
+        total_requests = 0
+        new_connections = 0
+        for key in pools.keys():
+            pool = pools[key]
+            total_requests += pool.num_requests
+            new_connections += pool.num_connections
         return {
-            "frame_shape": (height, width),
-            "timestamp": datetime.now().isoformat(),
-            "analysis": "video_analysis_complete"
+            "requests": total_requests,
+            "new_connections": new_connections,
+            "reused_connections": max(total_requests - new_connections, 0),
+            "retries": self.retries,
+            **({"scheduler": self.scheduler.stats()} if self.scheduler is not None else {})
         }
+    
+    def close(self):
+        """Close all pooled connections"""
+        self.session.close()
+
+_ollama_clients: Dict[str, OllamaClient] = {}
+_ollama_clients_lock = threading.Lock()
+
+def get_ollama_client(base_url="http://localhost:11434", **kwargs) -> OllamaClient:
+    """Return the process-wide Ollama client for a server URL"""
+    with _ollama_clients_lock:
+        client = _ollama_clients.get(base_url)
+        if client is None:
+            # Everything in the process shares this client, so it is where requests get scheduled
+            kwargs.setdefault("scheduler", RequestScheduler())
+            client = OllamaClient(base_url, **kwargs)
+            _ollama_clients[base_url] = client
+        return client
+
+class ResponseCache:
+    """Cache of LLM replies with an exact-match tier and an embedding-similarity tier"""
+    
+    def __init__(self, client: Optional[OllamaClient] = None, embedding_model="nomic-embed-text",
+                 max_entries=512, ttl=3600, similarity_threshold=0.92, max_input_words=12, semantic=True,
+                 retry_initial=5.0, retry_max=300.0):
+        self.client = client or get_ollama_client()
+        self.embedding_model = embedding_model
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.similarity_threshold = similarity_threshold
+        self.max_input_words = max_input_words
+        self.semantic = semantic
+        # After a transient embedding failure the semantic tier pauses, doubling up to retry_max
+        self.retry_initial = retry_initial
+        self.retry_max = retry_max
+        self.embed_backoff = 0.0
+        self.embed_retry_at = 0.0
+        self.lock = threading.Lock()
+        
+        # key -> (response, created, slot); order is LRU order
+        self.entries: "collections.OrderedDict[str, Tuple[str, float, int]]" = collections.OrderedDict()
+        # Unit-length embeddings, one row per slot, allocated on the first embedding
+        self.matrix: Optional[np.ndarray] = None
+        self.slot_scope = np.zeros(max_entries, dtype=np.int64)
+        self.slot_used = np.zeros(max_entries, dtype=bool)
+        self.slot_keys: List[Optional[str]] = [None] * max_entries
+        self.free_slots = list(range(max_entries - 1, -1, -1))
+        self.pending_embeddings: Dict[str, np.ndarray] = {}
+        
+        self.exact_hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        self.evictions = 0
+    
+    @staticmethod
+    def normalize(text: str) -> str:
+        """Lowercase, drop punctuation and collapse whitespace"""
+        text = re.sub(r"[^\w\s]", " ", text.lower())
+        return " ".join(text.split())
+    
+    @staticmethod
+    def _scope(personality: str, model: str) -> int:
+        digest = hashlib.sha1(f"{personality}\0{model}".encode("utf-8")).digest()
+        return int.from_bytes(digest[:8], "little", signed=True)
+    
+    def _key(self, normalized: str, scope: int) -> str:
+        return f"{scope}:{normalized}"
+    
+    def cacheable(self, user_input: str) -> bool:
+        """Only short, self-contained turns are worth caching"""
+        words = len(self.normalize(user_input).split())
+        return 0 < words <= self.max_input_words
+    
+    def get(self, user_input: str, personality: str, model: str) -> Optional[str]:
+        """Return a cached reply for this input, or None"""
+        if not self.cacheable(user_input):
+            return None
+        normalized = self.normalize(user_input)
+        scope = self._scope(personality, model)
+        key = self._key(normalized, scope)
+        
+        with self.lock:
+            response = self._lookup(key)
+            if response is not None:
+                self.exact_hits += 1
+                return response
+        
+        if self.semantic:
+            embedding = self._embed(normalized)
+            if embedding is not None:
+                with self.lock:
+                    # Kept for the put() that follows a miss; bounded in case it never comes
+                    if len(self.pending_embeddings) >= 64:
+                        self.pending_embeddings.clear()
+                    self.pending_embeddings[key] = embedding
+                    response = self._nearest(embedding, scope)
+                    if response is not None:
+                        self.semantic_hits += 1
+                        return response
+        
+        with self.lock:
+            self.misses += 1
+        return None
+    
+    def put(self, user_input: str, personality: str, model: str, response: str):
+        """Remember the reply generated for this input"""
+        if not self.cacheable(user_input) or not response:
+            return
+        normalized = self.normalize(user_input)
+        scope = self._scope(personality, model)
+        key = self._key(normalized, scope)
+        
+        with self.lock:
+            embedding = self.pending_embeddings.pop(key, None)
+        if embedding is None and self.semantic:
+            embedding = self._embed(normalized)
+        
+        with self.lock:
+            self._remove(key)
+            if not self.free_slots:
+                oldest = next(iter(self.entries))
+                self._remove(oldest)
+                self.evictions += 1
+            slot = self.free_slots.pop()
+            self.entries[key] = (response, time.monotonic(), slot)
+            self.slot_keys[slot] = key
+            self.slot_scope[slot] = scope
+            if embedding is not None and self.matrix is not None:
+                self.matrix[slot] = embedding
+                self.slot_used[slot] = True
+    
+    def _lookup(self, key: str) -> Optional[str]:
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        response, created, _ = entry
+        if time.monotonic() - created > self.ttl:
+            self._remove(key)
+            return None
+        self.entries.move_to_end(key)
+        return response
+    
+    def _nearest(self, embedding: np.ndarray, scope: int) -> Optional[str]:
+        if self.matrix is None:
+            return None
+        candidates = np.flatnonzero(self.slot_used & (self.slot_scope == scope))
+        if not candidates.size:
+            return None
+        similarities = self.matrix[candidates] @ embedding
+        best = int(np.argmax(similarities))
+        if similarities[best] < self.similarity_threshold:
+            return None
+        return self._lookup(self.slot_keys[candidates[best]])
+    
+    def _remove(self, key: str):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            slot = entry[2]
+            self.slot_used[slot] = False
+            self.slot_keys[slot] = None
+            self.free_slots.append(slot)
+    
+    def _embed(self, text: str) -> Optional[np.ndarray]:
+        """Unit-length embedding from Ollama, or None if embeddings are unavailable"""
+        if time.monotonic() < self.embed_retry_at:
+            return None
+        try:
+            embedding = self.client.embed(self.embedding_model, [text])[0]
+        except OllamaModelNotFoundError as e:
+            logger.warning(f"Embeddings unavailable, semantic response cache disabled: {e}")
+            self.semantic = False
+            return None
+        except Exception as e:
+            # Ollama still starting or the scheduler queue full: only the exact tier answers for a while
+            self.embed_backoff = min(self.embed_backoff * 2 or self.retry_initial, self.retry_max)
+            self.embed_retry_at = time.monotonic() + self.embed_backoff
+            logger.warning(f"Embedding failed, semantic cache paused for {self.embed_backoff:.0f} s: {e}")
+            return None
+        self.embed_backoff = 0.0
+        
+        if not embedding.any():
+            return None
+        with self.lock:
+            if self.matrix is None:
+                self.matrix = np.zeros((self.max_entries, embedding.size), dtype=np.float32)
+            elif self.matrix.shape[1] != embedding.size:
+                return None
+        return embedding
+    
+    def stats(self) -> Dict[str, Any]:
+        """Hit/miss counters"""
+        lookups = self.exact_hits + self.semantic_hits + self.misses
+        return {
+            "entries": len(self.entries),
+            "exact_hits": self.exact_hits,
+            "semantic_hits": self.semantic_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": (self.exact_hits + self.semantic_hits) / lookups if lookups else 0.0
+        }
+
+class ModelTier:
+    """One routing tier: a model, its concurrency limit and latency samples"""
+    
+    def __init__(self, name: str, model: str, max_concurrency=1, slow_after=10.0, window=256):
+        self.name = name
+        self.model = model
+        self.max_concurrency = max_concurrency
+        # A call slower than this marks the tier degraded for a while
+        self.slow_after = slow_after
+        self.semaphore = threading.BoundedSemaphore(max_concurrency)
+        self.latencies: "collections.deque[float]" = collections.deque(maxlen=window)
+        self.first_token_latencies: "collections.deque[float]" = collections.deque(maxlen=window)
+        self.degraded_until = 0.0
+        self.requests = 0
+        self.errors = 0
+        self.fallbacks = 0
+    
+    @property
+    def degraded(self) -> bool:
+        return time.monotonic() < self.degraded_until
+    
+    def stats(self) -> Dict[str, Any]:
+        stats = {
+            "model": self.model,
+            "requests": self.requests,
+            "errors": self.errors,
+            "fallbacks": self.fallbacks,
+            "degraded": self.degraded,
+        }
+        for label, samples in (("latency", self.latencies), ("first_token", self.first_token_latencies)):
+            if samples:
+                p50, p95 = np.percentile(np.fromiter(samples, dtype=np.float64), [50, 95])
+                stats[f"{label}_p50_s"] = round(float(p50), 3)
+                stats[f"{label}_p95_s"] = round(float(p95), 3)
+        return stats
+
+class ModelRouter:
+    """Picks a fast or slow model per turn from cheap features of the input"""
+    
+    FAST = "fast"
+    SLOW = "slow"
+    # Words that usually ask for reasoning, long answers or code
+    COMPLEX_KEYWORDS = (
+        "zakaj", "razloži", "pojasni", "primerjaj", "analiziraj", "napiši", "izračunaj",
+        "povzemi", "prevedi", "opiši", "koda", "program", "načrt", "kako deluje"
+    )
+    
+    def __init__(self, client: Optional[OllamaClient] = None, fast_model="llama3.2:1b", slow_model="mistral",
+                 max_fast_words=12, fast_concurrency=2, slow_concurrency=1, fast_slow_after=3.0,
+                 slow_slow_after=20.0, degraded_cooldown=60.0, queue_timeout=2.0, tags_ttl=60.0):
+        self.client = client or get_ollama_client()
+        self.tiers = {
+            self.FAST: ModelTier(self.FAST, fast_model, fast_concurrency, fast_slow_after),
+            self.SLOW: ModelTier(self.SLOW, slow_model, slow_concurrency, slow_slow_after),
+        }
+        self.max_fast_words = max_fast_words
+        self.degraded_cooldown = degraded_cooldown
+        self.queue_timeout = queue_timeout
+        self.complex_pattern = re.compile(
+            r"\b(?:" + "|".join(re.escape(word) for word in self.COMPLEX_KEYWORDS) + r")", re.IGNORECASE
+        )
+        self.tags_ttl = tags_ttl
+        self.available: Optional[set] = None
+        self.tags_checked = 0.0
+        self.lock = threading.Lock()
+    
+    def classify(self, user_input: str) -> str:
+        """Tier for an input: short chit-chat goes to the fast model"""
+        words = user_input.split()
+        if len(words) > self.max_fast_words or self.complex_pattern.search(user_input):
+            return self.SLOW
+        return self.FAST
+    
+    def _other(self, tier: ModelTier) -> ModelTier:
+        return self.tiers[self.SLOW if tier.name == self.FAST else self.FAST]
+    
+    def _refresh_models(self):
+        """Re-read the installed models from /api/tags at most once per TTL"""
+        # Only claiming the refresh happens under the lock; the HTTP call does not,
+        # so other turns keep routing on the previous list meanwhile
+        with self.lock:
+            now = time.monotonic()
+            if now - self.tags_checked < self.tags_ttl:
+                return
+            self.tags_checked = now
+        try:
+            response = self.client.get("/api/tags", timeout=5)
+            if response.status_code == 200:
+                names = {model["name"] for model in response.json().get("models", [])}
+                # "mistral" and "mistral:latest" name the same model
+                available = names | {name[:-len(":latest")] for name in names if name.endswith(":latest")}
+                with self.lock:
+                    self.available = available
+        except requests.exceptions.RequestException as e:
+            logger.warning(f"Could not list Ollama models: {e}")
+    
+    def is_available(self, model: str) -> bool:
+        """Whether Ollama has the model; unknown until /api/tags answers"""
+        self._refresh_models()
+        with self.lock:
+            return self.available is None or model in self.available
+    
+    def route(self, user_input: str) -> ModelTier:
+        """Tier for a turn, falling back when its model is missing or degraded"""
+        tier = self.tiers[self.classify(user_input)]
+        if not self.is_available(tier.model) or tier.degraded:
+            other = self._other(tier)
+            if self.is_available(other.model) and not other.degraded:
+                logger.info(f"Routing to {other.model}: {tier.model} is {'degraded' if tier.degraded else 'not installed'}")
+                tier.fallbacks += 1
+                return other
+        return tier
+    
+    def acquire(self, tier: ModelTier) -> ModelTier:
+        """Take a slot on a tier; spill to the other tier if it stays full"""
+        if tier.semaphore.acquire(timeout=self.queue_timeout):
+            return tier
+        other = self._other(tier)
+        if self.is_available(other.model) and other.semaphore.acquire(blocking=False):
+            tier.fallbacks += 1
+            return other
+        tier.semaphore.acquire()
+        return tier
+    
+    def release(self, tier: ModelTier, latency: float, first_token: Optional[float] = None, error=False):
+        """Free the slot and record how the call went"""
+        tier.semaphore.release()
+        tier.requests += 1
+        tier.latencies.append(latency)
+        if first_token is not None:
+            tier.first_token_latencies.append(first_token)
+        if error:
+            tier.errors += 1
+        # Streaming calls are judged by time to first token, whole calls by latency
+        measured = first_token if first_token is not None else latency
+        if error or measured > tier.slow_after:
+            tier.degraded_until = time.monotonic() + self.degraded_cooldown
+            logger.warning(f"Model {tier.model} marked degraded ({'error' if error else f'{measured:.1f} s'})")
+    
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        """Per-tier request counts and latency percentiles"""
+        return {name: tier.stats() for name, tier in self.tiers.items()}
+
+class ModelWarmup:
+    """Loads models before the first turn and keeps them resident with keep_alive"""
+    
+    def __init__(self, client: Optional[OllamaClient] = None, keep_alive="30m", prefill_prompt="Živjo",
+                 conversation: Optional["ConversationModule"] = None):
+        self.client = client or get_ollama_client()
+        # Ollama duration string ("30m"), seconds, or -1 to keep the model loaded indefinitely
+        self.keep_alive = keep_alive
+        self.prefill_prompt = prefill_prompt
+        # With a conversation the prefill is the prefix its real turns start with
+        self.conversation = conversation
+    
+    def first_token(self, model: str) -> Tuple[float, Dict[str, Any]]:
+        """Time to the first streamed chunk of a one-token prefill, plus the final chunk"""
+        prompt, fields = (self.conversation.prefill_request(self.prefill_prompt) if self.conversation
+                          else (self.prefill_prompt, {}))
+        start = time.perf_counter()
+        first = None
+        final: Dict[str, Any] = {}
+        response = self.client.post(
+            "/api/generate",
+            json={
+                "model": model,
+                "prompt": prompt,
+                **fields,
+                "stream": True,
+                "keep_alive": self.keep_alive,
+                "options": {"num_predict": 1}
+            },
+            stream=True,
+            # Loading a large model can take far longer than a normal read
+            timeout=(self.client.timeout[0], 300)
+        )
+        with response:
+            response.raise_for_status()
+            for line in response.iter_lines():
+                if not line:
+                    continue
+                if first is None:
+                    first = time.perf_counter() - start
+                data = json.loads(line)
+                if "error" in data:
+                    raise RuntimeError(data["error"])
+                if data.get("done"):
+                    final = data
+                    break
+        return (first if first is not None else time.perf_counter() - start), final
+    
+    def warm_up(self, models: Iterable[str]) -> Dict[str, Dict[str, Any]]:
+        """Load, pin and prime each model; report cold vs. warm first-token latency"""
+        report = {}
+        for model in dict.fromkeys(models):
+            try:
+                # The first request pays the load and leaves the prompt prefix cached
+                cold, final = self.first_token(model)
+                warm, _ = self.first_token(model)
+            except Exception as e:
+                logger.warning(f"Warm-up of {model} failed: {e}")
+                report[model] = {"error": str(e)}
+                continue
+            report[model] = {
+                "cold_first_token_ms": round(cold * 1000, 1),
+                "warm_first_token_ms": round(warm * 1000, 1),
+                "load_ms": round(final.get("load_duration", 0) / 1e6, 1),
+                "keep_alive": self.keep_alive
+            }
+            logger.info(
+                f"Warmed up {model}: first token {cold * 1000:.0f} ms cold, {warm * 1000:.0f} ms warm "
+                f"(load {report[model]['load_ms']:.0f} ms, keep_alive {self.keep_alive})"
+            )
+        return report
+
+class Turn:
+    """One exchange in the conversation history"""
+    
+    __slots__ = ("user", "response", "timestamp", "modality", "tokens")
+    
+    def __init__(self, user: str, response: str, timestamp: Optional[float] = None, modality: str = "text"):
+        self.user = user
+        self.response = response
+        self.timestamp = time.time() if timestamp is None else timestamp
+        # Only a handful of distinct values, so every turn shares the same string
+        self.modality = sys.intern(modality)
+        self.tokens: Optional[int] = None
+    
+    def get(self, key: str, default=None):
+        """Dict-style access, so turns work where exchange dicts were used"""
+        return getattr(self, key) if key in self.__slots__ else default
+    
+    def __getitem__(self, key: str):
+        if key not in self.__slots__:
+            raise KeyError(key)
+        return getattr(self, key)
+    
+    def to_dict(self) -> Dict[str, Any]:
+        return {"user": self.user, "response": self.response, "timestamp": self.timestamp, "modality": self.modality}
+
+class ConversationHistory:
+    """Bounded ring buffer of turns; the oldest turns spill to a JSON-lines file"""
+    
+    def __init__(self, capacity=1000, spill_path: Optional[str] = None, encryption: Optional["Encryption"] = None):
+        self.capacity = capacity
+        self.spill_path = spill_path
+        # Spilled turns are written as one sealed base64 line each when set
+        self.encryption = encryption
+        self.spill_batch = max(1, capacity // 10)
+        self.turns: "collections.deque[Turn]" = collections.deque()
+        if spill_path:
+            os.makedirs(os.path.dirname(os.path.abspath(spill_path)), exist_ok=True)
+        # Number of turns that left memory; indices stay global across spills
+        self.spilled = 0
+        self.lock = threading.Lock()
+        # Called with every new turn (e.g. to journal it)
+        self.on_append = None
+    
+    @property
+    def first_index(self) -> int:
+        """Global index of the oldest turn still in memory"""
+        return self.spilled
+    
+    def append(self, user: str, response: str, modality: str = "text", timestamp: Optional[float] = None) -> Turn:
+        """Add a turn, spilling the oldest ones once the buffer is full"""
+        turn = Turn(user, response, timestamp, modality)
+        with self.lock:
+            self.turns.append(turn)
+            if len(self.turns) > self.capacity:
+                self._spill([self.turns.popleft() for _ in range(self.spill_batch)])
+            # Still under the lock, so a snapshot sees either the turn and its journal
+            # record or neither of them
+            if self.on_append is not None:
+                self.on_append(turn)
+        return turn
+    
+    def snapshot(self) -> Dict[str, Any]:
+        """Turns in memory and the spill count, for a session snapshot"""
+        with self.lock:
+            return {"spilled": self.spilled, "turns": [turn.to_dict() for turn in self.turns]}
+    
+    def restore(self, turns: List[Dict[str, Any]], spilled=0):
+        """Replace the history with saved turns; ones beyond capacity count as spilled
+        (they were written to the spill file when they first overflowed)"""
+        with self.lock:
+            overflow = max(len(turns) - self.capacity, 0)
+            self.turns = collections.deque(
+                Turn(t["user"], t["response"], t.get("timestamp"), t.get("modality", "text")) for t in turns[overflow:]
+            )
+            self.spilled = spilled + overflow
+    
+    def _spill(self, turns: List[Turn]):
+        self.spilled += len(turns)
+        if self.spill_path is None:
+            return
+        try:
+            lines = [json.dumps(turn.to_dict(), ensure_ascii=False) for turn in turns]
+            if self.encryption is not None:
+                lines = [self.encryption.seal_text(line, "history") for line in lines]
+            with open(self.spill_path, "a", encoding="utf-8") as f:
+                f.write("".join(line + "\n" for line in lines))
+        except OSError as e:
+            logger.warning(f"Could not spill conversation history: {e}")
+    
+    def clear(self):
+        """Forget all turns"""
+        with self.lock:
+            self.turns.clear()
+            self.spilled = 0
+    
+    def __len__(self) -> int:
+        return self.spilled + len(self.turns)
+    
+    def __iter__(self) -> Iterator[Turn]:
+        return iter(list(self.turns))
+    
+    def __getitem__(self, index):
+        """Global indexing; slices are clamped to the turns still in memory"""
+        with self.lock:
+            total = self.spilled + len(self.turns)
+            if isinstance(index, slice):
+                start, stop, step = index.indices(total)
+                start = max(start, self.spilled)
+                return [self.turns[i - self.spilled] for i in range(start, stop, step)]
+            if index < 0:
+                index += total
+            if not self.spilled <= index < total:
+                raise IndexError("turn is not in memory")
+            return self.turns[index - self.spilled]
 
 class ConversationModule:
     """Main conversation module for MIA using Ollama LLM"""
     
-    def __init__(self, ollama_url="http://localhost:11434"):
+    MODES = ("prompt", "context")
+    
+    # Fallback replies spoken when a turn cannot be answered
+    PROCESSING_ERROR = "Oprostite, prišlo je do napake pri obdelavi vašega vprašanja."
+    LLM_UNAVAILABLE = "Oprostite, trenutno ni mogoče povezati z LLM modelom."
+    LLM_NOT_RUNNING = "Oprostite, trenutno ni mogoče povezati z LLM modelom. Preverite, ali je Ollama zagnan."
+    GENERATION_ERROR = "Oprostite, prišlo je do napake pri generiranju odgovora."
+    LLM_BUSY = "Oprostite, trenutno sem preobremenjena. Poskusite znova čez trenutek."
+    FALLBACK_REPLIES = (PROCESSING_ERROR, LLM_UNAVAILABLE, LLM_NOT_RUNNING, GENERATION_ERROR, LLM_BUSY)
+    
+    def __init__(self, ollama_url="http://localhost:11434", streaming=True, client=None, mode="prompt",
+                 response_cache: Optional[ResponseCache] = None, memory_store: Optional["MemoryStore"] = None,
+                 history: Optional[ConversationHistory] = None, router: Optional[ModelRouter] = None,
+                 keep_alive=None, max_context_tokens=4096):
+        if mode not in self.MODES:
+            raise ValueError(f"Unknown conversation mode: {mode}")
         self.ollama_url = ollama_url
-        self.conversation_history = []
-        self.context_manager = ContextManager()
+        self.client = client or get_ollama_client(ollama_url)
+        self.response_cache = response_cache
+        self.streaming = streaming
+        # "prompt" rebuilds the full text prompt every turn, "context" sends only
+        # the new turn together with the KV-cache tokens Ollama returned last time
+        self.mode = mode
+        # KV-cache tokens per model (they are only valid for the model that produced them);
+        # a context longer than max_context_tokens is dropped and the next turn re-seeds it
+        self.ollama_contexts: Dict[str, List[int]] = {}
+        self.max_context_tokens = max_context_tokens
+        # Model of the last context-mode request, whose tokens the reply carries
+        self.context_model = None
+        # Perceptual hashes of images already inside the vision model's KV-cache context
+        self.context_images = set()
+        # Sent with every request so idle gaps do not unload the model (None: Ollama default)
+        self.keep_alive = keep_alive
+        self.last_timings = {}
+        # One history store shared with the context manager and memory
+        self.conversation_history = history if history is not None else ConversationHistory()
+        self.context_manager = ContextManager(
+            summarizer=RollingSummarizer(self.client, keep_alive=keep_alive),
+            memory=Memory(store=memory_store, history=self.conversation_history)
+        )
         self.personality = "lahka ženska, prijazna, pomožna, neomejena v pogovorih"
         self.model_name = "mistral"
-        logger.info("Conversation module initialized with Ollama")
+        self.vision_model = "llava"
+        # Optional fast/slow model routing; without it every turn uses model_name
+        self.router = router
+        logger.info(f"Conversation module initialized with Ollama ({mode} mode)")
     
-    def process_input(self, user_input: str, modality: str = "text") -> str:
+    def process_input(self, user_input: str, modality: str = "text", images: Optional[List[str]] = None) -> str:
         """Process user input and generate response using Ollama"""
+        tier = None
+        start = None
+        # Only the model call counts against the tier; a local bug must not push traffic to the other model
+        failed = False
         try:
-            # Update context
-            context = self.context_manager.get_context(self.conversation_history)
+            # Turns with images (base64 JPEGs) always go to the vision model; an empty
+            # list means the images are already in the KV-cache context
+            vision = images is not None
+            tier = self.router.route(user_input) if self.router and not vision else None
+            # Common turns are answered from the cache without the LLM
+            cached = None if vision else self._cached_response(user_input, tier.model if tier else self.model_name)
+            if cached is not None:
+                self._record_exchange(user_input, cached, modality)
+                return cached
+            
+            if tier is not None:
+                tier = self.router.acquire(tier)
+                start = time.perf_counter()
+            model = tier.model if tier else (self.vision_model if vision else self.model_name)
             
             # Prepare prompt
-            prompt = self._prepare_prompt(user_input, context)
+            prompt, options = self._prepare_request(user_input, model)
+            if images:
+                options["images"] = images
             
             # Generate response using Ollama
-            response = self._generate_response_with_ollama(prompt)
+            response = self._generate_response_with_ollama(prompt, model, **options)
+            failed = response in self.FALLBACK_REPLIES
+            if not vision:
+                self._cache_response(user_input, response, model)
             
             # Update conversation history
-            self.conversation_history.append({
-                "user": user_input,
-                "response": response,
-                "timestamp": datetime.now().isoformat()
-            })
+            self._record_exchange(user_input, response, modality)
             
             return response
             
         except Exception as e:
             logger.error(f"Error in conversation processing: {e}")
-            return "Oprostite, prišlo je do napake pri obdelavi vašega vprašanja."
+            failed = isinstance(e, (requests.exceptions.RequestException, OllamaBusyError))
+            return self.PROCESSING_ERROR
+        finally:
+            # The slot goes back even when preparing or sending the request raised
+            if start is not None:
+                self.router.release(tier, time.perf_counter() - start, error=failed)
+    
+    def stream_input(self, user_input: str, modality: str = "text", images: Optional[List[str]] = None
+                     ) -> Iterator[str]:
+        """Process user input and yield the response sentence by sentence"""
+        splitter = SentenceSplitter()
+        chunks = []
+        tier = None
+        start = first_token = None
+        failed = False
+        vision = images is not None
+        try:
+            tier = self.router.route(user_input) if self.router and not vision else None
+            cached = None if vision else self._cached_response(user_input, tier.model if tier else self.model_name)
+            if cached is not None:
+                chunks.append(cached)
+                yield from splitter.feed(cached)
+                yield from splitter.flush()
+                self._record_exchange(user_input, cached, modality)
+                return
+            
+            if tier is not None:
+                tier = self.router.acquire(tier)
+                start = time.perf_counter()
+            model = tier.model if tier else (self.vision_model if vision else self.model_name)
+            prompt, options = self._prepare_request(user_input, model)
+            if images:
+                options["images"] = images
+            
+            for chunk in self._stream_response_with_ollama(prompt, model, **options):
+                if first_token is None and start is not None:
+                    first_token = time.perf_counter() - start
+                chunks.append(chunk)
+                yield from splitter.feed(chunk)
+            yield from splitter.flush()
+            
+        except Exception as e:
+            logger.error(f"Error in conversation processing: {e}")
+            failed = isinstance(e, (requests.exceptions.RequestException, OllamaBusyError))
+            yield self.PROCESSING_ERROR
+            return
+        finally:
+            # The slot is freed even when the consumer abandons the stream (barge-in)
+            if start is not None:
+                failed = failed or any(chunk in self.FALLBACK_REPLIES for chunk in chunks)
+                self.router.release(tier, time.perf_counter() - start, first_token, failed)
+        
+        response = "".join(chunks)
+        if not vision:
+            self._cache_response(user_input, response, model)
+        self._record_exchange(user_input, response, modality)
+    
+    def select_model(self, user_input: str) -> str:
+        """Model that should answer an input"""
+        return self.router.route(user_input).model if self.router else self.model_name
+    
+    def _cached_response(self, user_input: str, model: str) -> Optional[str]:
+        """Look the input up in the response cache, if one is configured"""
+        if self.response_cache is None:
+            return None
+        start = time.perf_counter()
+        cached = self.response_cache.get(user_input, self.personality, model)
+        if cached is not None:
+            logger.info(f"Response cache hit in {(time.perf_counter() - start) * 1000:.1f} ms")
+        return cached
+    
+    def _cache_response(self, user_input: str, response: str, model: str):
+        """Store a generated reply; fallback error replies are never cached"""
+        if self.response_cache is None or not response:
+            return
+        if not any(fallback in response for fallback in self.FALLBACK_REPLIES):
+            self.response_cache.put(user_input, self.personality, model, response)
+    
+    def _record_exchange(self, user_input: str, response: str, modality: str = "text"):
+        """Append a finished exchange to the conversation history"""
+        self.context_manager.memory.store_conversation(user_input, response, modality)
+    
+    def reset_context(self, model: Optional[str] = None):
+        """Forget the Ollama KV-cache tokens (of one model, or all) so the next turn starts a fresh prefix"""
+        if model is None:
+            self.ollama_contexts.clear()
+        else:
+            self.ollama_contexts.pop(model, None)
+        if model is None or model == self.vision_model:
+            self.context_images = set()
+    
+    def _prepare_request(self, user_input: str, model: Optional[str] = None) -> Tuple[str, Dict[str, Any]]:
+        """Build the prompt and extra Ollama request fields for the current mode"""
+        with get_metrics().span("context", mode=self.mode):
+            return self._build_request(user_input, model)
+    
+    def _build_request(self, user_input: str, model: Optional[str]) -> Tuple[str, Dict[str, Any]]:
+        if self.mode == "context":
+            model = model or self.model_name
+            self.context_model = model
+            context = self.ollama_contexts.get(model)
+            if context:
+                return user_input, self._request_options(context=context)
+            # A fresh context (first turn on this model, or after a trim) is seeded with the
+            # recent history, so switching models or trimming does not lose the conversation;
+            # the system message is only sent here, later turns extend the cached prefix
+            prompt = user_input
+            if len(self.conversation_history):
+                prompt = f"{self.context_manager.get_context(self.conversation_history)}Uporabnik: {user_input}"
+            return prompt, self._request_options(system=self.system_message)
+        
+        context = self.context_manager.get_context(self.conversation_history)
+        # Related exchanges from long-term memory that are not already in the context
+        memories = [
+            memory for memory in self.context_manager.memory.recall(user_input)
+            if memory["user"] not in context
+        ]
+        return self._prepare_prompt(user_input, context, memories), self._request_options()
+    
+    def _request_options(self, **options) -> Dict[str, Any]:
+        if self.keep_alive is not None:
+            options["keep_alive"] = self.keep_alive
+        return options
+    
+    def _handle_final_response(self, data: Dict[str, Any]):
+        """Keep the returned context tokens and log prefill vs. eval timings"""
+        if self.mode == "context" and data.get("context") and self.context_model:
+            if len(data["context"]) > self.max_context_tokens:
+                logger.info(f"KV-cache context of {self.context_model} reached {len(data['context'])} tokens, "
+                            f"re-seeding it from the history")
+                self.reset_context(self.context_model)
+            else:
+                self.ollama_contexts[self.context_model] = data["context"]
+        
+        timings = {
+            "prompt_eval_count": data.get("prompt_eval_count", 0),
+            "prompt_eval_ms": data.get("prompt_eval_duration", 0) / 1e6,
+            "eval_count": data.get("eval_count", 0),
+            "eval_ms": data.get("eval_duration", 0) / 1e6,
+            "total_ms": data.get("total_duration", 0) / 1e6,
+            "load_ms": data.get("load_duration", 0) / 1e6
+        }
+        self.last_timings = timings
+        metrics = get_metrics()
+        if metrics.enabled:
+            model = data.get("model", self.model_name)
+            metrics.observe("llm_prefill", timings["prompt_eval_ms"] / 1000, model=model,
+                            tokens=timings["prompt_eval_count"])
+            metrics.observe("llm_eval", timings["eval_ms"] / 1000, model=model, tokens=timings["eval_count"])
+            if timings["load_ms"]:
+                metrics.observe("llm_load", timings["load_ms"] / 1000, model=model)
+        tokens_per_second = timings["eval_count"] / (timings["eval_ms"] / 1000) if timings["eval_ms"] else 0.0
+        logger.info(
+            f"Ollama timings: prefill {timings['prompt_eval_count']} tokens in {timings['prompt_eval_ms']:.0f} ms, "
+            f"eval {timings['eval_count']} tokens in {timings['eval_ms']:.0f} ms ({tokens_per_second:.1f} tok/s), "
+            f"load {timings['load_ms']:.0f} ms, total {timings['total_ms']:.0f} ms"
+        )
+    
+    @property
+    def system_message(self) -> str:
+        """Identity sent as the system message in context mode"""
+        return f"Tvoj identitetni profil: {self.personality}"
+    
+    @property
+    def prompt_prefix(self) -> str:
+        """Start of every prompt-mode prompt, identical across turns so Ollama reuses its KV cache"""
+        return f"""
+        {self.system_message}
+        """
+    
+    def prepare_turn(self, user_input: str) -> Tuple[str, str, Dict[str, Any]]:
+        """Model, prompt and request fields for a turn another client sends to Ollama (e.g. the async server)"""
+        model = self.select_model(user_input)
+        prompt, options = self._prepare_request(user_input, model)
+        return model, prompt, options
     
-    def _prepare_prompt(self, user_input: str, context: Dict) -> str:
+    def finish_turn(self, user_input: str, response: str, final: Optional[Dict[str, Any]] = None,
+                    modality: str = "text"):
+        """Record a turn prepared with prepare_turn, given Ollama's final response chunk"""
+        if final:
+            self._handle_final_response(final)
+        self._record_exchange(user_input, response, modality)
+    
+    def prefill_request(self, greeting="Živjo") -> Tuple[str, Dict[str, Any]]:
+        """Prompt and request fields that share the prefix of real turns, for warming a model"""
+        if self.mode == "context":
+            return greeting, {"system": self.system_message}
+        return self.prompt_prefix, {}
+    
+    def _prepare_prompt(self, user_input: str, context: Dict, memories: Optional[List[Dict]] = None) -> str:
         """Prepare prompt for the Ollama model"""
-        prompt = f"""
-        Tvoj identitetni profil: {self.personality}
+        recalled = ""
+        if memories:
+            recalled = "Spomini iz prejšnjih pogovorov: " + " | ".join(
+                f"Uporabnik: {memory['user']} Asistent: {memory['response']}" for memory in memories
+            )
+        prompt = f"""{self.prompt_prefix}{recalled}
         Kontekst pogovora: {context}
         Uporabnik: {user_input}
         Odgovor:
         """
         return prompt
     
-    def _generate_response_with_ollama(self, prompt: str) -> str:
+    def _generate_response_with_ollama(self, prompt: str, model: Optional[str] = None, **options) -> str:
         """Generate response using Ollama LLM"""
         try:
             # Check if Ollama server is available
-            response = requests.post(
-                f"{self.ollama_url}/api/generate",
+            response = self.client.post(
+                "/api/generate",
                 json={
-                    "model": self.model_name,
+                    "model": model or self.model_name,
                     "prompt": prompt,
-                    "stream": False
-                },
-                timeout=30
+                    "stream": False,
+                    **options
+                }
             )
             
             if response.status_code == 200:
                 data = response.json()
+                self._handle_final_response(data)
                 return data.get("response", "Nisem razumel vašega vprašanja.")
             else:
                 logger.error(f"Ollama error: {response.status_code} - {response.text}")
-                return "Oprostite, trenutno ni mogoče povezati z LLM modelom."
+                return self.LLM_UNAVAILABLE
+                
+        except requests.exceptions.RequestException as e:
+            logger.error(f"Ollama connection error: {e}")
+            return self.LLM_NOT_RUNNING
+        except OllamaBusyError as e:
+            logger.warning(f"Ollama request rejected: {e}")
+            return self.LLM_BUSY
+        except Exception as e:
+            logger.error(f"Error in Ollama generation: {e}")
+            return self.GENERATION_ERROR
+    
+    def _stream_response_with_ollama(self, prompt: str, model: Optional[str] = None, **options) -> Iterator[str]:
+        """Yield response tokens from Ollama's NDJSON stream as they are generated"""
+        try:
+            start = time.perf_counter()
+            response = self.client.post(
+                "/api/generate",
+                json={
+                    "model": model or self.model_name,
+                    "prompt": prompt,
+                    "stream": True,
+                    **options
+                },
+                stream=True
+            )
+            
+            with response:
+                if response.status_code != 200:
+                    logger.error(f"Ollama error: {response.status_code} - {response.text}")
+                    yield self.LLM_UNAVAILABLE
+                    return
+                
+                first_token = True
+                for line in response.iter_lines():
+                    if not line:
+                        continue
+                    data = json.loads(line)
+                    if "error" in data:
+                        logger.error(f"Ollama error: {data['error']}")
+                        yield self.GENERATION_ERROR
+                        return
+                    token = data.get("response", "")
+                    if token:
+                        if first_token:
+                            first_token = False
+                            elapsed = time.perf_counter() - start
+                            get_metrics().observe("first_token", elapsed, model=model or self.model_name)
+                            logger.info(f"Time to first token: {elapsed * 1000:.0f} ms")
+                        yield token
+                    if data.get("done"):
+                        self._handle_final_response(data)
+                        break
                 
         except requests.exceptions.RequestException as e:
             logger.error(f"Ollama connection error: {e}")
-            return "Oprostite, trenutno ni mogoče povezati z LLM modelom. Preverite, ali je Ollama zagnan."
+            yield self.LLM_NOT_RUNNING
+        except OllamaBusyError as e:
+            logger.warning(f"Ollama request rejected: {e}")
+            yield self.LLM_BUSY
         except Exception as e:
             logger.error(f"Error in Ollama generation: {e}")
-            return "Oprostite, prišlo je do napake pri generiranju odgovora."
+            yield self.GENERATION_ERROR
+
+def approx_tokens(text: str) -> int:
+    """Rough token count: one token per 4 characters of a word, one per punctuation mark"""
+    return sum((len(piece) + 3) // 4 for piece in TOKEN_PIECE.findall(text))
+
+_summary_executor: Optional[ThreadPoolExecutor] = None
+_summary_executor_lock = threading.Lock()
+
+def get_summary_executor() -> ThreadPoolExecutor:
+    """Single background worker shared by all rolling summaries"""
+    global _summary_executor
+    with _summary_executor_lock:
+        if _summary_executor is None:
+            _summary_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="mia-summary")
+        return _summary_executor
+
+class RollingSummarizer:
+    """Folds old exchanges into a short running summary using the LLM"""
+    
+    def __init__(self, client: Optional[OllamaClient] = None, model_name="mistral", max_words=120, keep_alive=None):
+        self.client = client or get_ollama_client()
+        self.model_name = model_name
+        self.max_words = max_words
+        # Without it a summary request would reset the conversation model's keep_alive
+        self.keep_alive = keep_alive
+    
+    def summarize(self, previous: str, exchanges: List[Dict]) -> str:
+        """Return a new summary covering the previous summary and the exchanges"""
+        lines = [f"Uporabnik: {e.get('user', '')}\nAsistent: {e.get('response', '')}" for e in exchanges]
+        prompt = (
+            f"Povzemi pogovor v največ {self.max_words} besedah. Ohrani dejstva o uporabniku, "
+            f"njegove želje in odprta vprašanja.\n"
+            f"Dosedanji povzetek: {previous or 'ni ga'}\n"
+            f"Novi del pogovora:\n" + "\n".join(lines) + "\nPovzetek:"
+        )
+        try:
+            response = self.client.post(
+                "/api/generate",
+                json={
+                    "model": self.model_name,
+                    "prompt": prompt,
+                    "stream": False,
+                    "options": {"num_predict": self.max_words * 2},
+                    **({"keep_alive": self.keep_alive} if self.keep_alive is not None else {})
+                },
+                priority=RequestScheduler.BACKGROUND
+            )
+            if response.status_code == 200:
+                summary = response.json().get("response", "").strip()
+                if summary:
+                    return summary
+            logger.warning(f"Summary generation failed: {response.status_code}")
+        except Exception as e:
+            logger.warning(f"Summary generation failed: {e}")
+        
+        # Without the LLM keep the user's own words, trimmed to the word limit
+        words = (previous + " " + " ".join(e.get("user", "") for e in exchanges)).split()
+        return " ".join(words[-self.max_words:])
 
 class ContextManager:
     """Manages conversation context"""
     
-    def __init__(self):
+    def __init__(self, token_budget=1024, summarizer: Optional[RollingSummarizer] = None,
+                 memory: Optional["Memory"] = None):
         self.conversation_context = {}
         self.user_preferences = {}
         self.emotional_state = {}
-        self.memory = Memory()
+        self.memory = memory or Memory()
+        
+        # Token-budgeted context window
+        self.token_budget = token_budget
+        self.summarizer = summarizer
+        self.summary = ""
+        self.summarized_upto = 0
+        self.summary_future: Optional[Future] = None
+        self.cached_key = None
+        self.cached_context = None
+        self.lock = threading.Lock()
     
     def update_context(self, user_input: str, response: str):
         """Update conversation context"""
@@ -287,43 +3086,351 @@ class ContextManager:
         self.conversation_context['last_response'] = response
         self.conversation_context['timestamp'] = datetime.now().isoformat()
     
+    @staticmethod
+    def _format_exchange(exchange: Dict) -> str:
+        return f"Uporabnik: {exchange.get('user', '. ..')}\nAsistent: {exchange.get('response', '. ..')}\n"
+    
+    def _exchange_tokens(self, exchange) -> int:
+        """Token count of an exchange, cached on Turn records"""
+        if isinstance(exchange, Turn):
+            if exchange.tokens is None:
+                exchange.tokens = approx_tokens(self._format_exchange(exchange))
+            return exchange.tokens
+        return approx_tokens(self._format_exchange(exchange))
+    
     def get_context(self, history: List[Dict]) -> str:
         """Get current context for conversation"""
         if not history:
             return "Novega pogovora, brez prejšnjega konteksta."
         
-        # Create context from last few exchanges
-        recent_history = history[-5:]  # Last 5 exchanges
-        context_str = "Kontekst pogovora:\n"
-        for exchange in recent_history:
-            context_str += f"Uporabnik: {exchange.get('user', '. ..')}\n"
-            context_str += f"Asistent: {exchange.get('response', '. ..')}\n"
+        with self.lock:
+            # The assembled prefix only changes when history or the summary does
+            key = (id(history), len(history), self.summarized_upto)
+            if key == self.cached_key:
+                return self.cached_context
+            
+            if len(history) < self.summarized_upto:
+                self._reset()
+            
+            # Fill the budget from the newest exchange backwards; turns already
+            # spilled out of a bounded history cannot be included
+            budget = self.token_budget - approx_tokens(self.summary)
+            first = len(history)
+            floor = max(self.summarized_upto, getattr(history, "first_index", 0))
+            while first > floor and self._exchange_tokens(history[first - 1]) <= budget:
+                budget -= self._exchange_tokens(history[first - 1])
+                first -= 1
+            
+            if first > self.summarized_upto:
+                self._schedule_summary(history, first)
+            
+            parts = []
+            if self.summary:
+                parts.append(f"Povzetek prejšnjega pogovora: {self.summary}\n")
+            parts.append("Kontekst pogovora:\n")
+            parts.extend(self._format_exchange(exchange) for exchange in history[first:])
+            
+            self.cached_key = (id(history), len(history), self.summarized_upto)
+            self.cached_context = "".join(parts)
+            return self.cached_context
+    
+    def _reset(self):
+        """History was replaced; start over"""
+        self.summary = ""
+        self.summarized_upto = 0
+    
+    def _schedule_summary(self, history: List[Dict], upto: int):
+        """Fold exchanges that no longer fit into the summary, off the turn path"""
+        if self.summarizer is None:
+            self.summarized_upto = upto
+            return
+        if self.summary_future is not None and not self.summary_future.done():
+            return
+        
+        evicted = list(history[self.summarized_upto:upto])
+        previous = self.summary
+        
+        def finished(future: Future):
+            try:
+                summary = future.result()
+            except Exception as e:
+                logger.error(f"Error in rolling summary: {e}")
+                return
+            with self.lock:
+                self.summary = summary
+                self.summarized_upto = upto
+            logger.info(f"Rolling summary now covers {upto} exchanges")
+        
+        self.summary_future = get_summary_executor().submit(self.summarizer.summarize, previous, evicted)
+        self.summary_future.add_done_callback(finished)
+
+class MemoryStore:
+    """Disk-backed long-term memory: SQLite (WAL) records plus a memory-mapped embedding matrix"""
+    
+    def __init__(self, directory: Optional[str] = None, client: Optional[OllamaClient] = None,
+                 embedding_model="nomic-embed-text", batch_size=16, flush_interval=2.0, block_rows=8192,
+                 encryption: Optional["Encryption"] = None, retry_initial=1.0, retry_max=60.0):
+        self.directory = directory or os.path.join(os.path.expanduser("~"), ".local", "share", "mia", "memory")
+        os.makedirs(self.directory, exist_ok=True)
+        self.client = client or get_ollama_client()
+        self.embedding_model = embedding_model
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.block_rows = block_rows
+        # Failed embedding batches are retried with backoff; only a missing model disables vectors
+        self.retry_initial = retry_initial
+        self.retry_max = retry_max
+        # Record text is sealed into BLOBs when set; rows written without it stay readable
+        self.encryption = encryption
+        
+        self.db_lock = threading.Lock()
+        self.db = sqlite3.connect(os.path.join(self.directory, "memory.db"), check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS memories (
+                id INTEGER PRIMARY KEY,
+                created REAL NOT NULL,
+                user TEXT NOT NULL,
+                response TEXT NOT NULL,
+                vector_row INTEGER
+            );
+            CREATE UNIQUE INDEX IF NOT EXISTS memories_vector_row ON memories(vector_row);
+            CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+        """)
+        self.db.commit()
+        
+        self.vectors_path = os.path.join(self.directory, "vectors.f32")
+        self.dim = self._meta("dim")
+        self.rows = self._meta("rows") or 0
+        self.vectors: Optional[np.memmap] = None
+        self.capacity = 0
+        if self.dim:
+            self._map_vectors(max(self.rows, self.block_rows))
+        
+        # Records are written at once, their embeddings in batches off the turn path
+        self.pending: "queue.Queue[Tuple[int, str]]" = queue.Queue()
+        self.embedding_enabled = True
+        self.stop_event = threading.Event()
+        self.worker = threading.Thread(target=self._embedding_worker, name="mia-memory", daemon=True)
+        self.worker.start()
+        self._enqueue_unembedded()
+        logger.info(f"Memory store opened at {self.directory} ({self.rows} vectors)")
+    
+    def _meta(self, key: str) -> Optional[int]:
+        with self.db_lock:
+            row = self.db.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return int(row[0]) if row else None
+    
+    def _map_vectors(self, capacity: int):
+        """(Re)map the vector file with room for capacity rows"""
+        size = capacity * self.dim * 4
+        if not os.path.exists(self.vectors_path) or os.path.getsize(self.vectors_path) < size:
+            with open(self.vectors_path, "ab") as f:
+                f.truncate(size)
+        self.capacity = os.path.getsize(self.vectors_path) // (self.dim * 4)
+        self.vectors = np.memmap(self.vectors_path, dtype=np.float32, mode="r+", shape=(self.capacity, self.dim))
+    
+    def _seal(self, text: str):
+        if self.encryption is None:
+            return text
+        return bytes(self.encryption.encrypt(text.encode("utf-8"), "memory"))
+    
+    def _open(self, value) -> Optional[str]:
+        """Record text, or None for a sealed row this store cannot open (no key or a different key)"""
+        if isinstance(value, str):
+            return value
+        if self.encryption is None:
+            return None
+        try:
+            return self.encryption.decrypt(value, "memory").decode("utf-8")
+        except ValueError:
+            return None
+    
+    def _enqueue_unembedded(self):
+        with self.db_lock:
+            rows = self.db.execute("SELECT id, user, response FROM memories WHERE vector_row IS NULL").fetchall()
+        unreadable = 0
+        for memory_id, user, response in rows:
+            user, response = self._open(user), self._open(response)
+            if user is None or response is None:
+                unreadable += 1
+                continue
+            self.pending.put((memory_id, f"{user}\n{response}"))
+        if unreadable:
+            logger.warning(f"Skipped {unreadable} encrypted memories that cannot be opened with the current key")
+    
+    def add(self, user_input: str, response: str) -> int:
+        """Store an exchange; its embedding is computed in the background"""
+        with self.db_lock:
+            cursor = self.db.execute(
+                "INSERT INTO memories (created, user, response) VALUES (?, ?, ?)",
+                (time.time(), self._seal(user_input), self._seal(response))
+            )
+            self.db.commit()
+            memory_id = cursor.lastrowid
+        if self.embedding_enabled:
+            self.pending.put((memory_id, f"{user_input}\n{response}"))
+        return memory_id
+    
+    def _embedding_worker(self):
+        while not self.stop_event.is_set():
+            try:
+                batch = [self.pending.get(timeout=self.flush_interval)]
+            except queue.Empty:
+                continue
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.pending.get_nowait())
+                except queue.Empty:
+                    break
+            self._write_with_retry(batch)
+            for _ in batch:
+                self.pending.task_done()
+            if not self.embedding_enabled:
+                return
+    
+    def _write_with_retry(self, batch: List[Tuple[int, str]]):
+        """Write a batch, waiting out transient failures (Ollama starting, scheduler queue full)"""
+        delay = self.retry_initial
+        while not self.stop_event.is_set():
+            try:
+                self._write_embeddings(batch)
+                return
+            except OllamaModelNotFoundError as e:
+                logger.warning(f"Memory embeddings unavailable, vector retrieval disabled: {e}")
+                self.embedding_enabled = False
+                return
+            except Exception as e:
+                logger.warning(f"Memory embedding failed, retrying in {delay:.1f} s: {e}")
+                self.stop_event.wait(delay)
+                delay = min(delay * 2, self.retry_max)
+    
+    def _write_embeddings(self, batch: List[Tuple[int, str]]):
+        """Embed a batch in one request and append it to the vector file in one slice"""
+        embeddings = self.client.embed(self.embedding_model, [text for _, text in batch],
+                                       priority=RequestScheduler.BACKGROUND)
+        if self.dim is None:
+            self.dim = embeddings.shape[1]
+            with self.db_lock:
+                self.db.execute("INSERT OR REPLACE INTO meta VALUES ('dim', ?)", (str(self.dim),))
+                self.db.commit()
+            self._map_vectors(self.block_rows)
+        
+        start = self.rows
+        end = start + len(batch)
+        if end > self.capacity:
+            self.vectors.flush()
+            self._map_vectors(max(end, self.capacity * 2))
+        self.vectors[start:end] = embeddings
+        self.vectors.flush()
+        
+        with self.db_lock:
+            self.db.executemany(
+                "UPDATE memories SET vector_row = ? WHERE id = ?",
+                [(start + i, memory_id) for i, (memory_id, _) in enumerate(batch)]
+            )
+            self.db.execute("INSERT OR REPLACE INTO meta VALUES ('rows', ?)", (str(end),))
+            self.db.commit()
+        self.rows = end
+    
+    def search(self, query: str, k=3, min_similarity=0.5) -> List[Dict[str, Any]]:
+        """Top-k stored exchanges most similar to the query"""
+        rows = self.rows
+        if not rows or not self.embedding_enabled or self.vectors is None:
+            return []
+        try:
+            query_vector = self.client.embed(self.embedding_model, [query])[0]
+        except Exception as e:
+            logger.warning(f"Memory search failed: {e}")
+            return []
+        
+        # Score block by block so RAM use does not grow with the number of memories
+        best_rows = np.empty(0, dtype=np.int64)
+        best_scores = np.empty(0, dtype=np.float32)
+        vectors = self.vectors
+        for start in range(0, rows, self.block_rows):
+            scores = vectors[start:min(start + self.block_rows, rows)] @ query_vector
+            candidates = np.argpartition(scores, -k)[-k:] if scores.size > k else np.arange(scores.size)
+            best_rows = np.concatenate((best_rows, candidates + start))
+            best_scores = np.concatenate((best_scores, scores[candidates]))
+            if best_scores.size > k:
+                keep = np.argpartition(best_scores, -k)[-k:]
+                best_rows, best_scores = best_rows[keep], best_scores[keep]
+        
+        order = np.argsort(-best_scores)
+        selected = [(int(best_rows[i]), float(best_scores[i])) for i in order if best_scores[i] >= min_similarity]
+        if not selected:
+            return []
         
-        return context_str
+        with self.db_lock:
+            placeholders = ",".join("?" * len(selected))
+            records = self.db.execute(
+                f"SELECT vector_row, created, user, response FROM memories WHERE vector_row IN ({placeholders})",
+                [row for row, _ in selected]
+            ).fetchall()
+        by_row = {record[0]: record for record in records}
+        found = []
+        for row, score in selected:
+            if row not in by_row:
+                continue
+            user, response = self._open(by_row[row][2]), self._open(by_row[row][3])
+            # Rows sealed with a key this session does not have are left out
+            if user is not None and response is not None:
+                found.append({"user": user, "response": response, "created": by_row[row][1], "similarity": score})
+        return found
+    
+    def flush(self, timeout=10.0):
+        """Wait until queued embeddings are written"""
+        deadline = time.monotonic() + timeout
+        # unfinished_tasks also counts the batch being written (or retried) right now
+        while self.pending.unfinished_tasks and self.embedding_enabled and time.monotonic() < deadline:
+            time.sleep(0.05)
+    
+    def close(self):
+        """Stop the worker and close the database"""
+        self.stop_event.set()
+        self.worker.join(timeout=self.flush_interval + 1)
+        if self.vectors is not None:
+            self.vectors.flush()
+            self.vectors = None
+        with self.db_lock:
+            self.db.close()
 
 class Memory:
     """Memory management for MIA"""
     
-    def __init__(self):
+    def __init__(self, store: Optional[MemoryStore] = None, history: Optional[ConversationHistory] = None):
         self.user_preferences = {}
-        self.conversation_memory = []
+        # Bounded recent history, shared with ConversationModule and ContextManager;
+        # the long-term store holds everything
+        self.conversation_memory = history if history is not None else ConversationHistory()
         self.long_term_memory = {}
+        self.store = store
+        # Called with {preference: value} after every change
+        self.on_change = None
     
     def store_preference(self, preference: str, value: Any):
         """Store user preference"""
         self.user_preferences[preference] = value
+        if self.on_change is not None:
+            self.on_change({preference: value})
     
     def recall_preference(self, preference: str) -> Any:
         """Recall user preference"""
         return self.user_preferences.get(preference, None)
     
-    def store_conversation(self, user_input: str, response: str):
+    def store_conversation(self, user_input: str, response: str, modality: str = "text"):
         """Store conversation for context"""
-        self.conversation_memory.append({
-            "user": user_input,
-            "response": response,
-            "timestamp": datetime.now().isoformat()
-        })
+        self.conversation_memory.append(user_input, response, modality)
+        if self.store is not None:
+            self.store.add(user_input, response)
+    
+    def recall(self, query: str, k=3) -> List[Dict[str, Any]]:
+        """Long-term memories related to the query"""
+        if self.store is None:
+            return []
+        return self.store.search(query, k=k)
 
 class PersonalizationModule:
     """Personalization and adaptation module"""
@@ -366,27 +3473,274 @@ class AdaptationSystem:
 class SecurityLayer:
     """Security and privacy layer"""
     
-    def __init__(self):
-        self.encryption = Encryption()
+    def __init__(self, encryption: Optional["Encryption"] = None):
+        self.encryption = encryption or create_encryption()
         self.authentication = Authentication()
         self.privacy_controls = PrivacyControls()
         logger.info("Security layer initialized")
     
     def secure_communication(self, data: str) -> str:
         """Secure communication"""
-        return self.encryption.encrypt(data)
+        if self.encryption is None:
+            return data
+        return self.encryption.seal_text(data, "communication")
     
     def verify_identity(self, user_id: str) -> bool:
         """Verify user identity"""
         return self.authentication.verify(user_id)
 
+ENCRYPTION_MAGIC = b"MIA\x01"
+ENCRYPTION_TAG_SIZE = 16
+# Magic, chunk size and the 8-byte nonce prefix
+ENCRYPTION_HEADER_SIZE = 16
+
+def _seal_chunk(cipher, nonce: bytes, chunk, aad: bytes, out: memoryview):
+    """Encrypt a chunk straight into out when the library supports it"""
+    if hasattr(cipher, "encrypt_into"):
+        cipher.encrypt_into(nonce, chunk, aad, out)
+    else:
+        out[:] = cipher.encrypt(nonce, chunk, aad)
+
+def _open_chunk(cipher, nonce: bytes, chunk, aad: bytes, out: memoryview):
+    from cryptography.exceptions import InvalidTag
+    try:
+        if hasattr(cipher, "decrypt_into"):
+            cipher.decrypt_into(nonce, chunk, aad, out)
+        else:
+            out[:] = cipher.decrypt(nonce, chunk, aad)
+    except InvalidTag:
+        raise ValueError("Encrypted data failed authentication") from None
+
+class StreamEncryptor:
+    """Seals data as it arrives; full chunks are read straight from the caller's buffer"""
+    
+    def __init__(self, cipher, chunk_size: int):
+        self.cipher = cipher
+        self.chunk_size = chunk_size
+        # Nonce = random 8-byte prefix + chunk counter; the last chunk is marked in the
+        # associated data, so reordered, dropped or truncated chunks fail to open
+        self.prefix = os.urandom(8)
+        self.counter = 0
+        self.header = ENCRYPTION_MAGIC + chunk_size.to_bytes(4, "big") + self.prefix
+        self.buffer = bytearray()
+    
+    def _nonce(self) -> bytes:
+        nonce = self.prefix + self.counter.to_bytes(4, "big")
+        self.counter += 1
+        return nonce
+    
+    def seal_into(self, chunk, out: memoryview, final: bool) -> int:
+        """Seal one chunk into out; returns the bytes written"""
+        size = len(chunk) + ENCRYPTION_TAG_SIZE
+        _seal_chunk(self.cipher, self._nonce(), chunk, self.header + (b"\x01" if final else b"\x00"), out[:size])
+        return size
+    
+    def _seal(self, chunk, final: bool) -> bytearray:
+        out = bytearray(len(chunk) + ENCRYPTION_TAG_SIZE)
+        self.seal_into(chunk, memoryview(out), final)
+        return out
+    
+    def update(self, data) -> List[bytearray]:
+        """Sealed chunks for the data so far; a partial chunk waits for more data"""
+        view = memoryview(data).cast("B")
+        sealed = []
+        if self.buffer:
+            take = min(self.chunk_size - len(self.buffer), len(view))
+            self.buffer += view[:take]
+            view = view[take:]
+            if len(self.buffer) < self.chunk_size:
+                return sealed
+            sealed.append(self._seal(self.buffer, False))
+            self.buffer = bytearray()
+        full = len(view) - len(view) % self.chunk_size
+        for start in range(0, full, self.chunk_size):
+            sealed.append(self._seal(view[start:start + self.chunk_size], False))
+        self.buffer += view[full:]
+        return sealed
+    
+    def finalize(self) -> bytearray:
+        """The last chunk (possibly empty), marked final"""
+        sealed = self._seal(self.buffer, True)
+        self.buffer = bytearray()
+        return sealed
+
+class StreamDecryptor:
+    """Opens a sealed stream incrementally; full-size chunks are never the final one"""
+    
+    def __init__(self, cipher):
+        self.cipher = cipher
+        self.header = None
+        self.sealed_size = 0
+        self.counter = 0
+        self.buffer = bytearray()
+    
+    def _open(self, chunk, final: bool) -> bytearray:
+        nonce = self.header[8:] + self.counter.to_bytes(4, "big")
+        self.counter += 1
+        out = bytearray(len(chunk) - ENCRYPTION_TAG_SIZE)
+        _open_chunk(self.cipher, nonce, chunk, self.header + (b"\x01" if final else b"\x00"), memoryview(out))
+        return out
+    
+    def update(self, data) -> List[bytearray]:
+        """Plaintext of every complete chunk received so far"""
+        self.buffer += data
+        if self.header is None:
+            if len(self.buffer) < ENCRYPTION_HEADER_SIZE:
+                return []
+            self.header = bytes(self.buffer[:ENCRYPTION_HEADER_SIZE])
+            if self.header[:4] != ENCRYPTION_MAGIC:
+                raise ValueError("Not MIA encrypted data")
+            self.sealed_size = int.from_bytes(self.header[4:8], "big") + ENCRYPTION_TAG_SIZE
+            del self.buffer[:ENCRYPTION_HEADER_SIZE]
+        opened = []
+        view = memoryview(self.buffer)
+        offset = 0
+        while len(self.buffer) - offset > self.sealed_size:
+            opened.append(self._open(view[offset:offset + self.sealed_size], False))
+            offset += self.sealed_size
+        view.release()
+        del self.buffer[:offset]
+        return opened
+    
+    def finalize(self) -> bytearray:
+        """Plaintext of the final chunk; fails if the stream was cut short"""
+        if self.header is None or len(self.buffer) < ENCRYPTION_TAG_SIZE or len(self.buffer) >= self.sealed_size:
+            raise ValueError("Encrypted data is truncated")
+        return self._open(self.buffer, True)
+
 class Encryption:
-    """Simple encryption for demonstration"""
+    """AES-256-GCM authenticated encryption for data at rest, sealed in fixed-size chunks"""
+    
+    def __init__(self, key_path: Optional[str] = None, passphrase: Optional[str] = None, chunk_size=64 * 1024):
+        from cryptography.hazmat.primitives.ciphers.aead import AESGCM  # optional dependency: pip install cryptography
+        self.aead = AESGCM
+        self.chunk_size = chunk_size
+        # The key is kept apart from the data it protects (~/.config/mia, not ~/.local/share/mia)
+        self.key_path = key_path or os.path.join(os.path.expanduser("~"), ".config", "mia", "master.key")
+        os.makedirs(os.path.dirname(os.path.abspath(self.key_path)), exist_ok=True)
+        if key_path is None:
+            self._move_legacy_key()
+        # With a passphrase only a salt is stored, the key itself never touches the disk
+        self.from_passphrase = bool(passphrase)
+        # The slow part (scrypt for a passphrase) runs once; per-context keys are cheap HKDF derivations
+        self.master_key = self._master_key(passphrase)
+        self.ciphers: Dict[str, Any] = {}
+        self.lock = threading.Lock()
+    
+    def _move_legacy_key(self):
+        """Move a key (and passphrase salt) from the old location next to the data"""
+        legacy = os.path.join(os.path.expanduser("~"), ".local", "share", "mia", "master.key")
+        for suffix in ("", ".salt"):
+            if os.path.exists(legacy + suffix) and not os.path.exists(self.key_path + suffix):
+                os.replace(legacy + suffix, self.key_path + suffix)
+                logger.info(f"Moved {os.path.basename(legacy + suffix)} out of the data directory to {self.key_path + suffix}")
+    
+    def _master_key(self, passphrase: Optional[str]) -> bytes:
+        if passphrase:
+            from cryptography.hazmat.primitives.kdf.scrypt import Scrypt
+            salt = self._read_or_create(self.key_path + ".salt", 16)
+            return Scrypt(salt=salt, length=32, n=2 ** 15, r=8, p=1).derive(passphrase.encode())
+        return self._read_or_create(self.key_path, 32)
+    
+    @staticmethod
+    def _read_or_create(path: str, size: int) -> bytes:
+        """Random secret kept in a file only the owner can read"""
+        try:
+            fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        except FileExistsError:
+            with open(path, "rb") as f:
+                return f.read()
+        secret = os.urandom(size)
+        with os.fdopen(fd, "wb") as f:
+            f.write(secret)
+        return secret
+    
+    def cipher(self, context: str = "default"):
+        """AEAD keyed for one context (session, store, journal), derived once and cached"""
+        with self.lock:
+            cipher = self.ciphers.get(context)
+            if cipher is None:
+                from cryptography.hazmat.primitives import hashes
+                from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+                key = HKDF(algorithm=hashes.SHA256(), length=32, salt=None,
+                           info=b"mia:" + context.encode()).derive(self.master_key)
+                cipher = self.ciphers[context] = self.aead(key)
+            return cipher
+    
+    def encryptor(self, context: str = "default") -> StreamEncryptor:
+        return StreamEncryptor(self.cipher(context), self.chunk_size)
+    
+    def decryptor(self, context: str = "default") -> StreamDecryptor:
+        return StreamDecryptor(self.cipher(context))
+    
+    def encrypt(self, data, context: str = "default") -> bytearray:
+        """Seal a whole buffer into one preallocated output without copying the input"""
+        view = memoryview(data).cast("B")
+        encryptor = self.encryptor(context)
+        full = len(view) - len(view) % self.chunk_size
+        chunks = full // self.chunk_size
+        out = bytearray(ENCRYPTION_HEADER_SIZE + len(view) + (chunks + 1) * ENCRYPTION_TAG_SIZE)
+        target = memoryview(out)
+        target[:ENCRYPTION_HEADER_SIZE] = encryptor.header
+        position = ENCRYPTION_HEADER_SIZE
+        for start in range(0, full, self.chunk_size):
+            position += encryptor.seal_into(view[start:start + self.chunk_size], target[position:], False)
+        encryptor.seal_into(view[full:], target[position:], True)
+        return out
+    
+    def decrypt(self, data, context: str = "default") -> bytearray:
+        """Open a buffer sealed by encrypt() or encrypt_stream()"""
+        view = memoryview(data).cast("B")
+        decryptor = self.decryptor(context)
+        header = bytes(view[:ENCRYPTION_HEADER_SIZE])
+        if len(header) < ENCRYPTION_HEADER_SIZE or header[:4] != ENCRYPTION_MAGIC:
+            raise ValueError("Not MIA encrypted data")
+        decryptor.header = header
+        sealed_size = int.from_bytes(header[4:8], "big") + ENCRYPTION_TAG_SIZE
+        body = view[ENCRYPTION_HEADER_SIZE:]
+        chunks, last = divmod(len(body), sealed_size)
+        if last < ENCRYPTION_TAG_SIZE:
+            raise ValueError("Encrypted data is truncated")
+        out = bytearray(len(body) - (chunks + 1) * ENCRYPTION_TAG_SIZE)
+        target = memoryview(out)
+        plain_size = sealed_size - ENCRYPTION_TAG_SIZE
+        for i in range(chunks + 1):
+            final = i == chunks
+            chunk = body[i * sealed_size:len(body) if final else (i + 1) * sealed_size]
+            nonce = header[8:] + i.to_bytes(4, "big")
+            _open_chunk(decryptor.cipher, nonce, chunk, header + (b"\x01" if final else b"\x00"),
+                        target[i * plain_size:i * plain_size + len(chunk) - ENCRYPTION_TAG_SIZE])
+        return out
     
-    def encrypt(self, data: str) -> str:
-        """Encrypt data"""
-        # In real implementation, use proper encryption
-        return f"encrypted_{data}"
+    def encrypt_stream(self, chunks: Iterable, context: str = "default") -> Iterator[bytes]:
+        """Seal a stream of buffers (e.g. audio as it is recorded)"""
+        encryptor = self.encryptor(context)
+        yield encryptor.header
+        for chunk in chunks:
+            yield from encryptor.update(chunk)
+        yield encryptor.finalize()
+    
+    def decrypt_stream(self, chunks: Iterable, context: str = "default") -> Iterator[bytes]:
+        """Open a sealed stream piece by piece"""
+        decryptor = self.decryptor(context)
+        for chunk in chunks:
+            yield from decryptor.update(chunk)
+        yield decryptor.finalize()
+    
+    def seal_text(self, text: str, context: str = "default") -> str:
+        """Encrypted text as one base64 line"""
+        return base64.b64encode(self.encrypt(text.encode("utf-8"), context)).decode("ascii")
+    
+    def open_text(self, token: str, context: str = "default") -> str:
+        return self.decrypt(base64.b64decode(token), context).decode("utf-8")
+
+def create_encryption(**kwargs) -> Optional[Encryption]:
+    """Encryption for data at rest, or None when the cryptography package is missing"""
+    try:
+        return Encryption(**kwargs)
+    except ImportError:
+        logger.warning("cryptography is not installed, stored memory and journals are not encrypted")
+        return None
 
 class Authentication:
     """Authentication system"""
@@ -406,33 +3760,732 @@ class PrivacyControls:
             "video_recording": True,
             "data_sharing": False
         }
+        # Called with the changed settings
+        self.on_change = None
     
     def update_settings(self, settings: Dict[str, bool]):
         """Update privacy settings"""
         self.privacy_settings.update(settings)
+        if self.on_change is not None:
+            self.on_change(dict(settings))
+
+class SessionJournal:
+    """Append-only JSON-lines journal of session changes with periodic snapshots, written on a background thread"""
+    
+    def __init__(self, directory: str, snapshot_every=500, fsync=False, encryption: Optional[Encryption] = None):
+        self.directory = directory
+        # Records become sealed base64 lines and the snapshot a sealed blob when set;
+        # plaintext files from before still load
+        self.encryption = encryption
+        self.journal_path = os.path.join(directory, "journal.jsonl")
+        self.snapshot_path = os.path.join(directory, "snapshot.json")
+        self.snapshot_every = snapshot_every
+        self.fsync = fsync
+        # Returns the full session state; set by the owner before records start
+        self.capture = None
+        self.seq = 0
+        self.since_snapshot = 0
+        # Reentrant: owners share it with the state they journal (see resume_session),
+        # and a record can take a snapshot while that state is locked
+        self.lock = threading.RLock()
+        self.pending: "queue.Queue[Optional[Tuple[str, Dict[str, Any]]]]" = queue.Queue()
+        self.writer: Optional[threading.Thread] = None
+        self.file = None
+    
+    def load(self) -> Tuple[Optional[Dict[str, Any]], List[Dict[str, Any]]]:
+        """Last snapshot and the journal records written after it"""
+        snapshot = None
+        try:
+            with open(self.snapshot_path, "rb") as f:
+                raw = f.read()
+            if raw.startswith(ENCRYPTION_MAGIC):
+                if self.encryption is None:
+                    raise ValueError("snapshot is encrypted")
+                raw = self.encryption.decrypt(raw, "journal")
+            snapshot = json.loads(raw.decode("utf-8"))
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            logger.warning(f"Could not read session snapshot: {e}")
+        
+        floor = snapshot["seq"] if snapshot else 0
+        records = []
+        try:
+            with open(self.journal_path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        if not line.startswith("{"):
+                            if self.encryption is None:
+                                raise ValueError("journal is encrypted")
+                            line = self.encryption.open_text(line.strip(), "journal")
+                        record = json.loads(line)
+                    except ValueError:
+                        # A crash can leave a torn last line
+                        break
+                    if record["seq"] > floor:
+                        records.append(record)
+        except FileNotFoundError:
+            pass
+        self.seq = max([floor] + [record["seq"] for record in records])
+        return snapshot, records
+    
+    def start(self):
+        """Start the background writer"""
+        os.makedirs(self.directory, exist_ok=True)
+        self.file = open(self.journal_path, "a", encoding="utf-8")
+        self.writer = threading.Thread(target=self._write_loop, name="mia-journal", daemon=True)
+        self.writer.start()
+        return self
+    
+    def record(self, kind: str, data: Dict[str, Any]):
+        """Queue one change; a snapshot is taken every snapshot_every records"""
+        with self.lock:
+            self.seq += 1
+            self.pending.put(("record", {"seq": self.seq, "kind": kind, **data}))
+            self.since_snapshot += 1
+            due = self.since_snapshot >= self.snapshot_every
+        if due:
+            self.snapshot()
+    
+    def snapshot(self):
+        """Queue a snapshot of the current state; the journal restarts after it"""
+        if self.capture is None:
+            return
+        with self.lock:
+            # Captured under the lock, so the snapshot covers exactly the records up to seq
+            state = self.capture()
+            self.pending.put(("snapshot", {"seq": self.seq, **state}))
+            self.since_snapshot = 0
+    
+    def _write_loop(self):
+        while True:
+            items = [self.pending.get()]
+            while True:
+                try:
+                    items.append(self.pending.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                for item in items:
+                    if item is None:
+                        self._flush()
+                        self.file.close()
+                        return
+                    kind, data = item
+                    if kind == "record":
+                        line = json.dumps(data, ensure_ascii=False)
+                        if self.encryption is not None:
+                            line = self.encryption.seal_text(line, "journal")
+                        self.file.write(line + "\n")
+                    else:
+                        self._write_snapshot(data)
+                self._flush()
+            except (OSError, TypeError, ValueError) as e:
+                logger.warning(f"Could not write session journal: {e}")
+    
+    def _flush(self):
+        self.file.flush()
+        if self.fsync:
+            os.fsync(self.file.fileno())
+    
+    def _write_snapshot(self, state: Dict[str, Any]):
+        temporary = self.snapshot_path + ".tmp"
+        data = json.dumps(state, ensure_ascii=False).encode("utf-8")
+        if self.encryption is not None:
+            data = self.encryption.encrypt(data, "journal")
+        with open(temporary, "wb") as f:
+            f.write(data)
+            f.flush()
+            if self.fsync:
+                os.fsync(f.fileno())
+        os.replace(temporary, self.snapshot_path)
+        # Everything journaled so far is in the snapshot; records are skipped by seq
+        # if a crash lands between the two steps
+        self.file.flush()
+        self.file.truncate(0)
+    
+    def close(self):
+        """Write everything queued and stop the writer"""
+        if self.writer is not None:
+            self.pending.put(None)
+            self.writer.join(timeout=5)
+            self.writer = None
+
+class PipelineTurn:
+    """One user turn flowing through the pipeline, cancellable on barge-in"""
+    
+    def __init__(self, user_input: str):
+        self.user_input = user_input
+        self.started = time.perf_counter()
+        self.cancelled = threading.Event()
+        self.finished = threading.Event()
+        self.first_audio_logged = False
+    
+    def cancel(self):
+        self.cancelled.set()
+    
+    @property
+    def active(self) -> bool:
+        return not (self.cancelled.is_set() or self.finished.is_set())
+
+class ConversationPipeline:
+    """Pipelined runtime: capture, STT, LLM and playback stages on separate threads"""
+    
+    def __init__(self, audio_video: AudioVideoInterface, conversation: "ConversationModule",
+                 queue_size=4, barge_in=True, on_exchange=None, respond=None, on_partial=None):
+        self.audio_video = audio_video
+        self.conversation = conversation
+        self.barge_in = barge_in
+        self.on_exchange = on_exchange
+        # Called with each partial transcription while the user is still speaking
+        self.on_partial = on_partial
+        # Generator of reply sentences for a turn; defaults to the LLM
+        self.respond = respond or conversation.stream_input
+        
+        # Bounded queues between the stages
+        self.audio_queue = queue.Queue(maxsize=queue_size)
+        self.text_queue = queue.Queue(maxsize=queue_size)
+        self.speech_queue = queue.Queue(maxsize=queue_size * 4)
+        
+        self.stop_event = threading.Event()
+        self.current_turn: Optional[PipelineTurn] = None
+        self.turn_lock = threading.Lock()
+        self.threads: List[threading.Thread] = []
+        self.utterances: Optional[Iterator[Iterator[bytes]]] = None
+        self.dropped_audio = 0
+        self.barge_ins = 0
+    
+    def start(self):
+        """Start all pipeline stages"""
+        self.stop_event.clear()
+        stages = [
+            ("capture", self._capture_stage),
+            ("stt", self._stt_stage),
+            ("llm", self._llm_stage),
+            ("playback", self._playback_stage)
+        ]
+        for name, target in stages:
+            thread = threading.Thread(target=self._run_stage, args=(name, target), name=f"mia-{name}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+        logger.info("Conversation pipeline started")
+    
+    def stop(self):
+        """Stop all pipeline stages"""
+        self.stop_event.set()
+        self._cancel_current_turn()
+        for thread in self.threads:
+            thread.join(timeout=2)
+        self.threads = []
+        self.utterances = None
+        logger.info(f"Conversation pipeline stopped (barge-ins: {self.barge_ins}, dropped audio: {self.dropped_audio})")
+    
+    def run(self):
+        """Run the pipeline until stopped or interrupted"""
+        self.start()
+        try:
+            while not self.stop_event.is_set():
+                self.stop_event.wait(0.5)
+        except KeyboardInterrupt:
+            logger.info("Conversation stopped by user")
+        finally:
+            self.stop()
+    
+    def _run_stage(self, name: str, target):
+        while not self.stop_event.is_set():
+            try:
+                target()
+            except Exception as e:
+                logger.error(f"Error in pipeline stage {name}: {e}")
+                time.sleep(0.1)
+    
+    def _get(self, source: queue.Queue):
+        try:
+            return source.get(timeout=0.1)
+        except queue.Empty:
+            return None
+    
+    def _put(self, target: queue.Queue, item, turn: Optional[PipelineTurn] = None) -> bool:
+        """Blocking put that gives up when the pipeline stops or the turn is cancelled"""
+        while not self.stop_event.is_set():
+            if turn is not None and turn.cancelled.is_set():
+                return False
+            try:
+                target.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+    
+    def _cancel_current_turn(self):
+        with self.turn_lock:
+            if self.current_turn is not None:
+                self.current_turn.cancel()
+    
+    def _capture_stage(self):
+        if self.utterances is None:
+            self.utterances = self.audio_video.microphone.utterance_streams(self.stop_event)
+        utterance = next(self.utterances, None)
+        if utterance is None:
+            self.utterances = None
+            return
+        # The utterance is handed to STT as soon as it starts and filled while it is
+        # spoken; capture never waits for the later stages, the oldest audio is dropped instead
+        audio = queue.Queue()
+        while True:
+            try:
+                self.audio_queue.put_nowait(audio)
+                break
+            except queue.Full:
+                try:
+                    self.audio_queue.get_nowait()
+                    self.dropped_audio += 1
+                except queue.Empty:
+                    pass
+        try:
+            with get_metrics().span("record"):
+                for chunk in utterance:
+                    audio.put(chunk)
+        finally:
+            audio.put(None)
+    
+    def _stt_stage(self):
+        audio = self._get(self.audio_queue)
+        if audio is None:
+            return
+        text = ""
+        interrupted = False
+        for text, is_final in self.audio_video.stt.transcribe_stream(iter(audio.get, None)):
+            if not text:
+                continue
+            if not interrupted:
+                # The first words heard are enough to stop the current reply
+                self._interrupt()
+                interrupted = True
+            if not is_final:
+                logger.info(f"Partial transcription: {text}")
+                if self.on_partial is not None:
+                    self.on_partial(text)
+        if not text:
+            return
+        
+        logger.info(f"Transcribed text: {text}")
+        self._put(self.text_queue, text)
+    
+    def _interrupt(self):
+        if not self.barge_in:
+            return
+        with self.turn_lock:
+            turn = self.current_turn
+        if turn is not None and turn.active:
+            logger.info("Barge-in: cancelling current response")
+            self.barge_ins += 1
+            turn.cancel()
+    
+    def _llm_stage(self):
+        user_input = self._get(self.text_queue)
+        if user_input is None:
+            return
+        
+        turn = PipelineTurn(user_input)
+        with self.turn_lock:
+            self.current_turn = turn
+        
+        sentences = []
+        stream = self.respond(user_input)
+        try:
+            for sentence in stream:
+                if not self._put(self.speech_queue, (turn, sentence), turn):
+                    break
+                sentences.append(sentence)
+        finally:
+            # Closing the generator drops the HTTP stream so Ollama stops generating
+            stream.close()
+        
+        # End-of-turn marker lets playback tell when the turn is fully spoken
+        self._put(self.speech_queue, (turn, None), turn)
+        if turn.cancelled.is_set():
+            logger.info("Response generation cancelled")
+            return
+        get_metrics().observe("turn", time.perf_counter() - turn.started)
+        
+        response = " ".join(sentences)
+        if self.on_exchange is not None:
+            self.on_exchange(user_input, response)
+    
+    def _playback_stage(self):
+        item = self._get(self.speech_queue)
+        if item is None:
+            return
+        turn, sentence = item
+        if sentence is None:
+            turn.finished.set()
+            return
+        if turn.cancelled.is_set():
+            return
+        
+        logger.info(f"Speaking: {sentence}")
+        audio_data = self.audio_video.tts.synthesize(sentence)
+        if not turn.first_audio_logged:
+            turn.first_audio_logged = True
+            elapsed = time.perf_counter() - turn.started
+            get_metrics().observe("first_audio", elapsed)
+            logger.info(f"Turn latency to first audio: {elapsed * 1000:.0f} ms")
+        # Our own voice reaches the microphone too; gate the VAD so it cannot barge in on itself
+        vad = self.audio_video.microphone.vad
+        vad.set_playing(True)
+        try:
+            self.audio_video.speaker.play(audio_data, cancel_event=turn.cancelled)
+        finally:
+            vad.set_playing(False)
+
+class KeywordAutomaton:
+    """Aho-Corasick matcher: finds every keyword in one pass over the text"""
+    
+    def __init__(self, keywords: Dict[str, str]):
+        # keywords maps a lowercase keyword to its label
+        self.goto: List[Dict[str, int]] = [{}]
+        self.fail: List[int] = [0]
+        self.output: List[List[Tuple[str, str]]] = [[]]
+        for keyword, label in keywords.items():
+            state = 0
+            for char in keyword:
+                if char not in self.goto[state]:
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.output.append([])
+                    self.goto[state][char] = len(self.goto) - 1
+                state = self.goto[state][char]
+            self.output[state].append((keyword, label))
+        
+        pending = collections.deque(self.goto[0].values())
+        while pending:
+            state = pending.popleft()
+            for char, child in self.goto[state].items():
+                pending.append(child)
+                fallback = self.fail[state]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[child] = self.goto[fallback].get(char, 0) if self.goto[fallback].get(char) != child else 0
+                self.output[child] = self.output[child] + self.output[self.fail[child]]
+    
+    def find(self, text: str) -> Iterator[Tuple[int, str, str]]:
+        """Yield (start, keyword, label) for keywords that appear as whole words in the lowercase text"""
+        state = 0
+        for end, char in enumerate(text):
+            while state and char not in self.goto[state]:
+                state = self.fail[state]
+            state = self.goto[state].get(char, 0)
+            for keyword, label in self.output[state]:
+                start = end - len(keyword) + 1
+                # Inflections are listed explicitly, so "slik" must not fire on "slikar"
+                if (start == 0 or not text[start - 1].isalnum()) and (end + 1 == len(text) or not text[end + 1].isalnum()):
+                    yield start, keyword, label
+
+class IntentClassifier:
+    """Nearest-centroid classifier over hashed character trigrams, small enough to run per turn on CPU"""
+    
+    def __init__(self, examples: Dict[str, List[str]], dim=2048, sharpness=10.0):
+        self.dim = dim
+        self.sharpness = sharpness
+        self.labels = list(examples)
+        centroids = np.stack([self.features(examples[label]).mean(axis=0) for label in self.labels])
+        self.centroids = centroids / np.linalg.norm(centroids, axis=1, keepdims=True)
+    
+    def features(self, texts: List[str]) -> np.ndarray:
+        matrix = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            padded = f" {text.lower()} "
+            for i in range(len(padded) - 2):
+                digest = hashlib.blake2b(padded[i:i + 3].encode(), digest_size=4).digest()
+                matrix[row, int.from_bytes(digest, "little") % self.dim] += 1.0
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return matrix / norms
+    
+    def predict(self, text: str) -> Tuple[str, float, float]:
+        """Most likely label, its softmax confidence and its lead over the runner-up"""
+        scores = self.centroids @ self.features([text])[0] * self.sharpness
+        probabilities = np.exp(scores - scores.max())
+        probabilities /= probabilities.sum()
+        second, best = np.argsort(probabilities)[-2:]
+        return self.labels[best], float(probabilities[best]), float(probabilities[best] - probabilities[second])
+
+class IntentRouter:
+    """Recognises command-like turns so they can be answered without the LLM"""
+    
+    # Checked in this order when a turn names several intents; whole words, so every
+    # inflection that should count is listed
+    KEYWORDS = {
+        "video": ("video", "videa", "videu", "videom", "kamera", "kamero", "kameri", "kamere",
+                  "posnetek", "posnetka", "posnetku", "posnetke"),
+        "image": ("slika", "sliko", "sliki", "slike", "slikaj", "image", "fotografija", "fotografijo",
+                  "fotografiji", "fotografije", "kaj vidiš"),
+        "conversation": ("conversation", "pogovor"),
+        "help": ("help", "pomoč", "kaj znaš", "kaj zmoreš"),
+    }
+    # Words a command may contain besides its keyword; anything else makes the turn chat
+    COMMAND_WORDS = frozenset((
+        "prosim", "pokaži", "opiši", "analiziraj", "vklopi", "poglej", "preveri", "naredi", "odpri",
+        "zaženi", "daj", "to", "ta", "tole", "mi", "me", "na", "ali", "lahko", "please", "show",
+    ))
+    # Classifier examples; "chat" is everything that should go to the LLM
+    EXAMPLES = {
+        "video": ["analiziraj video", "kaj se dogaja na kameri", "vklopi kamero", "preveri posnetek",
+                  "ali se kaj premika", "poglej video"],
+        "image": ["opiši sliko", "kaj vidiš", "kaj je na sliki", "poglej to fotografijo", "slikaj me",
+                  "kaj je pred kamero"],
+        "help": ["pomoč", "kaj znaš", "kako te uporabljam", "katere ukaze poznaš", "kaj vse zmoreš",
+                 "navodila prosim"],
+        "chat": ["kakšno bo vreme jutri", "povej mi vic", "kdo je napisal prešerna", "rad bi se učil kuhati",
+                 "kaj priporočaš za večerjo", "razloži mi kvantno fiziko", "kako si danes",
+                 "napiši pesem o morju", "koliko je ura v tokiu", "kje je ljubljana"],
+    }
+    
+    def __init__(self, keywords: Optional[Dict[str, Iterable[str]]] = None,
+                 examples: Optional[Dict[str, List[str]]] = None, use_classifier=True,
+                 max_command_words=4, threshold=0.8, margin=0.5):
+        keywords = keywords or self.KEYWORDS
+        self.order = {intent: i for i, intent in enumerate(keywords)}
+        self.automaton = KeywordAutomaton({word: intent for intent, words in keywords.items() for word in words})
+        self.classifier = IntentClassifier(examples or self.EXAMPLES) if use_classifier else None
+        # A keyword only decides the turn when the whole turn is this short
+        self.max_command_words = max_command_words
+        # The classifier alone decides only when it is sure and clearly ahead of the runner-up
+        self.threshold = threshold
+        self.margin = margin
+        self.routed: Dict[str, int] = collections.Counter()
+        self.passed = 0
+        self.lock = threading.Lock()
+    
+    def match(self, text: str) -> Optional[str]:
+        """First intent named by a keyword anywhere in the text"""
+        intents = {intent for _, _, intent in self.automaton.find(text.lower())}
+        return min(intents, key=self.order.__getitem__) if intents else None
+    
+    def route(self, text: str) -> Optional[Tuple[str, float]]:
+        """(intent, confidence) for command-like turns, None for turns the LLM should answer"""
+        lowered = text.lower().strip()
+        result = None
+        matches = list(self.automaton.find(lowered))
+        intents = {intent for _, _, intent in matches}
+        if len(intents) == 1 and self._is_command(lowered, matches):
+            result = (intents.pop(), 1.0)
+        elif len(intents) == 1 and self.classifier is not None:
+            # Longer turns that name an intent ("kaj je na sliki") need the classifier to agree;
+            # without a keyword a turn always goes to the LLM
+            intent, confidence, lead = self.classifier.predict(lowered)
+            if intent in intents and confidence >= self.threshold and lead >= self.margin:
+                result = (intent, confidence)
+        with self.lock:
+            if result is None:
+                self.passed += 1
+            else:
+                self.routed[result[0]] += 1
+        return result
+    
+    def _is_command(self, lowered: str, matches: List[Tuple[int, str, str]]) -> bool:
+        """Short turn made of keywords and command words only ("opiši to sliko", not "video igre so zabavne")"""
+        words = list(re.finditer(r"\w+", lowered))
+        if len(words) > self.max_command_words:
+            return False
+        covered = [(start, start + len(keyword)) for start, keyword, _ in matches]
+        return all(
+            word.group() in self.COMMAND_WORDS or any(start <= word.start() < end for start, end in covered)
+            for word in words
+        )
+    
+    def stats(self) -> Dict[str, Any]:
+        """Turns routed per intent and turns passed on to the LLM"""
+        with self.lock:
+            return {"routed": dict(self.routed), "passed_to_llm": self.passed}
 
 class MIA_System:
     """Main MIA for All System class"""
     
-    def __init__(self):
-        self.audio_video = AudioVideoInterface()
-        self.conversation = ConversationModule()
-        self.context = ContextManager()
-        self.security = SecurityLayer()
+    GREETING = "Pozdravljen! Sem MIA, tvoja osebna ženska asistentka. Lahko ti izpolnim vse pogovorne, video in slikovne zahteve!"
+    ERROR_REPLY = "Oprostite, prišlo je do napake. Lahko poskusimo znova?"
+    VIDEO_CAPTURE_FAILED = "Video zajem ni uspel."
+    VIDEO_ERROR = "Oprostite, prišlo je do napake pri video analizi."
+    IMAGE_PROMPT = "Opiši, kaj vidiš na sliki."
+    VIDEO_PENDING = "Analiziram video, rezultat bo kmalu pripravljen. Vprašajte me znova čez trenutek."
+    CAMERA_DISABLED = "Kamera je izklopljena v nastavitvah zasebnosti."
+    # How long a video request may hold up the conversation before it answers
+    VIDEO_WAIT_S = 1.5
+    DEFAULT_REPLY = "Razumem, lahko vam pomagam s tem. Kaj bi želeli raziskati?"
+    
+    def __init__(self, keep_alive="30m", ollama_url="http://localhost:11434", persist_session=True,
+                 session_dir: Optional[str] = None, encryption: Optional[Encryption] = None, encrypt_at_rest=True,
+                 data_dir: Optional[str] = None, cache_dir: Optional[str] = None, config_dir: Optional[str] = None):
+        # Memory, history and the session journal live in data_dir (default ~/.local/share/mia),
+        # synthesized audio in cache_dir (default ~/.cache/mia) and the key in config_dir (default ~/.config/mia)
+        data_dir = data_dir or os.path.join(os.path.expanduser("~"), ".local", "share", "mia")
+        self.data_dir = data_dir
+        self.audio_video = AudioVideoInterface(cache_dir=cache_dir)
+        # One key set per process: memory, spilled history and the session journal are sealed at rest
+        self.encryption = encryption or (
+            create_encryption(key_path=os.path.join(config_dir, "master.key") if config_dir else None)
+            if encrypt_at_rest else None
+        )
+        if self.encryption is not None and not self.encryption.from_passphrase:
+            data_root = os.path.abspath(data_dir)
+            key_dir = os.path.dirname(os.path.abspath(self.encryption.key_path))
+            if os.path.commonpath([data_root, key_dir]) == data_root:
+                logger.warning(f"The master key {self.encryption.key_path} is stored with the data it encrypts; "
+                               "keep it elsewhere or set MIA_PASSPHRASE")
+        client = get_ollama_client(ollama_url)
+        self.conversation = ConversationModule(
+            ollama_url=ollama_url,
+            client=client,
+            response_cache=ResponseCache(client),
+            memory_store=MemoryStore(os.path.join(data_dir, "memory"), client=client, encryption=self.encryption),
+            history=ConversationHistory(spill_path=os.path.join(data_dir, "history.jsonl"), encryption=self.encryption),
+            router=ModelRouter(client),
+            keep_alive=keep_alive
+        )
+        self.warmup = ModelWarmup(self.conversation.client, keep_alive=keep_alive, conversation=self.conversation)
+        self.warmup_report = {}
+        # Same context manager, Memory and history the conversation module uses
+        self.context = self.conversation.context_manager
+        self.security = SecurityLayer(self.encryption)
         self.personalization = PersonalizationModule()
-        self.memory = Memory()
+        self.memory = self.context.memory
+        self.pipeline = None
+        self.video_future: Optional[Future] = None
+        # Command-like turns are answered directly instead of by the LLM
+        self.intents = IntentRouter()
+        self.llm_calls_avoided = 0
         self.is_running = False
         
+        # History, context, preferences and privacy settings survive restarts
+        self.journal = None
+        if persist_session:
+            self.journal = SessionJournal(session_dir or os.path.join(data_dir, "session"), encryption=self.encryption)
+            self.resume_session()
+        
         logger.info("MIA for All System initialized successfully")
         logger.info("Lahka ženska asistentka pripravljena za neomejene pogovore")
     
-    def initialize_system(self):
-        """Initialize all system components"""
+    def session_state(self) -> Dict[str, Any]:
+        """Everything a session snapshot holds"""
+        conversation = self.conversation
+        return {
+            "history": conversation.conversation_history.snapshot(),
+            "conversation_context": dict(self.context.conversation_context),
+            "user_preferences": dict(self.memory.user_preferences),
+            "privacy_settings": dict(self.security.privacy_controls.privacy_settings),
+            # The rolling summary and KV-cache tokens spare the model re-reading old turns
+            "summary": conversation.context_manager.summary,
+            "summarized_upto": conversation.context_manager.summarized_upto,
+            "ollama_contexts": dict(conversation.ollama_contexts)
+        }
+    
+    def resume_session(self):
+        """Replay the last snapshot and the journal tail, then journal every change"""
+        start = time.perf_counter()
+        journal = self.journal
+        snapshot, records = journal.load()
+        conversation = self.conversation
+        history = conversation.conversation_history
+        privacy = self.security.privacy_controls
+        
+        state = snapshot or {}
+        turns = list(state.get("history", {}).get("turns", []))
+        self.context.conversation_context.update(state.get("conversation_context", {}))
+        self.memory.user_preferences.update(state.get("user_preferences", {}))
+        privacy.privacy_settings.update(state.get("privacy_settings", {}))
+        for record in records:
+            kind = record["kind"]
+            if kind == "turn":
+                turns.append(record["turn"])
+            elif kind == "context":
+                self.context.conversation_context.update(record["data"])
+            elif kind == "preferences":
+                self.memory.user_preferences.update(record["data"])
+            elif kind == "privacy":
+                privacy.privacy_settings.update(record["data"])
+        if turns:
+            history.restore(turns, state.get("history", {}).get("spilled", 0))
+        if snapshot:
+            conversation.context_manager.summary = snapshot.get("summary", "")
+            conversation.context_manager.summarized_upto = snapshot.get("summarized_upto", 0)
+            conversation.ollama_contexts = dict(snapshot.get("ollama_contexts") or {})
+            # Snapshots from before per-model contexts hold a single one
+            if snapshot.get("ollama_context") and snapshot.get("context_model"):
+                conversation.ollama_contexts.setdefault(snapshot["context_model"], snapshot["ollama_context"])
+        
+        # A turn and its journal seq are assigned under one lock a snapshot also takes
+        history.lock = journal.lock
+        history.on_append = lambda turn: journal.record("turn", {"turn": turn.to_dict()})
+        self.memory.on_change = lambda changes: journal.record("preferences", {"data": changes})
+        privacy.on_change = lambda changes: journal.record("privacy", {"data": changes})
+        journal.capture = self.session_state
+        journal.start()
+        if snapshot or records:
+            logger.info(f"Resumed session with {len(history)} turns ({len(records)} journal records) "
+                        f"in {(time.perf_counter() - start) * 1000:.1f} ms")
+    
+    @cached_property
+    def frame_encoder(self) -> FrameEncoder:
+        # Built on the first image request, so text-only use never imports cv2
+        return FrameEncoder()
+    
+    def initialize_system(self, audio=True, video=False, max_workers=4) -> Dict[str, float]:
+        """Initialize components in parallel; returns seconds spent per task"""
         logger.info("Initializing MIA for All system...")
-        # All components are initialized in __init__
-        logger.info("MIA for All system initialized")
+        # Load the LLMs now so the first turn does not pay the model load
+        tasks = {"llm": lambda: setattr(self, "warmup_report", self.warmup.warm_up(self.conversation_models()))}
+        if audio:
+            # Fixed replies are synthesized up front so speaking them costs nothing
+            tasks["tts"] = lambda: self.audio_video.tts.prewarm(self.canned_phrases())
+            tasks["stt"] = lambda: self.audio_video.stt.backend.load()
+            tasks["audio_device"] = lambda: self.audio_video.audio_device
+        if video:
+            tasks["camera"] = lambda: self.audio_video.camera
+        
+        def timed(task) -> float:
+            start = time.perf_counter()
+            task()
+            return time.perf_counter() - start
+        
+        start = time.perf_counter()
+        timings = {}
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="mia-init") as executor:
+            futures = {name: executor.submit(timed, task) for name, task in tasks.items()}
+            for name, future in futures.items():
+                try:
+                    timings[name] = future.result()
+                except Exception as e:
+                    logger.error(f"Error initializing {name}: {e}")
+        logger.info(
+            f"MIA for All system initialized in {time.perf_counter() - start:.2f} s ("
+            + ", ".join(f"{name} {seconds:.2f} s" for name, seconds in timings.items()) + ")"
+        )
+        return timings
+    
+    def conversation_models(self) -> List[str]:
+        """Installed models the conversation can route to"""
+        router = self.conversation.router
+        if router is None:
+            return [self.conversation.model_name]
+        return [tier.model for tier in router.tiers.values() if router.is_available(tier.model)]
     
-    def start_conversation(self):
+    def canned_phrases(self) -> List[str]:
+        """Fixed replies the system speaks over and over"""
+        return [
+            self.GREETING,
+            self.ERROR_REPLY,
+            self.VIDEO_CAPTURE_FAILED,
+            self.VIDEO_ERROR,
+            self.VIDEO_PENDING,
+            self.CAMERA_DISABLED,
+            self.DEFAULT_REPLY,
+            self.handle_conversation_request(),
+            self.handle_help_request(),
+            *ConversationModule.FALLBACK_REPLIES
+        ]
+    
+    def start_conversation(self, pipelined: bool = False):
         """Start the conversation loop"""
         self.is_running = True
         logger.info("MIA for All conversation started")
@@ -440,7 +4493,17 @@ class MIA_System:
         logger.info("Lahko ti izpolnim vse pogovorne, video in slikovne zahteve!")
         
         # Initial greeting
-        self.audio_video.speak("Pozdravljen! Sem MIA, tvoja osebna ženska asistentka. Lahko ti izpolnim vse pogovorne, video in slikovne zahteve!")
+        self.audio_video.speak(self.GREETING)
+        
+        if pipelined:
+            self.pipeline = ConversationPipeline(
+                self.audio_video,
+                self.conversation,
+                on_exchange=self._after_exchange,
+                respond=self.respond_stream
+            )
+            self.pipeline.run()
+            return
         
         while self.is_running:
             try:
@@ -448,17 +4511,20 @@ class MIA_System:
                 user_input = self.audio_video.listen()
                 
                 if user_input:
-                    # Process input
-                    response = self.conversation.process_input(user_input)
-                    
-                    # Speak response
-                    self.audio_video.speak(response)
+                    with get_metrics().span("turn"):
+                        if self.conversation.streaming:
+                            # Speak each sentence as soon as the model produces it
+                            response = self.audio_video.speak_stream(self.respond_stream(user_input))
+                        else:
+                            # Process input
+                            response = self.dispatch_intent(user_input)
+                            if response is None:
+                                response = self.conversation.process_input(user_input)
+                            
+                            # Speak response
+                            self.audio_video.speak(response)
                     
-                    # Update context
-                    self.context.update_context(user_input, response)
-                    
-                    # Adapt to user
-                    self.personalization.adapt_to_user(response)
+                    self._after_exchange(user_input, response)
                 
                 # Small delay to prevent excessive CPU usage
                 time.sleep(0.1)
@@ -468,43 +4534,149 @@ class MIA_System:
                 break
             except Exception as e:
                 logger.error(f"Error in conversation loop: {e}")
-                self.audio_video.speak("Oprostite, prišlo je do napake. Lahko poskusimo znova?")
+                self.audio_video.speak(self.ERROR_REPLY)
                 time.sleep(1)
     
+    def dispatch_intent(self, user_input: str) -> Optional[str]:
+        """Answer a command-like turn directly; None means the LLM should answer"""
+        routed = self.intents.route(user_input)
+        if routed is None:
+            return None
+        intent, confidence = routed
+        logger.info(f"Intent '{intent}' recognised ({confidence:.2f}), answering without the LLM")
+        # Image requests still go to the vision model
+        if intent != "image":
+            self.llm_calls_avoided += 1
+        return self.handle_intent(intent, user_input)
+    
+    def respond_stream(self, user_input: str) -> Iterator[str]:
+        """Reply sentences for a turn: a direct answer for commands, otherwise the LLM's stream"""
+        response = self.dispatch_intent(user_input)
+        if response is not None:
+            yield response
+            return
+        yield from self.conversation.stream_input(user_input)
+    
+    def _after_exchange(self, user_input: str, response: str):
+        """Bookkeeping after a finished exchange"""
+        # Update context
+        self.context.update_context(user_input, response)
+        if self.journal is not None:
+            self.journal.record("context", {"data": dict(self.context.conversation_context)})
+        
+        # Adapt to user
+        self.personalization.adapt_to_user(response)
+    
     def stop_conversation(self):
         """Stop the conversation"""
         self.is_running = False
+        if self.pipeline is not None:
+            self.pipeline.stop_event.set()
+        logger.info(f"Ollama connection stats: {self.conversation.client.stats()}")
+        if self.conversation.response_cache is not None:
+            logger.info(f"Response cache stats: {self.conversation.response_cache.stats()}")
+        if self.conversation.router is not None:
+            logger.info(f"Model router stats: {self.conversation.router.stats()}")
+        logger.info(f"Intent router stats: {self.intents.stats()}, LLM calls avoided: {self.llm_calls_avoided}")
+        if get_metrics().enabled:
+            logger.info(f"Stage timings: {get_metrics().summary()}")
+        # Only if a video request opened the camera
+        if "camera" in vars(self.audio_video):
+            logger.info(f"Camera capture stats: {self.audio_video.camera.stats()}")
+        if self.journal is not None:
+            # A fresh snapshot makes the next start a single file read
+            self.journal.snapshot()
+            self.journal.close()
+        if self.memory.store is not None:
+            # Rows still waiting for an embedding are queued again on the next start
+            self.memory.store.flush(timeout=2.0)
+            self.memory.store.close()
         logger.info("MIA for All conversation stopped")
     
     def handle_special_requests(self, request: str) -> str:
         """Handle special requests from user"""
-        if "video" in request.lower():
+        return self.handle_intent(self.intents.match(request), request)
+    
+    def handle_intent(self, intent: Optional[str], request: str = "") -> str:
+        """Answer a recognised intent"""
+        if intent == "video":
             return self.handle_video_request()
-        elif "image" in request.lower() or "slika" in request.lower():
-            return self.handle_image_request()
-        elif "conversation" in request.lower() or "pogovor" in request.lower():
+        elif intent == "image":
+            return self.handle_image_request(request)
+        elif intent == "conversation":
             return self.handle_conversation_request()
-        elif "help" in request.lower():
+        elif intent == "help":
             return self.handle_help_request()
         else:
-            return "Razumem, lahko vam pomagam s tem. Kaj bi želeli raziskati?"
+            return self.DEFAULT_REPLY
+    
+    def camera_allowed(self) -> bool:
+        """Whether the privacy settings let MIA use the camera"""
+        return self.security.privacy_controls.privacy_settings.get("video_recording", True)
     
     def handle_video_request(self) -> str:
         """Handle video-related requests"""
+        if not self.camera_allowed():
+            return self.CAMERA_DISABLED
         try:
-            frame = self.audio_video.capture_video()
-            if frame is not None:
-                analysis = self.audio_video.process_video(frame)
-                return f"Video analiza končana. Slika ima dimenzije {analysis.get('frame_shape', 'neznano')}"
-            else:
-                return "Video zajem ni uspel."
+            # Analysis runs on the video workers; the conversation only waits briefly
+            if self.video_future is None:
+                self.video_future = self.audio_video.analyze_video_async()
+            future = self.video_future
+            try:
+                error = future.exception(timeout=self.VIDEO_WAIT_S)
+            except FutureTimeoutError:
+                return self.VIDEO_PENDING
+            self.video_future = None
+            if error is not None:
+                raise error
+            return self.describe_video(future.result())
+        except TimeoutError:
+            return self.VIDEO_CAPTURE_FAILED
         except Exception as e:
             logger.error(f"Error in video request: {e}")
-            return "Oprostite, prišlo je do napake pri video analizi."
+            return self.VIDEO_ERROR
+    
+    def describe_video(self, results: List[Dict[str, Any]]) -> str:
+        """Spoken summary of a video analysis"""
+        if not results:
+            return self.VIDEO_CAPTURE_FAILED
+        last = results[-1]
+        parts = [f"Video analiza končana. Slika ima dimenzije {last.get('frame_shape', 'neznano')}."]
+        moving = any(result["motion"] > self.audio_video.video_processor.motion_threshold for result in results)
+        parts.append("Zaznano je gibanje." if moving else "Ni gibanja.")
+        cuts = sum(result["scene_change"] for result in results)
+        if cuts:
+            parts.append(f"Menjav prizora: {cuts}.")
+        labels = collections.Counter(
+            detection["label"] for found in last["detections"].values() for detection in found
+        )
+        if labels:
+            parts.append("Vidim: " + ", ".join(f"{label} ({count})" for label, count in labels.most_common()) + ".")
+        return " ".join(parts)
     
-    def handle_image_request(self) -> str:
+    def handle_image_request(self, request: str = "") -> str:
         """Handle image-related requests"""
-        return "Slikovne zahteve so podprte. Lahko mi poveš, kaj bi želel videti v sliki?"
+        if not self.camera_allowed():
+            return self.CAMERA_DISABLED
+        try:
+            frame = self.audio_video.capture_video()
+            if frame is None:
+                return self.VIDEO_CAPTURE_FAILED
+            conversation = self.conversation
+            # In context mode an unchanged scene is already in the KV cache and is not resent
+            in_context = conversation.context_images if conversation.mode == "context" else ()
+            prepared = self.frame_encoder.prepare([frame], exclude=in_context)
+            # The frame is encoded now, its camera slot can go back
+            self.audio_video.camera.release()
+            response = conversation.process_input(request or self.IMAGE_PROMPT, modality="image",
+                                                  images=[image for _, image in prepared])
+            if conversation.mode == "context":
+                conversation.context_images.update(frame_hash for frame_hash, _ in prepared)
+            return response
+        except Exception as e:
+            logger.error(f"Error in image request: {e}")
+            return self.VIDEO_ERROR
     
     def handle_conversation_request(self) -> str:
         """Handle conversation-related requests"""
@@ -531,7 +4703,7 @@ def main():
     
     # Check if Ollama is running
     try:
-        response = requests.get("http://localhost:11434/api/tags", timeout=5)
+        response = get_ollama_client().get("/api/tags", timeout=5)
         if response.status_code == 200:
             logger.info("Ollama server is running and accessible")
         else:
@@ -542,18 +4714,30 @@ def main():
         print("Za namestitev Ollama: https://ollama.com/download")
         return
     
-    # Create MIA system instance
-    mia = MIA_System()
+    # Create MIA system instance; MIA_KEEP_ALIVE is an Ollama duration ("30m") or seconds (-1 pins forever)
+    keep_alive = os.environ.get("MIA_KEEP_ALIVE", "30m")
+    # MIA_PASSPHRASE derives the at-rest key from a passphrase instead of the generated key file
+    passphrase = os.environ.get("MIA_PASSPHRASE")
+    mia = MIA_System(keep_alive=int(keep_alive) if keep_alive.lstrip("-").isdigit() else keep_alive,
+                     encryption=create_encryption(passphrase=passphrase) if passphrase else None)
+    
+    # MIA_METRICS_PORT serves Prometheus metrics, MIA_TRACE_FILE appends a JSON-lines span trace
+    metrics_port = os.environ.get("MIA_METRICS_PORT")
+    trace_path = os.environ.get("MIA_TRACE_FILE")
+    if metrics_port or trace_path:
+        configure_metrics(trace_path=trace_path, port=int(metrics_port) if metrics_port else None)
     
     # Initialize system
     mia.initialize_system()
     
     # Start conversation
     try:
-        mia.start_conversation()
+        mia.start_conversation(pipelined=True)
     except Exception as e:
         logger.error(f"Error starting MIA for All system: {e}")
         print("Napaka pri zagonu sistema MIA for All")
+    finally:
+        mia.stop_conversation()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -22,20 +22,1068 @@ def test_imports():
 def test_basic_functionality():
     """Test basic system functionality"""
     try:
+        import tempfile
         from mia_system import MIA_System
-        mia = MIA_System()
+        with tempfile.TemporaryDirectory() as directory:
+            mia = MIA_System(data_dir=os.path.join(directory, "data"), cache_dir=directory, config_dir=directory)
+            # One shared context manager and history store
+            assert mia.context is mia.conversation.context_manager
+            assert mia.memory.conversation_memory is mia.conversation.conversation_history
+            mia.journal.close()
         print("✓ MIA System initialized successfully")
         return True
     except Exception as e:
         print(f"✗ System initialization failed: {e}")
         return False
 
+def test_sentence_splitter():
+    """Test that streamed chunks are cut at sentence boundaries"""
+    try:
+        from mia_system import SentenceSplitter
+        splitter = SentenceSplitter()
+        sentences = []
+        for chunk in ["Pozdravljen, kako ", "si danes? Jaz sem ", "dobro, hvala. Lepo"]:
+            sentences.extend(splitter.feed(chunk))
+        sentences.extend(splitter.flush())
+        assert sentences == ["Pozdravljen, kako si danes?", "Jaz sem dobro, hvala.", "Lepo"]
+        print("✓ Sentence splitter works")
+        return True
+    except Exception as e:
+        print(f"✗ Sentence splitter failed: {e}")
+        return False
+
+def test_voice_activity_detection():
+    """Test that the VAD yields one segment per synthetic utterance"""
+    try:
+        from mia_system import VoiceActivityDetector
+        from benchmark_mia import synthetic_utterances
+        audio = synthetic_utterances(count=3)
+        vad = VoiceActivityDetector()
+        chunks = (audio[i:i + 2048] for i in range(0, len(audio), 2048))
+        segments = list(vad.segments(chunks))
+        assert len(segments) == 3
+        assert vad.stats()["avg_saved_s"] > 0
+        
+        # A stream that stops mid-utterance still yields the last segment
+        cut = audio[:len(audio) - int(16000 * 1.3) * 2]
+        vad = VoiceActivityDetector()
+        chunks = (cut[i:i + 2048] for i in range(0, len(cut), 2048))
+        assert len(list(vad.segments(chunks))) == 3
+        print("✓ Voice activity detection works")
+        return True
+    except Exception as e:
+        print(f"✗ Voice activity detection failed: {e}")
+        return False
+
+def test_streaming_stt():
+    """Test overlapping-window transcription and partial hypotheses from listen()"""
+    try:
+        import numpy as np
+        from mia_system import (AudioDevice, AudioVideoInterface, InMemoryAudioBackend,
+                                SpeechToText, STTBackend)
+        from benchmark_mia import synthetic_utterances
+        
+        class BlockWords(STTBackend):
+            """One word per 0.25 s block, named after the block's constant sample value"""
+            name = "blocks"
+            
+            def transcribe(self, samples, rate):
+                block = rate // 4
+                return " ".join(f"w{round(samples[i] * 32768)}" for i in range(0, len(samples) - block + 1, block))
+        
+        stt = SpeechToText(backend=BlockWords(), chunk_seconds=1.0, overlap_seconds=0.25)
+        audio = np.repeat(np.arange(1, 13, dtype=np.int16), 4000).tobytes()
+        hypotheses = list(stt.transcribe_stream(audio[i:i + 1000] for i in range(0, len(audio), 1000)))
+        partials = [text for text, is_final in hypotheses if not is_final]
+        assert len(partials) >= 3 and all(b.startswith(a) for a, b in zip(partials, partials[1:]))
+        assert hypotheses[-1] == (" ".join(f"w{i}" for i in range(1, 13)), True)
+        
+        # Partial hypotheses reach the caller while the utterance is still being spoken
+        class Counting(STTBackend):
+            name = "counting"
+            calls = 0
+            
+            def transcribe(self, samples, rate):
+                self.calls += 1
+                return f"del{self.calls}"
+        
+        device = AudioDevice(backend=InMemoryAudioBackend(synthetic_utterances(count=1)))
+        audio_video = AudioVideoInterface(audio_device=device)
+        audio_video.stt = SpeechToText(backend=Counting(), chunk_seconds=0.5, overlap_seconds=0.1)
+        heard = []
+        try:
+            text = audio_video.listen(on_partial=heard.append)
+        finally:
+            device.close()
+        assert heard and text.startswith(heard[-1])
+        print("✓ Streaming STT works")
+        return True
+    except Exception as e:
+        print(f"✗ Streaming STT failed: {e}")
+        return False
+
+def test_in_memory_audio_device():
+    """Test microphone and speaker on the headless in-memory audio backend"""
+    try:
+        from mia_system import AudioDevice, InMemoryAudioBackend, Microphone, Speaker
+        from benchmark_mia import synthetic_utterances
+        backend = InMemoryAudioBackend(synthetic_utterances(count=1))
+        device = AudioDevice(backend=backend)
+        try:
+            assert len(Microphone(device=device).record_utterance()) > 0
+            tone = b"\x10\x00" * 8000
+            Speaker(device=device).play(tone)
+            assert bytes(backend.output).startswith(tone)
+        finally:
+            device.close()
+        print("✓ In-memory audio device works")
+        return True
+    except Exception as e:
+        print(f"✗ In-memory audio device failed: {e}")
+        return False
+
+def test_conversation_pipeline():
+    """Test that the pipeline streams partial transcripts, ignores its own playback and still takes a barge-in"""
+    try:
+        import time
+        import numpy as np
+        from mia_system import (AudioDevice, AudioVideoInterface, ConversationPipeline,
+                                InMemoryAudioBackend, SpeechToText, STTBackend, TextToSpeech, TTSBackend)
+        from benchmark_mia import synthetic_utterances
+        
+        class EchoBackend(InMemoryAudioBackend):
+            """Feeds everything the speaker plays back into the microphone"""
+            echo_pos = 0
+            
+            def next_input(self, size):
+                data = super().next_input(size) or bytes(size)
+                with self.lock:
+                    echo = bytes(self.output[self.echo_pos:self.echo_pos + size])
+                    self.echo_pos += len(echo)
+                mixed = np.frombuffer(data, dtype=np.int16).astype(np.int32)
+                mixed[:len(echo) // 2] += np.frombuffer(echo, dtype=np.int16)
+                return np.clip(mixed, -32768, 32767).astype(np.int16).tobytes()
+        
+        class FixedSTT(STTBackend):
+            name = "fixed"
+            
+            def transcribe(self, samples, rate):
+                return "Živjo"
+        
+        class ToneTTS(TTSBackend):
+            """A tone loud enough for the plain VAD threshold, as echo usually is"""
+            name = "tone"
+            seconds = 1.0
+            
+            def synthesize(self, text, voice, rate):
+                t = np.arange(int(rate * self.seconds)) / rate
+                return (1400 * np.sin(2 * np.pi * 200 * t)).astype(np.int16).tobytes()
+        
+        def wait_for(condition, timeout=10.0):
+            deadline = time.monotonic() + timeout
+            while not condition():
+                assert time.monotonic() < deadline, "timed out"
+                time.sleep(0.05)
+        
+        turns, partials = [], []
+        def respond(text):
+            turns.append(text)
+            yield "Odgovor."
+        
+        backend = EchoBackend(realtime=True)
+        device = AudioDevice(backend=backend)
+        audio_video = AudioVideoInterface(audio_device=device)
+        tts_backend = ToneTTS()
+        audio_video.stt = SpeechToText(backend=FixedSTT(), chunk_seconds=1.0, overlap_seconds=0.25)
+        audio_video.tts = TextToSpeech(backend=tts_backend, use_cache=False)
+        pipeline = ConversationPipeline(audio_video, None, respond=respond, on_partial=partials.append)
+        speech = synthetic_utterances(count=1)
+        pipeline.start()
+        try:
+            # The reply's echo must not be taken for a new turn
+            backend.feed(speech)
+            wait_for(lambda: pipeline.current_turn is not None and pipeline.current_turn.finished.is_set())
+            time.sleep(1.5)
+            assert turns == ["Živjo"] and partials and pipeline.barge_ins == 0
+            
+            # Real speech over a long reply still cancels it
+            tts_backend.seconds = 6.0
+            played = len(backend.output)
+            backend.feed(speech)
+            wait_for(lambda: len(backend.output) > played)
+            backend.feed(speech)
+            wait_for(lambda: pipeline.barge_ins == 1)
+        finally:
+            pipeline.stop()
+            device.close()
+        print("✓ Conversation pipeline works")
+        return True
+    except Exception as e:
+        print(f"✗ Conversation pipeline failed: {e}")
+        return False
+
+def test_context_token_budget():
+    """Test that the context keeps only the newest exchanges that fit the budget"""
+    try:
+        from mia_system import ContextManager, approx_tokens
+        history = [{"user": f"vprašanje {i}", "response": f"odgovor {i}"} for i in range(50)]
+        manager = ContextManager(token_budget=40)
+        context = manager.get_context(history)
+        assert approx_tokens(context) <= 40 + approx_tokens("Kontekst pogovora:")
+        assert "vprašanje 49" in context and "vprašanje 0\n" not in context
+        assert manager.get_context(history) is context
+        print("✓ Context token budget works")
+        return True
+    except Exception as e:
+        print(f"✗ Context token budget failed: {e}")
+        return False
+
+def test_context_mode():
+    """Test that KV-cache contexts are kept per model, capped, and re-seeded from history"""
+    try:
+        from mia_system import ConversationModule
+        conversation = ConversationModule(streaming=False, mode="context", max_context_tokens=100)
+        prompt, options = conversation._prepare_request("Živjo", "mistral")
+        assert prompt == "Živjo" and "system" in options
+        conversation._handle_final_response({"context": [1, 2, 3]})
+        conversation._record_exchange("Živjo", "Pozdravljen!")
+        assert conversation._prepare_request("Kako si?", "mistral")[1]["context"] == [1, 2, 3]
+        
+        # Another model gets a fresh context seeded with the history; the first one is kept
+        prompt, options = conversation._prepare_request("Kako si?", "llama3.2:1b")
+        assert "Pozdravljen!" in prompt and "system" in options and "context" not in options
+        conversation._handle_final_response({"context": [4, 5]})
+        assert conversation.ollama_contexts == {"mistral": [1, 2, 3], "llama3.2:1b": [4, 5]}
+        
+        # An overlong context is dropped and the next turn re-seeds it
+        conversation._prepare_request("Povej več", "mistral")
+        conversation._handle_final_response({"context": list(range(101))})
+        assert "mistral" not in conversation.ollama_contexts
+        assert "Pozdravljen!" in conversation._prepare_request("Povej več", "mistral")[0]
+        print("✓ Context mode works")
+        return True
+    except Exception as e:
+        print(f"✗ Context mode failed: {e}")
+        return False
+
+def test_conversation_history():
+    """Test that the bounded history spills old turns and keeps global indices"""
+    try:
+        import tempfile
+        from mia_system import ConversationHistory
+        with tempfile.TemporaryDirectory() as directory:
+            spill_path = os.path.join(directory, "history.jsonl")
+            history = ConversationHistory(capacity=10, spill_path=spill_path)
+            for i in range(25):
+                history.append(f"vprašanje {i}", f"odgovor {i}")
+            assert len(history) == 25 and len(history.turns) <= 10
+            assert history[-1].get("user") == "vprašanje 24"
+            assert [turn.user for turn in history[:history.first_index + 1]] == [f"vprašanje {history.first_index}"]
+            with open(spill_path, encoding="utf-8") as f:
+                assert sum(1 for _ in f) == history.first_index
+        print("✓ Conversation history works")
+        return True
+    except Exception as e:
+        print(f"✗ Conversation history failed: {e}")
+        return False
+
+def test_memory_embeddings():
+    """Test storing and recalling memories through the embedding path, across transient failures"""
+    try:
+        import tempfile
+        from benchmark_mia import FakeOllamaServer
+        from mia_system import MemoryStore, OllamaClient, ResponseCache
+        with tempfile.TemporaryDirectory() as directory:
+            with FakeOllamaServer(embed_delay=0, embed_failures=2) as server:
+                client = OllamaClient(server.url)
+                store = MemoryStore(directory, client=client, flush_interval=0.05, retry_initial=0.05)
+                store.add("Kako ji je ime?", "Ime ji je Ana.")
+                store.add("Kje živi?", "V Ljubljani.")
+                store.flush()
+                assert store.embedding_enabled and store.rows == 2
+                found = store.search("Kje živi?\nV Ljubljani.", min_similarity=0.99)
+                assert found and found[0]["response"] == "V Ljubljani."
+                store.close()
+                
+                cache = ResponseCache(client, retry_initial=0)
+                server.httpd.embed_failures = 1
+                assert cache.get("Živjo", "prijazna", "mistral") is None and cache.semantic
+                cache.put("Živjo", "prijazna", "mistral", "Živjo!")
+                assert cache.matrix is not None
+            
+            # Only a missing model turns the vector tier off
+            with FakeOllamaServer(embed_delay=0, embed_models=["other"]) as server:
+                client = OllamaClient(server.url)
+                store = MemoryStore(os.path.join(directory, "missing"), client=client, flush_interval=0.05)
+                store.add("vprašanje", "odgovor")
+                store.worker.join(timeout=5)
+                assert not store.embedding_enabled
+                store.close()
+                cache = ResponseCache(client)
+                cache.get("Živjo", "prijazna", "mistral")
+                assert not cache.semantic
+        print("✓ Memory embeddings work")
+        return True
+    except Exception as e:
+        print(f"✗ Memory embeddings failed: {e}")
+        return False
+
+def test_memory_store():
+    """Test vector file growth, blockwise top-k search and re-embedding of rows left over on reopen"""
+    try:
+        import tempfile
+        import time
+        import numpy as np
+        from mia_system import MemoryStore
+        
+        class FakeEmbeddings:
+            def __init__(self):
+                self.random = np.random.default_rng(0)
+                self.vectors = {}
+                self.fail = False
+            
+            def embed(self, model, texts, priority=None):
+                if self.fail:
+                    raise RuntimeError("Ollama still starting")
+                for text in texts:
+                    if text not in self.vectors:
+                        vector = self.random.standard_normal(8).astype(np.float32)
+                        self.vectors[text] = vector / np.linalg.norm(vector)
+                return np.stack([self.vectors[text] for text in texts])
+        
+        with tempfile.TemporaryDirectory() as directory:
+            client = FakeEmbeddings()
+            store = MemoryStore(directory, client=client, batch_size=3, flush_interval=0.05, block_rows=4)
+            capacities = []
+            for n in range(9):
+                store.add(f"vprašanje {n}", f"odgovor {n}")
+                if n % 3 == 2:
+                    store.flush()
+                    capacities.append(store.capacity)
+            # The file starts at block_rows and doubles when a batch does not fit
+            assert store.rows == 9 and capacities == [4, 8, 16], capacities
+            assert os.path.getsize(store.vectors_path) == 16 * 8 * 4
+            
+            # Top-k over several blocks matches a brute-force ranking
+            query = "vprašanje 7\nodgovor 7"
+            expected = np.argsort(-(np.asarray(store.vectors[:9]) @ client.vectors[query]))[:3]
+            found = store.search(query, k=3, min_similarity=-1.0)
+            assert [r["response"] for r in found] == [f"odgovor {n}" for n in expected]
+            assert found[0]["response"] == "odgovor 7" and found[0]["similarity"] > 0.99
+            assert [r["similarity"] for r in found] == sorted((r["similarity"] for r in found), reverse=True)
+            store.close()
+            
+            # Rows whose embedding never got written are picked up again on reopen
+            client.fail = True
+            store = MemoryStore(directory, client=client, flush_interval=0.05, block_rows=4, retry_initial=10.0)
+            assert store.rows == 9 and store.capacity == 16
+            store.add("Kako ji je ime?", "Ime ji je Ana.")
+            store.add("Kje živi?", "V Ljubljani.")
+            time.sleep(0.2)
+            store.close()
+            assert store.rows == 9
+            
+            client.fail = False
+            store = MemoryStore(directory, client=client, flush_interval=0.05, block_rows=4)
+            store.flush()
+            assert store.rows == 11 and not store.pending.unfinished_tasks
+            found = store.search("Kje živi?\nV Ljubljani.", k=1, min_similarity=0.99)
+            assert found and found[0]["response"] == "V Ljubljani."
+            store.close()
+        print("✓ Memory store works")
+        return True
+    except Exception as e:
+        print(f"✗ Memory store failed: {e}")
+        return False
+
+def test_response_cache():
+    """Test exact hits, expiry, LRU eviction, scoping and the semantic tier of the reply cache"""
+    try:
+        import time
+        import numpy as np
+        from mia_system import ResponseCache
+        
+        class FakeEmbeddings:
+            def __init__(self, vectors):
+                self.vectors = {text: np.asarray(v, dtype=np.float32) for text, v in vectors.items()}
+                self.calls = 0
+                self.fail = False
+            
+            def embed(self, model, texts, priority=None):
+                self.calls += 1
+                if self.fail:
+                    raise RuntimeError("scheduler queue full")
+                return np.stack([self.vectors.get(text, np.zeros(3, dtype=np.float32)) for text in texts])
+        
+        # Exact tier: normalized text, scoped to personality and model
+        cache = ResponseCache(FakeEmbeddings({}), semantic=False)
+        cache.put("Živjo!", "prijazna", "mistral", "Živjo, kako ti lahko pomagam?")
+        assert cache.get("  živjo ", "prijazna", "mistral") == "Živjo, kako ti lahko pomagam?"
+        assert cache.get("Živjo", "resna", "mistral") is None
+        assert cache.get("Živjo", "prijazna", "llama3") is None
+        assert cache.stats()["exact_hits"] == 1 and cache.stats()["misses"] == 2
+        assert not cache.cacheable("ena dva tri štiri pet šest sedem osem devet deset enajst dvanajst trinajst")
+        
+        # Entries older than the TTL are dropped on lookup and free their slot
+        cache = ResponseCache(FakeEmbeddings({}), semantic=False, ttl=0.05)
+        cache.put("Koliko je ura?", "prijazna", "mistral", "Ne vem.")
+        time.sleep(0.1)
+        assert cache.get("Koliko je ura?", "prijazna", "mistral") is None
+        assert not cache.entries and len(cache.free_slots) == cache.max_entries
+        
+        # A full cache evicts the least recently used entry, not the oldest
+        cache = ResponseCache(FakeEmbeddings({}), semantic=False, max_entries=2)
+        cache.put("prvo", "prijazna", "mistral", "1")
+        cache.put("drugo", "prijazna", "mistral", "2")
+        assert cache.get("prvo", "prijazna", "mistral") == "1"
+        cache.put("tretje", "prijazna", "mistral", "3")
+        assert cache.get("drugo", "prijazna", "mistral") is None
+        assert cache.get("prvo", "prijazna", "mistral") == "1"
+        assert cache.get("tretje", "prijazna", "mistral") == "3"
+        assert cache.evictions == 1 and len(cache.entries) == 2
+        
+        # Semantic tier: a paraphrase above the threshold hits, one below it and other scopes miss
+        client = FakeEmbeddings({
+            "kako si": [1.0, 0.0, 0.0],
+            "kako se imaš": [0.96, 0.28, 0.0],
+            "kaj delaš": [0.8, 0.6, 0.0]
+        })
+        cache = ResponseCache(client, similarity_threshold=0.92)
+        assert cache.get("Kako si?", "prijazna", "mistral") is None
+        cache.put("Kako si?", "prijazna", "mistral", "Dobro, hvala.")
+        assert client.calls == 1, "put() after a miss reuses the lookup embedding"
+        assert cache.get("Kako se imaš?", "prijazna", "mistral") == "Dobro, hvala."
+        assert cache.get("Kaj delaš?", "prijazna", "mistral") is None
+        assert cache.get("Kako se imaš?", "resna", "mistral") is None
+        assert cache.stats()["semantic_hits"] == 1
+        
+        # A transient embedding failure pauses the semantic tier, doubling up to retry_max
+        client = FakeEmbeddings({"kako si": [1.0, 0.0, 0.0], "kako si danes": [0.0, 1.0, 0.0]})
+        cache = ResponseCache(client, retry_initial=5.0, retry_max=12.0)
+        client.fail = True
+        assert cache.get("Kako si?", "prijazna", "mistral") is None
+        assert cache.embed_backoff == 5.0 and cache.embed_retry_at > time.monotonic() + 4
+        calls = client.calls
+        cache.put("Kako si?", "prijazna", "mistral", "Dobro, hvala.")
+        assert client.calls == calls, "no embedding requests while paused"
+        assert cache.get("Kako si?", "prijazna", "mistral") == "Dobro, hvala."
+        for expected in (10.0, 12.0):
+            cache.embed_retry_at = 0.0
+            assert cache.get("Kako se imaš?", "prijazna", "mistral") is None
+            assert cache.embed_backoff == expected
+        assert cache.semantic
+        client.fail = False
+        cache.embed_retry_at = 0.0
+        cache.get("Kako si danes?", "prijazna", "mistral")
+        assert cache.embed_backoff == 0.0 and cache.matrix is not None
+        print("✓ Response cache works")
+        return True
+    except Exception as e:
+        print(f"✗ Response cache failed: {e}")
+        return False
+
+def test_tts_cache():
+    """Test that only pre-warmed phrases reach the disk and settings are part of the key"""
+    try:
+        import subprocess
+        import tempfile
+        from mia_system import TTSCache, TextToSpeech, DummyTTSBackend, EspeakTTSBackend
+        with tempfile.TemporaryDirectory() as directory:
+            cache = TTSCache(directory)
+            tts = TextToSpeech(backend=DummyTTSBackend(), cache=cache)
+            tts.synthesize("Zasebni odgovor.")
+            tts.prewarm(["Pozdravljen!"])
+            stored = [name for _, _, names in os.walk(directory) for name in names]
+            assert len(stored) == 1
+            assert stored[0] == TTSCache.key("Pozdravljen!", tts.voice, tts.rate, "dummy") + ".pcm"
+        
+        slow, fast = EspeakTTSBackend(120, executable="espeak-ng"), EspeakTTSBackend(200, executable="espeak-ng")
+        assert slow.cache_id != fast.cache_id
+        calls = []
+        def fake_run(args, **kwargs):
+            calls.append(args)
+            raise subprocess.CalledProcessError(1, args)
+        original = subprocess.run
+        subprocess.run = fake_run
+        try:
+            slow.synthesize("-1 stopinja zunaj", "sl", 16000)
+        except subprocess.CalledProcessError:
+            pass
+        finally:
+            subprocess.run = original
+        assert calls[0][-2:] == ["--", "-1 stopinja zunaj"]
+        print("✓ TTS cache works")
+        return True
+    except Exception as e:
+        print(f"✗ TTS cache failed: {e}")
+        return False
+
+def test_warmup_prefix():
+    """Test that warm-up primes the same prompt prefix real turns start with"""
+    try:
+        from benchmark_mia import FakeOllamaServer
+        from mia_system import ConversationModule, ModelWarmup, OllamaClient
+        with FakeOllamaServer(first_token_delay=0, token_delay=0) as server:
+            client = OllamaClient(server.url)
+            for mode in ConversationModule.MODES:
+                conversation = ConversationModule(streaming=False, client=client, mode=mode)
+                sent = []
+                post = client.post
+                client.post = lambda path, **kwargs: sent.append(kwargs["json"]) or post(path, **kwargs)
+                try:
+                    assert "error" not in ModelWarmup(client, conversation=conversation).warm_up(["mistral"])["mistral"]
+                finally:
+                    client.post = post
+                prompt, options = conversation._prepare_request("Kako si?", "mistral")
+                if mode == "context":
+                    assert sent[0]["system"] == options["system"]
+                else:
+                    assert prompt.startswith(sent[0]["prompt"]) and conversation.personality in sent[0]["prompt"]
+        print("✓ Warm-up prefix works")
+        return True
+    except Exception as e:
+        print(f"✗ Warm-up prefix failed: {e}")
+        return False
+
+def test_model_router():
+    """Test that short turns go to the fast tier and complex ones to the slow tier"""
+    try:
+        from mia_system import ModelRouter
+        router = ModelRouter()
+        assert router.classify("Živjo, kako si") == ModelRouter.FAST
+        assert router.classify("Razloži mi, kako deluje fotosinteza") == ModelRouter.SLOW
+        assert router.classify(" ".join(["beseda"] * 30)) == ModelRouter.SLOW
+        
+        # A turn that raises must give its slot back
+        import threading
+        import time
+        from mia_system import ConversationModule
+        router = ModelRouter(fast_concurrency=1, slow_concurrency=1, queue_timeout=0.05)
+        router.is_available = lambda model: True
+        conversation = ConversationModule(streaming=False, router=router)
+        def broken(user_input, model=None):
+            raise RuntimeError("prompt failed")
+        conversation._prepare_request = broken
+        replies = []
+        def turns():
+            for _ in range(3):
+                replies.append(conversation.process_input("živjo"))
+            del conversation._prepare_request
+            conversation._generate_response_with_ollama = lambda prompt, model=None, **options: "Živjo!"
+            replies.append(conversation.process_input("živjo"))
+        worker = threading.Thread(target=turns, daemon=True)
+        worker.start()
+        worker.join(timeout=5)
+        assert replies == [ConversationModule.PROCESSING_ERROR] * 3 + ["Živjo!"], "turn blocked on a leaked router slot"
+        # A local bug is not the model's fault; a failed model call is
+        assert not any(tier.degraded or tier.errors for tier in router.tiers.values())
+        conversation._generate_response_with_ollama = lambda prompt, model=None, **options: ConversationModule.LLM_NOT_RUNNING
+        conversation.process_input("živjo")
+        assert router.tiers[ModelRouter.FAST].degraded
+        
+        # A slow /api/tags probe must not hold up other turns
+        probing, answer = threading.Event(), threading.Event()
+        class SlowTags:
+            status_code = 200
+            def get(self, path, timeout=None):
+                probing.set()
+                answer.wait(5)
+                return self
+            def json(self):
+                return {"models": [{"name": "mistral:latest"}]}
+        router = ModelRouter(client=SlowTags())
+        prober = threading.Thread(target=router.is_available, args=("mistral",), daemon=True)
+        prober.start()
+        assert probing.wait(5)
+        start = time.monotonic()
+        assert router.is_available("mistral") and time.monotonic() - start < 1
+        answer.set()
+        prober.join(5)
+        assert router.is_available("mistral") and not router.is_available("llama3.2:1b")
+        print("✓ Model router works")
+        return True
+    except Exception as e:
+        print(f"✗ Model router failed: {e}")
+        return False
+
+def test_text_only_startup():
+    """Test that text-only use does not import torch, cv2 or pyaudio"""
+    try:
+        import subprocess
+        import tempfile
+        code = (
+            f"import sys; sys.path.insert(0, {os.path.dirname(os.path.abspath(__file__))!r}); "
+            "import mia_system; mia_system.MIA_System(data_dir='data', cache_dir='cache', config_dir='config'); "
+            "print([name for name in ('torch', 'cv2', 'pyaudio') if name in sys.modules])"
+        )
+        with tempfile.TemporaryDirectory() as cwd:
+            output = subprocess.run([sys.executable, "-c", code], cwd=cwd, capture_output=True, text=True, check=True).stdout
+        assert output.strip().splitlines()[-1] == "[]", output
+        print("✓ Text-only startup works")
+        return True
+    except Exception as e:
+        print(f"✗ Text-only startup failed: {e}")
+        return False
+
+def test_camera_capture():
+    """Test threaded capture from the synthetic frame source"""
+    try:
+        import threading
+        from mia_system import Camera, SyntheticFrameSource
+        camera = Camera(source=SyntheticFrameSource(width=160, height=120), fps=100)
+        first = camera.capture()
+        assert first.shape == (120, 160, 3) and not first.flags.writeable
+        second = camera.capture()
+        assert camera.capture_thread.holders.count(1) == 1
+        
+        # Another thread's capture must not hand back the frame this thread still uses
+        other = threading.Thread(target=camera.capture)
+        other.start()
+        other.join()
+        assert sum(camera.capture_thread.holders) == 2
+        camera.release()
+        assert sum(camera.capture_thread.holders) == 1
+        assert camera.stats()["captured"] >= 1
+        camera.capture_thread.stop()
+        print("✓ Camera capture works")
+        return True
+    except Exception as e:
+        print(f"✗ Camera capture failed: {e}")
+        return False
+
+def test_video_analysis():
+    """Test motion detection and skipping of unchanged frames"""
+    try:
+        import numpy as np
+        from mia_system import VideoProcessor
+        processor = VideoProcessor(detectors=[])
+        still = np.zeros((240, 320, 3), dtype=np.uint8)
+        moved = still.copy()
+        moved[60:180, 80:240] = 255
+        results = processor.analyze_batch([still, still, moved, moved])
+        assert [result["skipped"] for result in results] == [False, True, False, True]
+        assert results[2]["motion"] > 0.2 and results[1]["motion"] == 0
+        assert results[0]["frame_shape"] == (240, 320)
+        processor.pool.shutdown()
+        print("✓ Video analysis works")
+        return True
+    except Exception as e:
+        print(f"✗ Video analysis failed: {e}")
+        return False
+
+def test_frame_encoder():
+    """Test that near-identical frames are sent once and the byte cap holds"""
+    try:
+        import numpy as np
+        from mia_system import FrameEncoder
+        encoder = FrameEncoder(max_request_bytes=50_000)
+        frame = np.tile(np.linspace(0, 255, 640).astype(np.uint8)[None, :, None], (480, 1, 3))
+        nearly = frame.copy()
+        nearly[0, 0] = 0
+        noise = np.random.default_rng(0).integers(0, 255, frame.shape, dtype=np.uint8)
+        prepared = encoder.prepare([frame, nearly, noise])
+        assert len(prepared) == 2 and encoder.stats()["duplicates"] == 1
+        assert sum(len(image) for _, image in prepared) <= 50_000
+        assert encoder.prepare([nearly], exclude=[prepared[0][0]]) == []
+        print("✓ Frame encoder works")
+        return True
+    except Exception as e:
+        print(f"✗ Frame encoder failed: {e}")
+        return False
+
+def test_metrics():
+    """Test stage histograms and the Prometheus export"""
+    try:
+        from mia_system import Metrics
+        disabled = Metrics()
+        with disabled.span("stt"):
+            pass
+        assert disabled.histograms == {}
+        metrics = Metrics(enabled=True)
+        with metrics.span("stt"):
+            pass
+        metrics.observe("llm_eval", 0.3)
+        text = metrics.prometheus()
+        assert 'mia_stage_seconds_count{stage="stt"} 1' in text
+        assert 'mia_stage_seconds_bucket{stage="llm_eval",le="0.25"} 0' in text
+        assert 'mia_stage_seconds_bucket{stage="llm_eval",le="0.5"} 1' in text
+        print("✓ Metrics work")
+        return True
+    except Exception as e:
+        print(f"✗ Metrics failed: {e}")
+        return False
+
+def test_request_scheduler():
+    """Test priority admission, coalescing, embedding batches and queue limits"""
+    try:
+        import threading
+        import time
+        import numpy as np
+        from concurrent.futures import ThreadPoolExecutor
+        from mia_system import RequestScheduler, OllamaBusyError
+        scheduler = RequestScheduler(max_concurrency=1, max_queue=(4, 1))
+        release = scheduler.acquire(RequestScheduler.BACKGROUND)
+        order = []
+        def wait_for(priority):
+            release_slot = scheduler.acquire(priority)
+            order.append(priority)
+            release_slot()
+        with ThreadPoolExecutor(2) as pool:
+            pool.submit(wait_for, RequestScheduler.BACKGROUND)
+            while not scheduler.waiters[RequestScheduler.BACKGROUND]:
+                pass
+            try:
+                scheduler.acquire(RequestScheduler.BACKGROUND)
+                raise AssertionError("full queue admitted a request")
+            except OllamaBusyError:
+                pass
+            pool.submit(wait_for, RequestScheduler.INTERACTIVE)
+            while not scheduler.waiters[RequestScheduler.INTERACTIVE]:
+                pass
+            release()
+        assert order == [RequestScheduler.INTERACTIVE, RequestScheduler.BACKGROUND]
+        
+        calls = []
+        gate = threading.Event()
+        def send():
+            calls.append(1)
+            gate.wait()
+            return "odgovor"
+        with ThreadPoolExecutor(4) as pool:
+            results = [pool.submit(scheduler.run, RequestScheduler.INTERACTIVE, send, "isti") for _ in range(4)]
+            while scheduler.coalesced < 3:
+                pass
+            gate.set()
+        assert [r.result() for r in results] == ["odgovor"] * 4 and len(calls) == 1
+        
+        batches = []
+        def embed(model, texts, priority):
+            batches.append(list(texts))
+            return np.arange(len(texts), dtype=np.float32)[:, None]
+        scheduler.embed_window = 0.05
+        with ThreadPoolExecutor(8) as pool:
+            rows = list(pool.map(lambda i: scheduler.embed("nomic", [f"t{i}"], embed), range(8)))
+        assert len(batches) == 1 and sorted(batches[0]) == [f"t{i}" for i in range(8)]
+        assert all(batches[0][int(row[0, 0])] == f"t{i}" for i, row in enumerate(rows))
+        
+        # A leader interrupted while sending must not leave its followers waiting forever
+        def interrupted(model, texts, priority):
+            raise KeyboardInterrupt
+        errors = []
+        def call(send):
+            try:
+                scheduler.embed("nomic", ["x"], send)
+            except BaseException as e:
+                errors.append(type(e))
+        scheduler.embed_window = 0.2
+        leader = threading.Thread(target=call, args=(interrupted,), daemon=True)
+        leader.start()
+        time.sleep(0.05)
+        follower = threading.Thread(target=call, args=(embed,), daemon=True)
+        follower.start()
+        leader.join(2)
+        follower.join(2)
+        assert errors == [KeyboardInterrupt, KeyboardInterrupt] and not scheduler.embed_batches
+        print("✓ Request scheduler works")
+        return True
+    except Exception as e:
+        print(f"✗ Request scheduler failed: {e}")
+        return False
+
+def test_intent_router():
+    """Test that commands are recognised without the LLM and chat is passed on"""
+    try:
+        from mia_system import IntentRouter, KeywordAutomaton, MIA_System
+        automaton = KeywordAutomaton({"ab": "x", "abc": "y", "bc": "z"})
+        assert list(automaton.find("abc bc")) == [(0, "abc", "y"), (4, "bc", "z")]
+        router = IntentRouter()
+        assert router.route("Pomoč!") == ("help", 1.0)
+        assert router.route("Opiši to sliko")[0] == "image"
+        assert router.match("Ali lahko narediš sliko tega?") == "image"
+        assert router.route("Kakšno bo vreme jutri v Ljubljani?") is None
+        assert router.route("Rad bi se pogovoril o vremenu in jutrišnjem izletu") is None
+        assert router.stats()["passed_to_llm"] == 2
+        assert router.route("kaj je na sliki")[0] == "image"
+        # Ordinary chat that merely contains a command word goes to the LLM
+        for text in ("Kaj misliš o slikarstvu?", "Slikar Picasso", "Potrebujem pomočnika", "Kaj znaš kuhati?",
+                     "video igre so zabavne", "Kaj je novega?"):
+            assert router.route(text) is None, text
+        import tempfile
+        with tempfile.TemporaryDirectory() as directory:
+            mia = MIA_System(persist_session=False, data_dir=os.path.join(directory, "data"), cache_dir=directory, config_dir=directory)
+            assert mia.dispatch_intent("help") == mia.handle_help_request()
+            assert mia.llm_calls_avoided == 1
+            mia.security.privacy_controls.update_settings({"video_recording": False})
+            mia.audio_video.capture_video = lambda: (_ for _ in ()).throw(AssertionError("camera used"))
+            assert mia.dispatch_intent("opiši sliko") == mia.CAMERA_DISABLED
+            assert mia.dispatch_intent("video") == mia.CAMERA_DISABLED
+        print("✓ Intent router works")
+        return True
+    except Exception as e:
+        print(f"✗ Intent router failed: {e}")
+        return False
+
+def test_session_journal():
+    """Test that a session resumes from its snapshot and journal tail"""
+    try:
+        import tempfile
+        import threading
+        import time
+        from mia_system import MIA_System
+        with tempfile.TemporaryDirectory() as directory:
+            mia = MIA_System(data_dir=os.path.join(directory, "data"), cache_dir=directory, config_dir=directory)
+            mia.journal.snapshot_every = 3
+            for i in range(5):
+                mia.conversation.conversation_history.append(f"vprašanje {i}", f"odgovor {i}")
+            mia._after_exchange("vprašanje 4", "odgovor 4")
+            mia.memory.store_preference("ime", "Ana")
+            mia.security.privacy_controls.update_settings({"voice_recording": False})
+            mia.stop_conversation()
+            assert not mia.memory.store.worker.is_alive() and mia.memory.store.vectors is None
+            
+            resumed = MIA_System(data_dir=os.path.join(directory, "data"), cache_dir=directory, config_dir=directory)
+            history = resumed.conversation.conversation_history
+            assert len(history) == 5 and history[4].response == "odgovor 4"
+            assert resumed.context.conversation_context["last_input"] == "vprašanje 4"
+            assert resumed.memory.recall_preference("ime") == "Ana"
+            assert resumed.security.privacy_controls.privacy_settings["voice_recording"] is False
+            resumed.journal.close()
+            
+            # Snapshots racing with appends must not replay a turn twice
+            directory = os.path.join(directory, "race")
+            mia = MIA_System(data_dir=os.path.join(directory, "data"), cache_dir=directory, config_dir=directory)
+            record = mia.journal.record
+            def slow_record(kind, data):
+                time.sleep(0.001)
+                record(kind, data)
+            mia.journal.record = slow_record
+            done = threading.Event()
+            def snapshots():
+                while not done.wait(0.002):
+                    mia.journal.snapshot()
+            snapshotter = threading.Thread(target=snapshots)
+            snapshotter.start()
+            for i in range(200):
+                mia.conversation.conversation_history.append(f"vprašanje {i}", f"odgovor {i}")
+            done.set()
+            snapshotter.join()
+            mia.journal.close()
+            resumed = MIA_System(data_dir=os.path.join(directory, "data"), cache_dir=directory, config_dir=directory)
+            users = [turn.user for turn in resumed.conversation.conversation_history]
+            assert users == [f"vprašanje {i}" for i in range(200)], f"{len(users)} turns replayed"
+            resumed.journal.close()
+        print("✓ Session journal works")
+        return True
+    except Exception as e:
+        print(f"✗ Session journal failed: {e}")
+        return False
+
+def test_encryption():
+    """Test authenticated at-rest encryption, streaming and encrypted session storage"""
+    try:
+        import tempfile
+        from mia_system import Encryption, SessionJournal, MemoryStore, ENCRYPTION_MAGIC
+        with tempfile.TemporaryDirectory() as directory:
+            encryption = Encryption(key_path=os.path.join(directory, "master.key"), chunk_size=1024)
+            data = os.urandom(5000)
+            sealed = encryption.encrypt(data, "audio")
+            assert encryption.decrypt(sealed, "audio") == data
+            pieces = [data[i:i + 300] for i in range(0, len(data), 300)]
+            streamed = b"".join(encryption.encrypt_stream(pieces, "audio"))
+            assert len(streamed) == len(sealed) and encryption.decrypt(streamed, "audio") == data
+            assert b"".join(encryption.decrypt_stream([sealed[i:i + 700] for i in range(0, len(sealed), 700)], "audio")) == data
+            assert encryption.cipher("audio") is encryption.cipher("audio")
+            tampered = bytearray(sealed)
+            tampered[100] ^= 1
+            for bad in (bytes(tampered), sealed[:-1], sealed[:16 + 1040]):
+                try:
+                    encryption.decrypt(bad, "audio")
+                    assert False, "tampered data was accepted"
+                except ValueError:
+                    pass
+            try:
+                encryption.decrypt(sealed, "memory")
+                assert False, "wrong context was accepted"
+            except ValueError:
+                pass
+            
+            journal = SessionJournal(os.path.join(directory, "session"), encryption=encryption)
+            journal.capture = lambda: {"history": {"turns": [], "spilled": 0}}
+            journal.start()
+            journal.record("turn", {"user": "skrivnost", "response": "odgovor"})
+            journal.close()
+            with open(journal.journal_path, "rb") as f:
+                assert b"skrivnost" not in f.read()
+            records = SessionJournal(journal.directory, encryption=encryption).load()[1]
+            assert records[0]["user"] == "skrivnost"
+            journal.start()
+            journal.snapshot()
+            journal.close()
+            with open(journal.snapshot_path, "rb") as f:
+                assert f.read().startswith(ENCRYPTION_MAGIC)
+            assert SessionJournal(journal.directory, encryption=encryption).load()[0]["seq"] == 1
+            
+            store = MemoryStore(directory=os.path.join(directory, "memory"), encryption=encryption)
+            store.embedding_enabled = False
+            memory_id = store.add("skrivnost", "odgovor")
+            row = store.db.execute("SELECT user FROM memories WHERE id = ?", (memory_id,)).fetchone()
+            assert isinstance(row[0], bytes) and store._open(row[0]) == "skrivnost"
+            store.close()
+            # Sealed rows without the key (or with another key) are skipped, not fatal
+            other = Encryption(key_path=os.path.join(directory, "other.key"))
+            for key in (None, other):
+                reopened = MemoryStore(directory=store.directory, encryption=key)
+                assert reopened.pending.empty() and reopened._open(row[0]) is None
+                reopened.close()
+            
+            # The key is kept out of the data directory, and an old key next to the data is moved
+            import logging
+            from mia_system import MIA_System
+            warnings = []
+            handler = logging.Handler(logging.WARNING)
+            handler.emit = warnings.append
+            logging.getLogger("MIA_for_All").addHandler(handler)
+            try:
+                MIA_System(persist_session=False, data_dir=os.path.join(directory, "data"), cache_dir=directory,
+                           config_dir=os.path.join(directory, "config"))
+                assert os.path.exists(os.path.join(directory, "config", "master.key")) and not warnings
+                shared = os.path.join(directory, "shared")
+                MIA_System(persist_session=False, data_dir=shared, cache_dir=directory, config_dir=shared)
+                assert any("MIA_PASSPHRASE" in record.getMessage() for record in warnings)
+            finally:
+                logging.getLogger("MIA_for_All").removeHandler(handler)
+            home = os.environ.get("HOME")
+            os.environ["HOME"] = directory
+            try:
+                legacy = os.path.join(directory, ".local", "share", "mia", "master.key")
+                os.makedirs(os.path.dirname(legacy))
+                with open(legacy, "wb") as f:
+                    f.write(b"k" * 32)
+                moved = Encryption()
+                assert moved.key_path == os.path.join(directory, ".config", "mia", "master.key")
+                assert moved.master_key == b"k" * 32 and not os.path.exists(legacy)
+            finally:
+                os.environ["HOME"] = home
+        print("✓ Encryption works")
+        return True
+    except Exception as e:
+        print(f"✗ Encryption failed: {e}")
+        return False
+
+def test_server():
+    """Test the HTTP/WebSocket server against the fake Ollama, with concurrent sessions"""
+    try:
+        import asyncio
+        import time
+        from aiohttp.test_utils import TestServer, TestClient
+        from benchmark_mia import FakeOllamaServer, FAKE_RESPONSE
+        from mia_server import AsyncConversationEngine, create_app
+        
+        async def run(url):
+            engine = AsyncConversationEngine(url, max_concurrency=4)
+            client = TestClient(TestServer(create_app(engine)))
+            await client.start_server()
+            try:
+                session_ids = [(await (await client.post("/sessions")).json())["session_id"] for _ in range(6)]
+                
+                async def turn(session_id, text):
+                    response = await client.post(f"/sessions/{session_id}/turns", json={"text": text})
+                    assert response.status == 200
+                    return (await response.json())["response"]
+                
+                replies = await asyncio.gather(*(turn(session_id, "Živjo") for session_id in session_ids))
+                assert [reply.strip() for reply in replies] == [FAKE_RESPONSE] * len(session_ids)
+                assert all(len(engine.sessions[sid].conversation.conversation_history) == 1 for sid in session_ids)
+                assert 1 < engine.client.stats()["peak_in_flight"] <= 4
+                assert (await client.post(f"/sessions/{session_ids[0]}/turns", json={})).status == 400
+                # Sessions only come from POST /sessions
+                assert (await client.post("/sessions/missing/turns", json={"text": "Živjo"})).status == 404
+                assert (await client.get("/ws?session_id=missing")).status == 404
+                assert len(engine.sessions) == len(session_ids)
+                
+                # Building a prompt blocks in its own thread, not the event loop
+                slow = engine.sessions[session_ids[1]].conversation
+                prepare = slow.prepare_turn
+                slow.prepare_turn = lambda user_input: (time.sleep(0.5), prepare(user_input))[1]
+                slow_turn = asyncio.ensure_future(turn(session_ids[1], "Živjo"))
+                await asyncio.sleep(0.05)
+                start = time.monotonic()
+                assert (await client.get("/health")).status == 200
+                assert time.monotonic() - start < 0.3
+                await slow_turn
+                del slow.prepare_turn
+                
+                ws = await client.ws_connect(f"/ws?session_id={session_ids[0]}")
+                assert (await ws.receive_json())["session_id"] == session_ids[0]
+                await ws.send_json({"text": "Kako si?"})
+                messages = []
+                while not messages or messages[-1]["type"] != "done":
+                    messages.append(await ws.receive_json())
+                await ws.close()
+                assert any(message["type"] == "sentence" for message in messages)
+                assert len(engine.sessions[session_ids[0]].conversation.conversation_history) == 2
+                
+                health = await (await client.get("/health")).json()
+                assert health["status"] == "ok" and health["turns"] == len(session_ids) + 2
+            finally:
+                await client.close()
+        
+        with FakeOllamaServer(first_token_delay=0.05, token_delay=0.001) as server:
+            asyncio.run(run(server.url))
+        print("✓ Server works")
+        return True
+    except Exception as e:
+        print(f"✗ Server failed: {e!r}")
+        return False
+
+def test_e2e_benchmark():
+    """Test a short end-to-end benchmark run and the baseline comparison"""
+    try:
+        from benchmark_mia import benchmark_e2e, compare_results
+        result = benchmark_e2e(turns=2, first_token_delay=0.01, token_delay=0.001, vision_every=2)
+        assert result["turns"] == 5 and result["turn_p99_ms"] >= result["turn_p50_ms"] > 0
+        assert result["ttft_p50_ms"] > 0 and result["ttfa_p50_ms"] > 0
+        baseline = {"e2e": result}
+        assert compare_results(baseline, baseline) == []
+        slower = {"e2e": {**result, "turn_p95_ms": result["turn_p95_ms"] * 2, "turns_per_s": result["turns_per_s"] / 2}}
+        assert len(compare_results(baseline, slower)) == 2
+        print("✓ End-to-end benchmark works")
+        return True
+    except Exception as e:
+        print(f"✗ End-to-end benchmark failed: {e}")
+        return False
+
 if __name__ == "__main__":
     print("Testing MIA for All system...")
     
     success = True
     success &= test_imports()
     success &= test_basic_functionality()
+    success &= test_sentence_splitter()
+    success &= test_voice_activity_detection()
+    success &= test_streaming_stt()
+    success &= test_in_memory_audio_device()
+    success &= test_conversation_pipeline()
+    success &= test_context_token_budget()
+    success &= test_context_mode()
+    success &= test_conversation_history()
+    success &= test_memory_embeddings()
+    success &= test_memory_store()
+    success &= test_response_cache()
+    success &= test_tts_cache()
+    success &= test_warmup_prefix()
+    success &= test_model_router()
+    success &= test_text_only_startup()
+    success &= test_camera_capture()
+    success &= test_video_analysis()
+    success &= test_frame_encoder()
+    success &= test_metrics()
+    success &= test_e2e_benchmark()
+    success &= test_server()
+    success &= test_request_scheduler()
+    success &= test_intent_router()
+    success &= test_session_journal()
+    success &= test_encryption()
     
     if success:
         print("\n✓ All tests passed!")